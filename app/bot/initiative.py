@@ -2,12 +2,47 @@ import logging
 
 import discord
 
+from app.bot.pinned import pinned_trackers
+from app.constants import DISCORD_MESSAGE_LIMIT
 from app.controllers import initiative
-from app.errors import AlreadyExistsError, BacktrackError, NotFoundError
+from app.controllers.queue import channel_queue
+from app.errors import (
+    AlreadyExistsError,
+    BacktrackError,
+    NotFoundError,
+    NothingToUndoError,
+    UndoUnsupportedError,
+)
 
 log = logging.getLogger(__name__)
 
 
+def parse_participants(text: str) -> list[initiative.Participant]:
+    """Parses a comma-separated list of `name:init` or `name:init:tiebreaker` entries."""
+    participants = []
+    for entry in text.split(","):
+        name, *values = (part.strip() for part in entry.split(":"))
+        if not name or len(values) not in (1, 2):
+            raise ValueError(f"Cannot parse participant {entry!r}")
+        participants.append(initiative.Participant(name, *(int(v) for v in values)))
+    return participants
+
+
+async def respond_with(ctx, tracker: initiative.InitiativeTracker):
+    """Shows a tracker in its pinned message if it has one, or else in a reply."""
+    if tracker.message_id is None:
+        await ctx.respond(tracker.render(DISCORD_MESSAGE_LIMIT))
+        return
+    message = ctx.channel.get_partial_message(int(tracker.message_id))
+    pinned_trackers.show(message, tracker)
+    await ctx.respond("Updated the tracker!", ephemeral=True)
+
+
+async def participant_names(ctx: discord.AutocompleteContext) -> list[str]:
+    """Suggests the names of the channel's participants, as they are typed."""
+    return initiative.complete_participant(ctx.interaction.channel_id, ctx.value or "")
+
+
 def add_init_commands(bot: discord.Bot):
     log.info("Adding initiative commands")
     init_commands = bot.create_group("init", "commands relating to initiative")
@@ -15,20 +50,32 @@ def add_init_commands(bot: discord.Bot):
     @init_commands.command()
     async def start(ctx):
         try:
-            tracker = await initiative.create_initiative(ctx.channel.id)
+            tracker = await channel_queue.run(
+                ctx.channel.id, initiative.create_initiative
+            )
         except AlreadyExistsError:
             await ctx.respond("Initiative tracker already exists!")
         else:
-            await ctx.respond(str(tracker))
+            await ctx.respond(tracker.render(DISCORD_MESSAGE_LIMIT))
 
     @init_commands.command()
     async def end(ctx):
         try:
-            await initiative.delete_initiative(ctx.channel.id)
+            tracker = await initiative.get_initiative(ctx.channel.id)
+            await channel_queue.run(ctx.channel.id, initiative.delete_initiative)
         except NotFoundError:
             await ctx.respond("No initiative tracker found!")
-        else:
-            await ctx.respond("Initiative tracker ended!")
+            return
+
+        pinned_trackers.forget(ctx.channel.id)
+        if tracker.message_id is not None:
+            message = ctx.channel.get_partial_message(int(tracker.message_id))
+            try:
+                await message.edit(content="Initiative tracker ended!")
+                await message.unpin()
+            except discord.HTTPException as e:
+                log.warning(f"Could not unpin tracker in channel {ctx.channel.id}: {e!r}")
+        await ctx.respond("Initiative tracker ended!")
 
     @init_commands.command()
     async def show(ctx):
@@ -37,12 +84,49 @@ def add_init_commands(bot: discord.Bot):
         except NotFoundError:
             await ctx.respond("No initiative tracker found!")
         else:
-            await ctx.respond(str(tracker))
+            await ctx.respond(tracker.render(DISCORD_MESSAGE_LIMIT))
+
+    @init_commands.command()
+    async def pin(ctx):
+        try:
+            tracker = await initiative.get_initiative(ctx.channel.id)
+        except NotFoundError:
+            await ctx.respond("No initiative tracker found!")
+            return
+
+        message = await ctx.channel.send(tracker.render(DISCORD_MESSAGE_LIMIT))
+        try:
+            await message.pin()
+            if tracker.message_id is not None:
+                await ctx.channel.get_partial_message(int(tracker.message_id)).unpin()
+        except discord.HTTPException as e:
+            # without Manage Messages it is still kept up to date, just not pinned
+            log.warning(f"Could not pin tracker in channel {ctx.channel.id}: {e!r}")
+        await channel_queue.run(ctx.channel.id, initiative.set_message, message.id)
+        await ctx.respond("The tracker will be kept up to date here!", ephemeral=True)
+
+    @init_commands.command()
+    async def unpin(ctx):
+        try:
+            tracker = await initiative.get_initiative(ctx.channel.id)
+            await channel_queue.run(ctx.channel.id, initiative.set_message, None)
+        except NotFoundError:
+            await ctx.respond("No initiative tracker found!")
+            return
+
+        if tracker.message_id is not None:
+            try:
+                await ctx.channel.get_partial_message(int(tracker.message_id)).unpin()
+            except discord.HTTPException as e:
+                log.warning(f"Could not unpin tracker in channel {ctx.channel.id}: {e!r}")
+        await ctx.respond("The tracker will be shown after each command again!")
 
     @init_commands.command()
     async def add(ctx, player: str, init_value: int, tiebreaker: int = 0):
         try:
-            tracker = await initiative.add_participant(ctx.channel.id, player, init_value)
+            tracker = await channel_queue.run(
+                ctx.channel.id, initiative.add_participant, player, init_value
+            )
         except NotFoundError:
             await ctx.respond("No initiative tracker found!")
         except AlreadyExistsError:
@@ -50,55 +134,131 @@ def add_init_commands(bot: discord.Bot):
                 f"{player} is alrerady in this initiative! (use `update` to change their init value))"
             )
         else:
-            await ctx.respond(str(tracker))
+            await respond_with(ctx, tracker)
+
+    @init_commands.command(name="add-many")
+    async def add_many(ctx, participants: str):
+        try:
+            new_participants = parse_participants(participants)
+        except ValueError:
+            await ctx.respond(
+                "List participants as `name:init` or `name:init:tiebreaker`, separated by commas!",
+                ephemeral=True,
+            )
+            return
+
+        try:
+            tracker = await channel_queue.run(
+                ctx.channel.id, initiative.add_participants, new_participants
+            )
+        except NotFoundError:
+            await ctx.respond("No initiative tracker found!")
+        except AlreadyExistsError:
+            await ctx.respond(
+                "Someone in that list is already in this initiative! (use `update` to change their init value)"
+            )
+        else:
+            await respond_with(ctx, tracker)
 
     @init_commands.command()
-    async def remove(ctx, player: str):
+    async def remove(ctx, player: discord.Option(str, autocomplete=participant_names)):
         try:
-            tracker = await initiative.remove_participant(ctx.channel.id, player)
+            tracker = await channel_queue.run(
+                ctx.channel.id, initiative.remove_participant, player
+            )
         except NotFoundError:
             await ctx.respond(f"{player} does not exist in this initiative!")
         else:
-            await ctx.respond(str(tracker))
+            await respond_with(ctx, tracker)
 
     @init_commands.command()
-    async def update(ctx, player: str, init_value: int, tiebreaker: int = 0):
+    async def update(
+        ctx,
+        player: discord.Option(str, autocomplete=participant_names),
+        init_value: int,
+        tiebreaker: int = 0,
+    ):
         try:
-            tracker = await initiative.update_participant(
-                ctx.channel.id, player, init_value
+            tracker = await channel_queue.run(
+                ctx.channel.id, initiative.update_participant, player, init_value
             )
         except NotFoundError:
             await ctx.respond(f"{player} does not exist in this initiative!")
         else:
-            await ctx.respond(str(tracker))
+            await respond_with(ctx, tracker)
 
     @init_commands.command()
-    async def next(ctx):
+    async def next(ctx, steps: discord.Option(int, min_value=1, default=1)):
         try:
-            tracker = await initiative.next_participant(ctx.channel.id)
+            tracker = await channel_queue.move(ctx.channel.id, steps)
         except NotFoundError:
             await ctx.respond("No tracker found!")
         else:
-            await ctx.respond(str(tracker))
+            if tracker is None:
+                # merged into another player's press, which shows the tracker
+                await ctx.respond("Moved on!", ephemeral=True)
+                return
+            await respond_with(ctx, tracker)
 
     @init_commands.command()
-    async def back(ctx):
+    async def back(ctx, steps: discord.Option(int, min_value=1, default=1)):
+        try:
+            tracker = await channel_queue.move(ctx.channel.id, -steps)
+        except NotFoundError:
+            await ctx.respond("No tracker found!")
+        except BacktrackError:
+            await ctx.respond("Cannot go back any further!")
+        else:
+            if tracker is None:
+                await ctx.respond("Moved back!", ephemeral=True)
+                return
+            await respond_with(ctx, tracker)
+
+    @init_commands.command(name="round")
+    async def round_(ctx, to_round: discord.Option(int, min_value=1)):
         try:
-            tracker = await initiative.previous_participant(ctx.channel.id)
+            tracker = await channel_queue.run(
+                ctx.channel.id, initiative.goto_round, to_round
+            )
         except NotFoundError:
             await ctx.respond("No tracker found!")
         except BacktrackError:
             await ctx.respond("Cannot go back any further!")
         else:
-            await ctx.respond(str(tracker))
+            await respond_with(ctx, tracker)
 
     @init_commands.command()
-    async def goto(ctx, target_name: str) -> None:
+    async def goto(
+        ctx, target_name: discord.Option(str, autocomplete=participant_names)
+    ) -> None:
         try:
-            tracker = await initiative.goto_participant(ctx.channel.id, target_name)
+            tracker = await channel_queue.run(
+                ctx.channel.id, initiative.goto_participant, target_name
+            )
         except NotFoundError:
             await ctx.respond(f"{target_name} does not exist in this initiative!")
         else:
-            await ctx.respond(str(tracker))
+            await respond_with(ctx, tracker)
+
+    async def travel(ctx, command, steps: int, verb: str):
+        try:
+            tracker = await channel_queue.run(ctx.channel.id, command, steps)
+        except UndoUnsupportedError:
+            await ctx.respond(f"Changes can't be {verb} here!", ephemeral=True)
+        except NothingToUndoError as e:
+            await ctx.respond(str(e), ephemeral=True)
+        else:
+            if tracker is None:
+                await ctx.respond(f"{verb.capitalize()}! There's no tracker now.")
+                return
+            await respond_with(ctx, tracker)
+
+    @init_commands.command()
+    async def undo(ctx, steps: discord.Option(int, min_value=1, default=1)):
+        await travel(ctx, initiative.undo, steps, "undone")
+
+    @init_commands.command()
+    async def redo(ctx, steps: discord.Option(int, min_value=1, default=1)):
+        await travel(ctx, initiative.redo, steps, "redone")
 
     log.info("Initiative commands added!")
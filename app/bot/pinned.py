@@ -0,0 +1,75 @@
+import asyncio
+import contextvars
+import logging
+
+import discord
+
+from app.constants import DISCORD_MESSAGE_LIMIT, PINNED_EDIT_DELAY
+from app.controllers import initiative
+from app.controllers.queue import channel_queue
+from app.controllers.tracker import InitiativeTracker
+from app.errors import NotFoundError
+from app.metrics import Counter
+
+log = logging.getLogger(__name__)
+
+updates = Counter(
+    "pinned_tracker_updates_total", "Tracker changes shown in pinned tracker messages"
+)
+edits = Counter("pinned_tracker_edits_total", "Edits made to pinned tracker messages")
+
+
+class PinnedTrackers:
+    """Shows trackers in their pinned messages, editing each message in place.
+
+    Edits wait `delay` seconds before they are made, and every change to a channel's
+    tracker in that time, or while its last edit was being made, is shown by one edit.
+    """
+
+    def __init__(self, delay: float = PINNED_EDIT_DELAY):
+        self.delay = delay
+        # the latest change waiting to be shown, by channel
+        self._latest: dict[str, tuple[discord.PartialMessage, InitiativeTracker]] = {}
+        self._editors: dict[str, asyncio.Task] = {}
+
+    def show(self, message: discord.PartialMessage, tracker: InitiativeTracker):
+        """Schedules an edit of a tracker's pinned message to show it."""
+        channel_id = str(tracker.channel_id)
+        updates.inc()
+        self._latest[channel_id] = (message, tracker)
+        if channel_id not in self._editors:
+            # outlives the command that started it, so isn't counted as part of it
+            self._editors[channel_id] = asyncio.create_task(
+                self._edit(channel_id), context=contextvars.Context()
+            )
+
+    def forget(self, channel_id: str | int):
+        """Drops a channel's change waiting to be shown, as its tracker has ended."""
+        self._latest.pop(str(channel_id), None)
+
+    async def _edit(self, channel_id: str):
+        try:
+            while channel_id in self._latest:
+                await asyncio.sleep(self.delay)
+                message, tracker = self._latest.pop(channel_id)
+                edits.inc()
+                try:
+                    await message.edit(content=tracker.render(DISCORD_MESSAGE_LIMIT))
+                except discord.NotFound:
+                    log.info(
+                        f"Pinned tracker in channel {channel_id} is gone, forgetting it"
+                    )
+                    try:
+                        await channel_queue.run(channel_id, initiative.set_message, None)
+                    except NotFoundError:
+                        # the tracker ended meanwhile, and its message with it
+                        pass
+                except discord.HTTPException as e:
+                    log.warning(
+                        f"Could not edit pinned tracker in channel {channel_id}: {e!r}"
+                    )
+        finally:
+            del self._editors[channel_id]
+
+
+pinned_trackers = PinnedTrackers()
@@ -3,11 +3,34 @@ import logging
 import discord
 
 from app.bot.initiative import add_init_commands
-from app.constants import TESTING_SERVERS
-from app.models import database
+from app.constants import SHARD_COUNT, SHARD_IDS, TESTING_SERVERS
+from app.database import finish_command, start_command
+from app.errors import ConflictError, PoolExhaustedError
 
 log = logging.getLogger(__name__)
-bot = discord.Bot()
+# the launcher's workers each connect to their own share of the shards; as Discord sends
+# a guild's interactions down one shard, each channel's commands stay in one process
+bot = (
+    discord.AutoShardedBot(shard_ids=SHARD_IDS, shard_count=SHARD_COUNT)
+    if SHARD_IDS
+    else discord.Bot()
+)
+
+
+def shard_of(guild_id: int, shard_count: int) -> int:
+    """Returns the shard Discord sends a guild's events down."""
+    return (guild_id >> 22) % shard_count
+
+
+def on_own_shards(channel_id: str | int) -> bool:
+    """Returns whether a channel's commands come to this process.
+
+    Only known for the channels the bot has been told of, so once it's ready.
+    """
+    if not SHARD_IDS:
+        return True
+    guild = getattr(bot.get_channel(int(channel_id)), "guild", None)
+    return guild is not None and shard_of(guild.id, SHARD_COUNT) in SHARD_IDS
 
 
 @bot.command(guild_ids=TESTING_SERVERS, description="Pings the bot")
@@ -21,14 +44,25 @@ async def on_ready():
     log.info("MMW custodian running!")
 
 
-@bot.event
-async def on_connect():
-    await database.connect()
-    log.info("Connected to database!")
+@bot.before_invoke
+async def start_tracking(ctx):
+    start_command(ctx.command.qualified_name, ctx.channel.id)
+
+
+@bot.after_invoke
+async def finish_tracking(ctx):
+    finish_command()
 
 
 @bot.event
-async def on_disconnect():
-    await database.disconnect()
-    log.info("Disconnected from database!")
-    log.info("MMW custodian shutting down!")
+async def on_application_command_error(ctx, error):
+    if isinstance(error, discord.ApplicationCommandInvokeError) and isinstance(
+        error.original, ConflictError
+    ):
+        await ctx.respond("Too many changes at once! Please try again.")
+    elif isinstance(error, discord.ApplicationCommandInvokeError) and isinstance(
+        error.original, PoolExhaustedError
+    ):
+        await ctx.respond("I'm swamped right now! Please try again in a moment.")
+    else:
+        log.error(f"Error in command {ctx.command}", exc_info=error)
@@ -9,3 +9,69 @@ POSTGRES_HOST = os.getenv("POSTGRES_HOST", "localhost")
 POSTGRES_PORT = os.getenv("POSTGRES_PORT", 5432)
 POSTGRES_DB = os.environ["POSTGRES_DB"]
 DATABASE_URL = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
+
+# where trackers are kept: "postgres", "events" for Postgres as a log of every change,
+# which can be undone, "journal" for Postgres written behind a local journal, by a
+# single process, "sqlite" for a single process with no database server, or "memory" for
+# one that can lose them on restart
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "postgres")
+SQLITE_PATH = os.getenv("SQLITE_PATH", "custodian.sqlite3")
+JOURNAL_PATH = os.getenv("JOURNAL_PATH", "custodian.journal")
+# seconds between writing the journal's changes to Postgres
+JOURNAL_FLUSH_INTERVAL = float(os.getenv("JOURNAL_FLUSH_INTERVAL", 0.25))
+# flushes tried on starting, a flush interval apart, before giving up on the journal
+JOURNAL_REPLAY_ATTEMPTS = int(os.getenv("JOURNAL_REPLAY_ATTEMPTS", 40))
+# how many changes to each tracker can be undone, with the events storage
+UNDO_DEPTH = int(os.getenv("UNDO_DEPTH", 20))
+# the events storage snapshots each tracker every this many events, so that rebuilding
+# one never reads more than about this many
+EVENT_SNAPSHOT_INTERVAL = int(os.getenv("EVENT_SNAPSHOT_INTERVAL", 50))
+
+# connection pool settings, passed through to asyncpg.create_pool
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 2))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 10))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", 100))
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", 5))
+DB_MAX_INACTIVE_CONNECTION_LIFETIME = float(
+    os.getenv("DB_MAX_INACTIVE_CONNECTION_LIFETIME", 300)
+)
+# how long a command waits for a free connection before giving up; Discord gives up on
+# interactions that haven't been answered within 3 seconds
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", 2))
+# the pool lives as long as the process, and is checked every interval and rebuilt with
+# exponential backoff, in seconds, if a check fails
+DB_HEALTH_CHECK_INTERVAL = float(os.getenv("DB_HEALTH_CHECK_INTERVAL", 30))
+DB_HEALTH_CHECK_TIMEOUT = float(os.getenv("DB_HEALTH_CHECK_TIMEOUT", 5))
+DB_RECONNECT_BACKOFF = float(os.getenv("DB_RECONNECT_BACKOFF", 0.5))
+DB_RECONNECT_MAX_BACKOFF = float(os.getenv("DB_RECONNECT_MAX_BACKOFF", 30))
+
+TRACKER_CACHE_SIZE = int(os.getenv("TRACKER_CACHE_SIZE", 1024))
+TRACKER_CACHE_TTL = float(os.getenv("TRACKER_CACHE_TTL", 300))
+# trackers written within this many hours are loaded into the cache on start up
+TRACKER_WARM_START_HOURS = int(os.getenv("TRACKER_WARM_START_HOURS", 6))
+# characters; Discord rejects longer messages, so big trackers are shown in part
+DISCORD_MESSAGE_LIMIT = 2000
+# seconds that edits to pinned tracker messages wait, so a burst of commands is one edit
+PINNED_EDIT_DELAY = float(os.getenv("PINNED_EDIT_DELAY", 1))
+
+# commands that send more statements than this, or wait longer than this many seconds on
+# the database, are logged
+COMMAND_QUERY_BUDGET = int(os.getenv("COMMAND_QUERY_BUDGET", 3))
+COMMAND_DB_TIME_BUDGET = float(os.getenv("COMMAND_DB_TIME_BUDGET", 0.1))
+
+# serves /metrics and /healthz
+METRICS_PORT = int(os.getenv("METRICS_PORT", 80))
+
+# the Discord shards this process connects to, of SHARD_COUNT, as the launcher sets them
+# for each of its workers; unset, the process connects to every shard itself
+SHARD_IDS = [int(shard) for shard in os.getenv("SHARD_IDS", "").split(",") if shard]
+# unset, the launcher asks Discord how many shards the bot should have
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", 0)) or None
+# how many processes the launcher shares the shards between, each serving its metrics
+# and health on the next port after METRICS_PORT, which the launcher serves them all on
+WORKER_COUNT = int(os.getenv("WORKER_COUNT", os.cpu_count() or 1))
+# seconds; crashed workers are restarted after backing off exponentially from this, and
+# a worker that ran for WORKER_STABLE_SECONDS starts backing off from scratch
+WORKER_RESTART_BACKOFF = float(os.getenv("WORKER_RESTART_BACKOFF", 1))
+WORKER_RESTART_MAX_BACKOFF = float(os.getenv("WORKER_RESTART_MAX_BACKOFF", 60))
+WORKER_STABLE_SECONDS = float(os.getenv("WORKER_STABLE_SECONDS", 60))
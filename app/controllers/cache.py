@@ -0,0 +1,93 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Iterator
+
+from app.constants import TRACKER_CACHE_SIZE, TRACKER_CACHE_TTL
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        """Returns the fraction of lookups that were served from the cache."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class TrackerCache:
+    """An in-process, channel-keyed cache of initiative trackers.
+
+    Entries are evicted least-recently-used first once `max_size` is reached, and
+    expire `ttl` seconds after they were last written.
+    """
+
+    def __init__(
+        self,
+        max_size: int = TRACKER_CACHE_SIZE,
+        ttl: float = TRACKER_CACHE_TTL,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self._clock = clock
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, channel_id: str | int) -> bool:
+        return str(channel_id) in self._entries
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._entries))
+
+    def get(self, channel_id: str | int) -> Any | None:
+        """Returns the cached tracker for a channel, or None if it is missing or stale."""
+        key = str(channel_id)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats.misses += 1
+            return None
+
+        expires_at, tracker = entry
+        if expires_at <= self._clock():
+            del self._entries[key]
+            self.stats.evictions += 1
+            self.stats.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.stats.hits += 1
+        return tracker
+
+    def peek(self, channel_id: str | int) -> Any | None:
+        """Returns a channel's cached tracker, even if stale, without counting it."""
+        entry = self._entries.get(str(channel_id))
+        return None if entry is None else entry[1]
+
+    def put(self, channel_id: str | int, tracker: Any) -> None:
+        """Stores the latest state of a channel's tracker."""
+        key = str(channel_id)
+        self._entries[key] = (self._clock() + self.ttl, tracker)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+
+    def invalidate(self, channel_id: str | int) -> None:
+        """Drops a channel's tracker from the cache, if present."""
+        self._entries.pop(str(channel_id), None)
+
+    def clear(self) -> None:
+        """Drops every tracker from the cache."""
+        self._entries.clear()
+
+
+tracker_cache = TrackerCache()
@@ -1,145 +1,100 @@
 import logging
-from bisect import insort  # adds to a list in sorted order
-from dataclasses import dataclass, field
+from typing import Callable
 
-from asyncpg.exceptions import UniqueViolationError
 from databases import Database
 
-from app.errors import AlreadyExistsError, BacktrackError, NotFoundError
-from app.models import database
+from app.controllers.cache import TrackerCache, tracker_cache
+from app.controllers.tracker import InitiativeTracker, Participant
+from app.errors import AlreadyExistsError, BacktrackError
+from app.storage import Storage, as_storage, storage
 
-# TODO transactions
 log = logging.getLogger(__name__)
 
-
-@dataclass(frozen=True, order=True)
-class Participant:
-    name: str = field(compare=False)
-    initiative: int
-    tiebreaker: int = 0
-
-    def __str__(self):
-        if self.tiebreaker is None:
-            return f"{self.initiative}: {self.name}"
-        else:
-            return f"{self.initiative} ({self.tiebreaker}): {self.name}"
-
-    def as_dict(self):
-        return {self.initiative: self.name}
-
-    def is_before(self, other) -> bool:
-        """Returns True if this participant is before the other."""
-        if other is None:
-            return False
-
-        return self > other
-
-
-@dataclass(frozen=True)
-class InitiativeTracker:
-    id: int
-    channel_id: str | int
-    current_round: int
-    current_index: int
-    participants: tuple[Participant, ...] = field(default_factory=tuple)
-
-    def __post_init__(self):
-        """Sorts the participants by initiative and tiebreaker."""
-        sorted_participants = tuple(sorted(self.participants, reverse=True))
-
-        # need to do this weird assignment method b/c frozen=True
-        object.__setattr__(self, "participants", sorted_participants)
-
-    def __str__(self):
-        """Returns a string representation of the initiative tracker."""
-        if self.participants:
-            participant_list = "\n".join(
-                f"{p} {' <==' if p == self.current_participant else ''}"
-                for p in self.participants
-            )
-        else:
-            participant_list = "Nobody!\n"
-
-        return f"Round {self.current_round}\n Participants:\n {participant_list}"
-
-    def as_dict(self):
-        return {p.name: p.initiative for p in self.participants}
-
-    def find_participant(self, name: str) -> Participant | None:
-        """Finds a participant by name."""
-        for participant in self.participants:
-            if participant.name == name:
-                return participant
-        return None
-
-    @property
-    def current_participant(self) -> Participant | None:
-        """Returns the current participant."""
-        if len(self.participants) > 0:
-            return self.participants[self.current_index]
-        else:
-            return None
+# Every controller takes the storage to use as `database`, which may also be a Postgres
+# Database, for callers that only have one of those.
 
 
 async def create_initiative(
     channel_id: str | int,
     current_round: int = 1,
-    current_index=0,
-    database: Database = database,
+    database: Database | Storage = storage,
+    cache: TrackerCache = tracker_cache,
 ) -> InitiativeTracker:
     """Creates an initiative tracker."""
-    try:
-        await database.execute(
-            "INSERT INTO initiative_trackers (channel_id, current_round, current_index) VALUES (:channel_id, :current_round, :current_index)",
-            {
-                "channel_id": str(channel_id),
-                "current_round": current_round,
-                "current_index": current_index,
-            },
-        )
-    except UniqueViolationError:
-        raise AlreadyExistsError(
-            f"Initiative tracker for channel {channel_id} already exists!"
-        )
-
-    return await get_initiative(channel_id, database=database)
+    tracker = await as_storage(database).create_tracker(str(channel_id), current_round)
+    cache.put(channel_id, tracker)
+    return tracker
 
 
 async def get_initiative(
-    channel_id: str | int, database: Database = database
+    channel_id: str | int,
+    database: Database | Storage = storage,
+    cache: TrackerCache = tracker_cache,
 ) -> InitiativeTracker:
-    """Gets an initiative tracker."""
-    query = "SELECT * FROM initiative_trackers WHERE channel_id = :channel_id"
-    db_init = await database.fetch_one(query, {"channel_id": str(channel_id)})
-    if db_init is None:
-        raise NotFoundError(f"Initiative tracker for channel {channel_id} not found!")
-
-    db_participants = await database.fetch_all(
-        "SELECT * FROM initiative_members WHERE initiative_id = :initiative_id",
-        {"initiative_id": db_init["id"]},
-    )
-    final_participants = [
-        Participant(
-            name=p["player_name"],
-            initiative=p["init_value"],
-            tiebreaker=p["tiebreaker"],
-        )
-        for p in db_participants
-    ]
-    return InitiativeTracker(
-        id=db_init["id"],
-        channel_id=db_init["channel_id"],
-        current_round=db_init["current_round"],
-        current_index=db_init["current_index"],
-        participants=tuple(final_participants),
-    )
+    """Gets an initiative tracker, from the cache if possible."""
+    tracker = cache.get(channel_id)
+    if tracker is not None:
+        return tracker
+
+    tracker = await as_storage(database).get_tracker(str(channel_id))
+    cache.put(channel_id, tracker)
+    return tracker
+
+
+async def warm_cache(
+    hours: int,
+    database: Database | Storage = storage,
+    cache: TrackerCache = tracker_cache,
+    keep: Callable[[str], bool] | None = None,
+) -> int:
+    """Caches the trackers written in the last `hours`, and returns how many.
+
+    Only the channels `keep` returns True for are cached, if it's given, and those
+    already cached are left as they are, as commands may have changed them since.
+    """
+    loaded = 0
+    async for tracker in as_storage(database).recent_trackers(hours, cache.max_size):
+        if tracker.channel_id in cache or (keep and not keep(tracker.channel_id)):
+            continue
+        cache.put(tracker.channel_id, tracker)
+        loaded += 1
+    return loaded
+
+
+def complete_participant(
+    channel_id: str | int, prefix: str, cache: TrackerCache = tracker_cache
+) -> list[str]:
+    """Suggests the names of a channel's participants that start with `prefix`.
+
+    Only the cached tracker is looked at, however stale, so that suggesting names as
+    someone types never goes to the database.
+    """
+    tracker = cache.peek(channel_id)
+    if tracker is None:
+        return []
+    return tracker.complete_name(prefix)
+
+
+async def delete_initiative(
+    channel_id: str | int,
+    database: Database | Storage = storage,
+    cache: TrackerCache = tracker_cache,
+):
+    """Deletes an initiative tracker."""
+    cache.invalidate(channel_id)
+    await as_storage(database).delete_tracker(str(channel_id))
 
 
-async def delete_initiative(channel_id: str | int, database: Database = database):
-    """Deletes an initiative tracker."""
-    await database.execute(
-        "DELETE FROM initiative_trackers WHERE channel_id = :channel_id",
-        {"channel_id": str(channel_id)},
+async def set_message(
+    channel_id: str | int,
+    message_id: str | int | None,
+    database: Database | Storage = storage,
+    cache: TrackerCache = tracker_cache,
+):
+    """Sets the pinned message showing a tracker, or clears it if `message_id` is None."""
+    cache.invalidate(channel_id)
+    await as_storage(database).set_message(
+        str(channel_id), None if message_id is None else str(message_id)
     )
 
 
@@ -148,55 +103,48 @@ async def add_participant(
     player_name: str,
     initiative: int,
     tiebreaker: int = 0,
-    database: Database = database,
+    database: Database | Storage = storage,
+    cache: TrackerCache = tracker_cache,
 ) -> InitiativeTracker:
     """Adds a character to an initiative tracker."""
-    tracker = await get_initiative(channel_id, database=database)
-
     try:
-        await database.execute(
-            "INSERT INTO initiative_members (initiative_id, player_name, init_value, tiebreaker) VALUES (:initiative_id, :player_name, :init_value, :tiebreaker)",
-            {
-                "initiative_id": tracker.id,
-                "player_name": player_name,
-                "init_value": initiative,
-                "tiebreaker": tiebreaker,
-            },
+        return await add_participants(
+            channel_id,
+            [Participant(player_name, initiative, tiebreaker)],
+            database=database,
+            cache=cache,
         )
-    except UniqueViolationError:
+    except AlreadyExistsError as err:
         raise AlreadyExistsError(
             f"Participant {player_name} already exists in this initiative!"
-        )
+        ) from err
 
-    new_participant = Participant(
-        name=player_name, initiative=initiative, tiebreaker=tiebreaker
-    )
-    if new_participant.is_before(tracker.current_participant):
-        new_index = tracker.current_index + 1
-    else:
-        new_index = tracker.current_index
 
-    await database.execute(
-        "UPDATE initiative_trackers SET current_index = :new_index WHERE id = :id",
-        {"new_index": new_index, "id": tracker.id},
+async def add_participants(
+    channel_id: str | int,
+    participants: list[Participant],
+    database: Database | Storage = storage,
+    cache: TrackerCache = tracker_cache,
+) -> InitiativeTracker:
+    """Adds several characters to an initiative tracker at once."""
+    new_tracker = await as_storage(database).add_participants(
+        str(channel_id), participants
     )
-
-    new_tracker = await get_initiative(channel_id, database=database)
+    cache.put(channel_id, new_tracker)
     return new_tracker
 
 
 async def remove_participant(
-    channel_id: str | int, player_name: str, database: Database = database
+    channel_id: str | int,
+    player_name: str,
+    database: Database | Storage = storage,
+    cache: TrackerCache = tracker_cache,
 ) -> InitiativeTracker:
     """Removes a character from an initiative tracker."""
-    tracker = await get_initiative(channel_id, database=database)
-
-    await database.execute(
-        "DELETE FROM initiative_members WHERE initiative_id = :initiative_id AND player_name = :player_name",
-        {"initiative_id": tracker.id, "player_name": player_name},
+    new_tracker = await as_storage(database).remove_participant(
+        str(channel_id), player_name
     )
-
-    new_tracker = await get_initiative(channel_id, database=database)
+    cache.put(channel_id, new_tracker)
     return new_tracker
 
 
@@ -205,96 +153,114 @@ async def update_participant(
     player_name: str,
     initiative: int,
     tiebreaker: int = 0,
-    database: Database = database,
+    database: Database | Storage = storage,
+    cache: TrackerCache = tracker_cache,
 ) -> InitiativeTracker:
     """Updates a character in an initiative tracker."""
-    tracker = await get_initiative(channel_id, database=database)
-
-    await database.execute(
-        "UPDATE initiative_members SET init_value = :init_value, tiebreaker = :tiebreaker WHERE initiative_id = :initiative_id AND player_name = :player_name",
-        {
-            "initiative_id": tracker.id,
-            "player_name": player_name,
-            "init_value": initiative,
-            "tiebreaker": tiebreaker,
-        },
+    updated_tracker = await as_storage(database).update_participant(
+        str(channel_id), player_name, initiative, tiebreaker
     )
+    cache.put(channel_id, updated_tracker)
+    return updated_tracker
+
 
-    updated_tracker = await get_initiative(channel_id, database=database)
+async def _move(
+    channel_id: str | int, steps: int, database: Database | Storage, cache: TrackerCache
+) -> InitiativeTracker:
+    """Moves the current participant `steps` places, wrapping around between rounds."""
+    updated_tracker = await as_storage(database).move(str(channel_id), steps)
+    cache.put(channel_id, updated_tracker)
     return updated_tracker
 
 
 async def next_participant(
     channel_id: str | int,
-    database: Database = database,
+    steps: int = 1,
+    database: Database | Storage = storage,
+    cache: TrackerCache = tracker_cache,
 ) -> InitiativeTracker:
-    """Moves to the next participant in an initiative tracker."""
-    tracker = await get_initiative(channel_id, database=database)
-    next_index = (tracker.current_index + 1) % len(tracker.participants)
-
-    await database.execute(
-        "UPDATE initiative_trackers SET current_index = :current_index, current_round = :current_round WHERE id = :id",
-        {
-            "current_index": next_index,
-            "current_round": (
-                # if we've wrapped around, increment the round
-                tracker.current_round + 1
-                if tracker.current_index > next_index
-                else tracker.current_round
-            ),
-            "id": tracker.id,
-        },
-    )
-
-    updated_tracker = await get_initiative(channel_id, database=database)
-    return updated_tracker
+    """Moves `steps` participants forward in an initiative tracker."""
+    if steps < 1:
+        raise ValueError("Can only move forward by a positive number of steps")
+    return await _move(channel_id, steps, database=database, cache=cache)
 
 
 async def previous_participant(
-    channel_id: str | int, database: Database = database
+    channel_id: str | int,
+    steps: int = 1,
+    database: Database | Storage = storage,
+    cache: TrackerCache = tracker_cache,
 ) -> InitiativeTracker:
-    """Moves to the previous participant in an initiative tracker."""
-    tracker = await get_initiative(channel_id, database=database)
-    previous_index = (tracker.current_index - 1) % len(tracker.participants)
-    previous_round = (
-        tracker.current_round - 1
-        if tracker.current_index < previous_index
-        else tracker.current_round
-    )
-    if previous_round < 1:
-        raise BacktrackError("Cannot go back before round 1")
+    """Moves `steps` participants back in an initiative tracker."""
+    if steps < 1:
+        raise ValueError("Can only move back by a positive number of steps")
+    return await _move(channel_id, -steps, database=database, cache=cache)
 
-    await database.execute(
-        "UPDATE initiative_trackers SET current_index = :current_index, current_round = :current_round WHERE id = :id",
-        {
-            "current_index": previous_index,
-            "current_round": (
-                # if we've wrapped backwards, decrement the round
-                tracker.current_round - 1
-                if tracker.current_index < previous_index
-                else tracker.current_round
-            ),
-            "id": tracker.id,
-        },
-    )
 
-    updated_tracker = await get_initiative(channel_id, database=database)
+async def goto_round(
+    channel_id: str | int,
+    to_round: int,
+    database: Database | Storage = storage,
+    cache: TrackerCache = tracker_cache,
+) -> InitiativeTracker:
+    """Moves to the first participant of a specific round in an initiative tracker."""
+    if to_round < 1:
+        raise BacktrackError("Cannot go back before round 1")
+
+    updated_tracker = await as_storage(database).goto_round(str(channel_id), to_round)
+    cache.put(channel_id, updated_tracker)
     return updated_tracker
 
 
 async def goto_participant(
-    channel_id: str | int, target_name: str, database: Database = database
+    channel_id: str | int,
+    target_name: str,
+    database: Database | Storage = storage,
+    cache: TrackerCache = tracker_cache,
 ) -> InitiativeTracker:
     """Moves to a specific participant in an initiative tracker."""
-    tracker = await get_initiative(channel_id, database=database)
-    target = tracker.find_participant(target_name)
-    if target is None:
-        raise NotFoundError(f"Participant {target_name} not found in this initiative!")
-
-    await database.execute(
-        "UPDATE initiative_trackers SET current_index = :current_index WHERE id = :id",
-        {"current_index": tracker.participants.index(target), "id": tracker.id},
+    updated_tracker = await as_storage(database).goto_participant(
+        str(channel_id), target_name
     )
-
-    updated_tracker = await get_initiative(channel_id, database=database)
+    cache.put(channel_id, updated_tracker)
     return updated_tracker
+
+
+def _cache_travel(
+    channel_id: str | int, tracker: InitiativeTracker | None, cache: TrackerCache
+) -> InitiativeTracker | None:
+    """Caches where undoing or redoing left a channel, which may be without a tracker."""
+    if tracker is None:
+        cache.invalidate(channel_id)
+    else:
+        cache.put(channel_id, tracker)
+    return tracker
+
+
+async def undo(
+    channel_id: str | int,
+    steps: int = 1,
+    database: Database | Storage = storage,
+    cache: TrackerCache = tracker_cache,
+) -> InitiativeTracker | None:
+    """Undoes the last `steps` changes to a channel's tracker, whatever they were.
+
+    Returns None if that goes back to before the tracker was started.
+    """
+    if steps < 1:
+        raise ValueError("Can only undo a positive number of changes")
+    tracker = await as_storage(database).undo(str(channel_id), steps)
+    return _cache_travel(channel_id, tracker, cache)
+
+
+async def redo(
+    channel_id: str | int,
+    steps: int = 1,
+    database: Database | Storage = storage,
+    cache: TrackerCache = tracker_cache,
+) -> InitiativeTracker | None:
+    """Redoes the last `steps` changes undone in a channel's tracker."""
+    if steps < 1:
+        raise ValueError("Can only redo a positive number of changes")
+    tracker = await as_storage(database).redo(str(channel_id), steps)
+    return _cache_travel(channel_id, tracker, cache)
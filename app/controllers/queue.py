@@ -0,0 +1,151 @@
+import asyncio
+import contextvars
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Any, Awaitable, Callable
+
+from app.controllers import initiative
+from app.errors import BacktrackError
+
+log = logging.getLogger(__name__)
+
+
+async def move_participant(channel_id: str | int, steps: int, **options):
+    """Moves `steps` participants forwards, or backwards if `steps` is negative."""
+    if steps > 0:
+        return await initiative.next_participant(channel_id, steps=steps, **options)
+    return await initiative.previous_participant(channel_id, steps=-steps, **options)
+
+
+@dataclass
+class _Command:
+    future: asyncio.Future
+    call: Callable[[], Awaitable[Any]] | None = None
+    # non-zero for navigation commands, which can be merged with their neighbours
+    steps: int = 0
+    options: dict = field(default_factory=dict)
+    # the queuer's context, so the command's work is tagged as theirs, not the worker's
+    context: contextvars.Context = field(default_factory=contextvars.copy_context)
+
+    def run(self, func: Callable[..., Awaitable[Any]], *args, **kwargs) -> asyncio.Task:
+        """Runs `func` in the context the command was queued from."""
+        return asyncio.create_task(func(*args, **kwargs), context=self.context)
+
+    def can_merge(self, other: "_Command") -> bool:
+        """Returns True if the other command moves the same way with the same options."""
+        return (
+            other.steps != 0
+            and (self.steps > 0) == (other.steps > 0)
+            and self.options == other.options
+        )
+
+
+def _settle(future: asyncio.Future, result: Any = None, error: Exception | None = None):
+    # the caller may have given up waiting, e.g. if the interaction timed out
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+class ChannelQueue:
+    """Runs the commands for each channel one at a time, in the order they arrived.
+
+    Navigation commands that pile up behind a running command are merged, so a burst of
+    N `next`s becomes a single move of N steps: one database write and one result. The
+    first command of a merged burst gets the tracker; the rest get None.
+    """
+
+    def __init__(self, mover: Callable[..., Awaitable[Any]] = move_participant):
+        self.merged = 0
+        self._mover = mover
+        self._pending: dict[str, deque[_Command]] = {}
+        self._workers: dict[str, asyncio.Task] = {}
+
+    async def run(
+        self, channel_id: str | int, func: Callable[..., Awaitable[Any]], *args, **kwargs
+    ):
+        """Queues `func(channel_id, *args, **kwargs)` behind the channel's other commands."""
+        command = _Command(
+            asyncio.get_running_loop().create_future(),
+            call=partial(func, channel_id, *args, **kwargs),
+        )
+        return await self._enqueue(channel_id, command)
+
+    async def move(self, channel_id: str | int, steps: int, **options):
+        """Queues a move of `steps` participants, merging it with any queued moves."""
+        if steps == 0:
+            raise ValueError("Cannot move by zero steps")
+
+        command = _Command(
+            asyncio.get_running_loop().create_future(), steps=steps, options=options
+        )
+        return await self._enqueue(channel_id, command)
+
+    def _enqueue(self, channel_id: str | int, command: _Command) -> asyncio.Future:
+        key = str(channel_id)
+        self._pending.setdefault(key, deque()).append(command)
+        if key not in self._workers:
+            self._workers[key] = asyncio.create_task(self._work(channel_id))
+        return command.future
+
+    async def _work(self, channel_id: str | int):
+        key = str(channel_id)
+        pending = self._pending[key]
+        try:
+            while pending:
+                batch = [pending.popleft()]
+                if batch[0].steps:
+                    while pending and batch[0].can_merge(pending[0]):
+                        batch.append(pending.popleft())
+                await self._execute(channel_id, batch)
+        finally:
+            # nothing awaits between the last empty check and here, so nothing is lost
+            del self._pending[key]
+            del self._workers[key]
+
+    async def _execute(self, channel_id: str | int, batch: list[_Command]):
+        lead = batch[0]
+        if not lead.steps:
+            try:
+                _settle(lead.future, await lead.run(lead.call))
+            except Exception as e:
+                _settle(lead.future, error=e)
+            return
+
+        try:
+            tracker = await lead.run(
+                self._mover, channel_id, sum(c.steps for c in batch), **lead.options
+            )
+        except BacktrackError as e:
+            if len(batch) == 1:
+                _settle(lead.future, error=e)
+                return
+            # some of the merged moves may still fit before round 1, so go one at a time
+            for command in batch:
+                try:
+                    _settle(
+                        command.future,
+                        await command.run(
+                            self._mover, channel_id, command.steps, **command.options
+                        ),
+                    )
+                except Exception as e:
+                    _settle(command.future, error=e)
+        except Exception as e:
+            for command in batch:
+                _settle(command.future, error=e)
+        else:
+            if len(batch) > 1:
+                self.merged += len(batch) - 1
+                log.debug(f"Merged {len(batch)} moves in channel {channel_id}")
+            _settle(lead.future, tracker)
+            for command in batch[1:]:
+                _settle(command.future, None)
+
+
+channel_queue = ChannelQueue()
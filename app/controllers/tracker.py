@@ -0,0 +1,201 @@
+from bisect import bisect_left
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+from app.constants import TRACKER_CACHE_SIZE
+
+
+@dataclass(frozen=True, order=True, slots=True)
+class Participant:
+    name: str = field(compare=False)
+    initiative: int
+    tiebreaker: int = 0
+    # the member row, for participants that have been saved
+    id: int | None = field(default=None, compare=False)
+
+    def __str__(self):
+        if self.tiebreaker is None:
+            return f"{self.initiative}: {self.name}"
+        else:
+            return f"{self.initiative} ({self.tiebreaker}): {self.name}"
+
+    def as_dict(self):
+        return {self.initiative: self.name}
+
+    def is_before(self, other) -> bool:
+        """Returns True if this participant is before the other."""
+        if other is None:
+            return False
+
+        return self > other
+
+
+@dataclass(frozen=True, slots=True)
+class InitiativeTracker:
+    id: int
+    channel_id: str | int
+    current_round: int
+    current_member_id: int | None = None
+    version: int = 0
+    # the pinned message that shows the tracker, if it has one
+    message_id: str | None = None
+    # already in turn order; the storage sorts them so we don't have to
+    participants: tuple[Participant, ...] = field(default_factory=tuple)
+    # built once from the participants, which never change after construction
+    current_index: int = field(init=False, compare=False)
+    _names: tuple[str, ...] = field(init=False, repr=False, compare=False)
+    _ids: tuple[int | None, ...] = field(init=False, repr=False, compare=False)
+    _positions: dict[str, int] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        names = tuple(p.name for p in self.participants)
+        ids = tuple(p.id for p in self.participants)
+        # frozen, so the derived fields have to be set around the dataclass
+        object.__setattr__(self, "_names", names)
+        object.__setattr__(self, "_ids", ids)
+        object.__setattr__(self, "_positions", {name: i for i, name in enumerate(names)})
+        object.__setattr__(
+            self,
+            "current_index",
+            ids.index(self.current_member_id) if self.current_member_id in ids else 0,
+        )
+
+    def __str__(self):
+        """Returns a string representation of the initiative tracker."""
+        return self.render()
+
+    def render(self, limit: int | None = None) -> str:
+        """Renders the tracker, marking the current participant.
+
+        If that would take more than `limit` characters, only the participants around
+        the current one are shown.
+        """
+        header = f"Round {self.current_round}\n Participants:\n "
+        if not self.participants:
+            return f"{header}Nobody!\n"
+
+        block, ends = _render_block(self.participants)
+        end = ends[self.current_index]
+        if limit is None or len(header) + len(block) + len(_MARKER) <= limit:
+            return f"{header}{block[:end]}{_MARKER}{block[end:]}"
+        window = _render_window(block, ends, self.current_index, limit - len(header))
+        return header + window
+
+    def as_dict(self):
+        return {p.name: p.initiative for p in self.participants}
+
+    def find_position(self, name: str) -> int | None:
+        """Finds where a participant is in the turn order by name."""
+        return self._positions.get(name)
+
+    def find_participant(self, name: str) -> Participant | None:
+        """Finds a participant by name."""
+        position = self._positions.get(name)
+        if position is None:
+            return None
+        return self.participants[position]
+
+    def complete_name(self, prefix: str, limit: int = 25) -> list[str]:
+        """Returns up to `limit` participants' names that start with `prefix`."""
+        return _name_index(self._names).complete(prefix, limit)
+
+    @property
+    def current_participant(self) -> Participant | None:
+        """Returns the current participant."""
+        if len(self.participants) > 0:
+            return self.participants[self.current_index]
+        else:
+            return None
+
+
+class NameIndex:
+    """Names sorted ignoring case, so those with a prefix can be found by bisection."""
+
+    def __init__(self, names: tuple[str, ...]):
+        pairs = sorted((name.casefold(), name) for name in names)
+        self._keys = [key for key, _ in pairs]
+        self._names = [name for _, name in pairs]
+
+    def complete(self, prefix: str, limit: int) -> list[str]:
+        """Returns up to `limit` of the names that start with `prefix`, ignoring case."""
+        prefix = prefix.casefold()
+        start = bisect_left(self._keys, prefix)
+        # every key with the prefix sorts before the prefix followed by the last character
+        end = bisect_left(self._keys, prefix + chr(0x10FFFF), start)
+        return self._names[start : min(end, start + limit)]
+
+
+@lru_cache(maxsize=TRACKER_CACHE_SIZE)
+def _name_index(names: tuple[str, ...]) -> NameIndex:
+    # cached by the names, compared by equality, so trackers with the same members share
+    # an index however they were built
+    return NameIndex(names)
+
+
+_MARKER = " <=="
+
+# the rendered participants of recently shown trackers, by the identity of their
+# participants, which trackers built from the same rows share; each entry holds on to
+# its participants so their identity can't be reused while it is cached
+_blocks: OrderedDict[int, tuple[tuple[Participant, ...], str, list[int]]] = OrderedDict()
+
+
+def _render_block(participants: tuple[Participant, ...]) -> tuple[str, list[int]]:
+    """Renders participants one to a line, and returns the text and where each line ends.
+
+    Navigating doesn't change who is in a tracker, so the text is cached, and only the
+    marker has to be moved.
+    """
+    entry = _blocks.get(id(participants))
+    if entry is not None:
+        _blocks.move_to_end(id(participants))
+        return entry[1], entry[2]
+
+    lines = [f"{p} " for p in participants]
+    ends, end = [], 0
+    for line in lines:
+        end += len(line)
+        ends.append(end)
+        end += 1  # for the newline
+    block = "\n".join(lines)
+
+    _blocks[id(participants)] = (participants, block, ends)
+    if len(_blocks) > TRACKER_CACHE_SIZE:
+        _blocks.popitem(last=False)
+    return block, ends
+
+
+def _render_window(block: str, ends: list[int], current: int, limit: int) -> str:
+    """Renders as many lines around the current one as fit in `limit` characters."""
+
+    def start(first: int) -> int:
+        return ends[first - 1] + 1 if first else 0
+
+    def above(first: int) -> str:
+        return f"... {first} more\n" if first else ""
+
+    def below(last: int) -> str:
+        return f"\n... {len(ends) - 1 - last} more" if last < len(ends) - 1 else ""
+
+    def fits(first: int, last: int) -> bool:
+        length = ends[last] - start(first) + len(_MARKER)
+        return len(above(first)) + length + len(below(last)) <= limit
+
+    first = last = current
+    grew = True
+    while grew:
+        grew = False
+        # a line below, then a line above, for as long as either still fits
+        if last < len(ends) - 1 and fits(first, last + 1):
+            last += 1
+            grew = True
+        if first > 0 and fits(first - 1, last):
+            first -= 1
+            grew = True
+
+    end = ends[current]
+    lines = f"{block[start(first):end]}{_MARKER}{block[end:ends[last]]}"
+    text = f"{above(first)}{lines}{below(last)}"
+    # only a single line that is too long on its own needs cutting short
+    return text[:limit]
@@ -0,0 +1,375 @@
+import asyncio
+import itertools
+import logging
+import random
+import re
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import AsyncIterator
+
+import asyncpg
+from databases import Database
+from databases.core import Connection
+
+from app.constants import (
+    COMMAND_DB_TIME_BUDGET,
+    COMMAND_QUERY_BUDGET,
+    DB_HEALTH_CHECK_INTERVAL,
+    DB_HEALTH_CHECK_TIMEOUT,
+    DB_RECONNECT_BACKOFF,
+    DB_RECONNECT_MAX_BACKOFF,
+)
+from app.errors import PoolExhaustedError
+from app.metrics import Counter, Gauge, Histogram
+
+log = logging.getLogger(__name__)
+
+query_seconds = Histogram(
+    "db_query_seconds",
+    "Time taken by each database statement, by the command that sent it",
+)
+command_queries = Histogram(
+    "command_queries",
+    "Database statements sent per command",
+    buckets=(1, 2, 3, 5, 10, 20, 50),
+)
+command_db_seconds = Histogram(
+    "command_db_seconds", "Time each command spent waiting on the database"
+)
+command_seconds = Histogram("command_seconds", "Time each command took, start to finish")
+pool_wait_seconds = Histogram(
+    "db_pool_wait_seconds", "Time spent waiting for a pooled connection, by command"
+)
+pool_exhausted = Counter(
+    "db_pool_exhausted_total",
+    "Statements abandoned because no pooled connection came free",
+)
+database_up = Gauge("db_up", "Whether the last database health check passed")
+reconnects = Counter("db_reconnects_total", "Times the database pool was rebuilt")
+
+
+@dataclass
+class CommandStats:
+    command: str
+    channel_id: str
+    queries: int = 0
+    db_seconds: float = 0.0
+    started: float = field(default_factory=time.perf_counter)
+
+    @property
+    def over_budget(self) -> bool:
+        """Returns True if the command sent too many statements or waited too long on them."""
+        return (
+            self.queries > COMMAND_QUERY_BUDGET
+            or self.db_seconds > COMMAND_DB_TIME_BUDGET
+        )
+
+
+# the command whose statements are being sent, if any
+current_command: ContextVar[CommandStats | None] = ContextVar(
+    "current_command", default=None
+)
+
+
+def start_command(command: str, channel_id: str | int) -> CommandStats:
+    """Tags the statements sent from here on with a command and channel."""
+    stats = current_command.get()
+    if stats is not None:
+        # command groups invoke their subcommands from within themselves, and the
+        # subcommand's name is the more useful one
+        stats.command = command
+        return stats
+
+    stats = CommandStats(command, str(channel_id))
+    current_command.set(stats)
+    return stats
+
+
+def finish_command() -> CommandStats | None:
+    """Stops tagging statements, and records what the command sent."""
+    stats = current_command.get()
+    if stats is None:
+        return None
+    current_command.set(None)
+
+    command_seconds.observe(time.perf_counter() - stats.started, command=stats.command)
+    command_queries.observe(stats.queries, command=stats.command)
+    command_db_seconds.observe(stats.db_seconds, command=stats.command)
+    if stats.over_budget:
+        log.warning(
+            f"Command {stats.command} in channel {stats.channel_id} sent {stats.queries} "
+            f"statements and waited {stats.db_seconds:.3f}s on the database"
+        )
+    return stats
+
+
+def _record(seconds: float):
+    stats = current_command.get()
+    query_seconds.observe(seconds, command=stats.command if stats else "none")
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += seconds
+
+
+# databases 0.8 keeps the asyncpg pool, and each connection's asyncpg connection and the
+# lock that keeps it to one statement at a time, in private attributes; only the helpers
+# below reach for them, so only they need checking when databases is upgraded
+
+
+def _asyncpg_pool(database: Database) -> asyncpg.Pool | None:
+    """Returns a database's asyncpg pool, which only exists while it's connected."""
+    return getattr(database._backend, "_pool", None)
+
+
+def _forget_pool(database: Database):
+    """Makes a database forget its pool, as databases only does for a pool that closed."""
+    database.is_connected = False
+    database._backend._pool = None
+
+
+@asynccontextmanager
+async def _raw_connection(connection: Connection) -> AsyncIterator[asyncpg.Connection]:
+    """Yields a connection's asyncpg connection, for the caller alone to use meanwhile."""
+    async with connection._query_lock:
+        yield connection.raw_connection
+
+
+def pool_usage(database: Database) -> tuple[int, int]:
+    """Returns how many connections a database's pool has open, and how many are in use."""
+    pool = _asyncpg_pool(database)
+    if pool is None:
+        return 0, 0
+    return pool.get_size(), pool.get_size() - pool.get_idle_size()
+
+
+# a named parameter, as SQLAlchemy finds them, but not the second half of a :: cast
+_PARAMETER = re.compile(r"(?<![:\w]):(\w+)")
+
+
+class Statement:
+    """A hot statement, prepared once on every pooled connection as the connection opens.
+
+    It is written with the named parameters databases takes, and rewritten once into the
+    positional ones Postgres takes, so running it prepared skips SQLAlchemy altogether.
+    """
+
+    def __init__(self, name: str, sql: str):
+        self.name = name
+        self.sql = sql
+        self.parameters: list[str] = []
+        self.positional_sql = _PARAMETER.sub(self._number, sql)
+        statements[name] = self
+
+    def _number(self, match: re.Match) -> str:
+        name = match.group(1)
+        if name not in self.parameters:
+            self.parameters.append(name)
+        return f"${self.parameters.index(name) + 1}"
+
+    def arguments(self, values: dict) -> list:
+        """Returns the values of the statement's parameters, in order."""
+        return [values[name] for name in self.parameters]
+
+    def __str__(self) -> str:
+        return self.sql
+
+
+# every hot statement, by name
+statements: dict[str, Statement] = {}
+
+async def prepare_statements(connection: asyncpg.Connection):
+    """Prepares every hot statement on a newly opened connection, as a pool's `init`."""
+    # into asyncpg's statement cache, which lasts as long as the connection, where a
+    # PreparedStatement stops working once the connection goes back to the pool; the
+    # cache only fills as statements run, so each runs once, on nulls, and is undone
+    transaction = connection.transaction()
+    await transaction.start()
+    try:
+        for statement in statements.values():
+            arguments = [None] * len(statement.parameters)
+            try:
+                async with connection.transaction():
+                    await connection.fetchrow(statement.positional_sql, *arguments)
+            except asyncpg.PostgresError:
+                # it was prepared before it ran, so it's cached all the same
+                pass
+    finally:
+        await transaction.rollback()
+
+
+# the server processes behind the pool's open connections, so that the process can tell
+# the changes it made itself from those other processes made
+own_backends: set[int] = set()
+
+
+async def init_connection(connection: asyncpg.Connection):
+    """Readies a newly opened pooled connection, as a pool's `init`."""
+    pid = connection.get_server_pid()
+    own_backends.add(pid)
+    connection.add_termination_listener(lambda _: own_backends.discard(pid))
+    await prepare_statements(connection)
+
+
+async def fetch_statement(database: Database, statement: Statement, values: dict):
+    """Runs a hot statement and returns its first row, prepared if the database can."""
+    if isinstance(database, InstrumentedDatabase):
+        return await database.fetch_prepared(statement, values)
+    return await database.fetch_one(statement.sql, values)
+
+
+class InstrumentedDatabase(Database):
+    """A database that times every statement, and counts them against the current command.
+
+    Waiting for a pooled connection is timed separately, and gives up with a
+    PoolExhaustedError after `acquire_timeout` seconds, if given.
+    """
+
+    def __init__(self, url, *, acquire_timeout: float | None = None, **options):
+        super().__init__(url, **options)
+        self.acquire_timeout = acquire_timeout
+
+    @asynccontextmanager
+    async def _acquired(self):
+        # databases acquires a connection when one is first entered, and reuses it for
+        # the statement sent inside, so entering it here lets the wait be timed alone
+        connection = self.connection()
+        stats = current_command.get()
+        start = time.perf_counter()
+        try:
+            async with asyncio.timeout(self.acquire_timeout):
+                await connection.__aenter__()
+        except TimeoutError:
+            pool_exhausted.inc()
+            raise PoolExhaustedError(
+                f"No database connection came free within {self.acquire_timeout}s"
+            )
+        pool_wait_seconds.observe(
+            time.perf_counter() - start, command=stats.command if stats else "none"
+        )
+        try:
+            yield connection
+        finally:
+            await connection.__aexit__(None, None, None)
+
+    async def _timed(self, method, *args, **kwargs):
+        async with self._acquired():
+            start = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                _record(time.perf_counter() - start)
+
+    async def fetch_all(self, query, values=None):
+        return await self._timed(super().fetch_all, query, values)
+
+    async def fetch_one(self, query, values=None):
+        return await self._timed(super().fetch_one, query, values)
+
+    async def fetch_val(self, query, values=None, column=0):
+        return await self._timed(super().fetch_val, query, values, column=column)
+
+    async def execute(self, query, values=None):
+        return await self._timed(super().execute, query, values)
+
+    async def execute_many(self, query, values):
+        return await self._timed(super().execute_many, query, values)
+
+    async def fetch_prepared(self, statement: Statement, values: dict):
+        """Runs a hot statement straight down the connection, and returns the first row.
+
+        The statement is found in the connection's statement cache, where the pool's
+        `init` put it if it was init_connection, and asyncpg prepares it there if not.
+        """
+        async with self._acquired() as connection:
+            start = time.perf_counter()
+            try:
+                # databases only sends one statement at a time down a connection
+                async with _raw_connection(connection) as raw:
+                    return await raw.fetchrow(
+                        statement.positional_sql, *statement.arguments(values)
+                    )
+            finally:
+                _record(time.perf_counter() - start)
+
+    async def iterate(self, query, values=None):
+        async with self._acquired():
+            # timed from the first fetch until the last, including time spent by the caller
+            start = time.perf_counter()
+            try:
+                async for record in super().iterate(query, values):
+                    yield record
+            finally:
+                _record(time.perf_counter() - start)
+
+
+class ConnectionKeeper:
+    """Keeps a database connected for the life of the process.
+
+    The pool is checked every `interval` seconds, and rebuilt in the background if a
+    check fails, backing off exponentially between attempts.
+    """
+
+    def __init__(
+        self,
+        database: Database,
+        interval: float = DB_HEALTH_CHECK_INTERVAL,
+        timeout: float = DB_HEALTH_CHECK_TIMEOUT,
+        backoff: float = DB_RECONNECT_BACKOFF,
+        max_backoff: float = DB_RECONNECT_MAX_BACKOFF,
+    ):
+        self.database = database
+        self.interval = interval
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    async def check(self) -> bool:
+        """Returns True if the database answers a trivial query in time."""
+        try:
+            await asyncio.wait_for(self.database.fetch_val("SELECT 1"), self.timeout)
+        except PoolExhaustedError:
+            # busy, not broken
+            healthy = True
+        except Exception as e:
+            log.warning(f"Database health check failed: {e!r}")
+            healthy = False
+        else:
+            healthy = True
+        database_up.set(int(healthy))
+        return healthy
+
+    async def connect(self):
+        """Connects to the database, retrying with backoff until it works."""
+        for attempt in itertools.count():
+            try:
+                await self.database.connect()
+            except Exception as e:
+                delay = random.uniform(
+                    0, min(self.max_backoff, self.backoff * 2**attempt)
+                )
+                log.warning(
+                    f"Could not connect to the database ({e!r}), retrying in {delay:.1f}s"
+                )
+                await asyncio.sleep(delay)
+            else:
+                database_up.set(1)
+                return
+
+    async def reconnect(self):
+        """Throws away the pool and builds a new one."""
+        reconnects.inc()
+        try:
+            await self.database.disconnect()
+        except Exception as e:
+            log.warning(f"Could not cleanly disconnect from the database: {e!r}")
+            _forget_pool(self.database)
+        await self.connect()
+
+    async def run(self):
+        """Checks the database's health until cancelled, reconnecting whenever it fails."""
+        while True:
+            await asyncio.sleep(self.interval)
+            if not await self.check():
+                await self.reconnect()
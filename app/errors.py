@@ -8,3 +8,23 @@ class AlreadyExistsError(Exception):
 
 class BacktrackError(ValueError):
     """An error that is raised when a value is attempted to be reduced below its min value."""
+
+
+class NothingToUndoError(Exception):
+    """An error that is raised when there are fewer changes to undo or redo than asked."""
+
+
+class UndoUnsupportedError(Exception):
+    """An error that is raised when a storage doesn't keep the history to undo with."""
+
+
+class ConflictError(Exception):
+    """An error that is raised when a write keeps losing races with other writers."""
+
+
+class JournalReplayError(Exception):
+    """An error that is raised when journalled changes can't be written on starting."""
+
+
+class PoolExhaustedError(Exception):
+    """An error that is raised when no database connection comes free in time."""
@@ -0,0 +1,247 @@
+import asyncio
+import logging
+import os
+import random
+import signal
+import sys
+import time
+from dataclasses import dataclass
+
+import aiohttp
+from aiohttp import web
+
+from app.constants import (
+    JOURNAL_PATH,
+    METRICS_PORT,
+    SECRET_TOKEN,
+    SHARD_COUNT,
+    STORAGE_BACKEND,
+    WORKER_COUNT,
+    WORKER_RESTART_BACKOFF,
+    WORKER_RESTART_MAX_BACKOFF,
+    WORKER_STABLE_SECONDS,
+)
+from app.metrics import Counter, Gauge, merge, render
+
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+# seconds a worker is given to stop after being told to, before it is killed
+STOP_TIMEOUT = 10.0
+# seconds the launcher waits on a worker's metrics or health
+WORKER_REQUEST_TIMEOUT = 2.0
+
+worker_restarts = Counter(
+    "launcher_worker_restarts_total", "Workers restarted after exiting, by worker"
+)
+workers_running = Gauge("launcher_workers_running", "Worker processes running")
+
+
+def assign_shards(shard_count: int, worker_count: int) -> list[list[int]]:
+    """Shares the shards out between workers in runs, as evenly as they go."""
+    bounds = [i * shard_count // worker_count for i in range(worker_count + 1)]
+    return [list(range(start, end)) for start, end in zip(bounds, bounds[1:])]
+
+
+async def recommended_shard_count(token: str = SECRET_TOKEN) -> int:
+    """Asks Discord how many shards the bot should be split into."""
+    async with aiohttp.ClientSession() as session:
+        async with session.get(
+            "https://discord.com/api/v10/gateway/bot",
+            headers={"Authorization": f"Bot {token}"},
+            raise_for_status=True,
+        ) as response:
+            return (await response.json())["shards"]
+
+
+@dataclass
+class Worker:
+    """A process running the bot on some of the shards."""
+
+    index: int
+    shard_ids: list[int]
+    port: int
+    process: asyncio.subprocess.Process | None = None
+
+    @property
+    def running(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+
+class Supervisor:
+    """Runs the bot as several worker processes, restarting any that exit.
+
+    Each worker runs app.main on its own run of the shards, and serves its metrics and
+    health on a port of its own. The supervisor serves them all, merged, on `port`.
+
+    SQLite storage is only for a single worker, as a file of its own for each worker
+    would lose its trackers to another whenever the shards were shared out afresh.
+    """
+
+    def __init__(
+        self,
+        shard_count: int,
+        worker_count: int = WORKER_COUNT,
+        port: int = METRICS_PORT,
+        command: tuple[str, ...] = (sys.executable, "-m", "app.main"),
+        backoff: float = WORKER_RESTART_BACKOFF,
+        max_backoff: float = WORKER_RESTART_MAX_BACKOFF,
+        stable_seconds: float = WORKER_STABLE_SECONDS,
+        storage_backend: str = STORAGE_BACKEND,
+    ):
+        self.shard_count = shard_count
+        self.port = port
+        self.command = command
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stable_seconds = stable_seconds
+        # no more workers than shards, so that none is left without any
+        self.workers = [
+            Worker(index, shard_ids, port + 1 + index)
+            for index, shard_ids in enumerate(
+                assign_shards(shard_count, min(worker_count, shard_count))
+            )
+        ]
+        if storage_backend == "sqlite" and len(self.workers) > 1:
+            raise ValueError(
+                f"SQLite storage can't be shared by {len(self.workers)} workers, "
+                "set WORKER_COUNT to 1"
+            )
+        self._stopping = False
+
+    def _environment(self, worker: Worker) -> dict[str, str]:
+        return {
+            **os.environ,
+            "SHARD_IDS": ",".join(map(str, worker.shard_ids)),
+            "SHARD_COUNT": str(self.shard_count),
+            "METRICS_PORT": str(worker.port),
+            # so that workers writing behind don't share a journal
+            "JOURNAL_PATH": f"{JOURNAL_PATH}.{worker.index}",
+        }
+
+    async def _supervise(self, worker: Worker):
+        """Runs a worker until the supervisor stops, restarting it whenever it exits."""
+        failures = 0
+        while not self._stopping:
+            started = time.monotonic()
+            worker.process = await asyncio.create_subprocess_exec(
+                *self.command, env=self._environment(worker)
+            )
+            workers_running.set(sum(w.running for w in self.workers))
+            log.info(
+                f"Started worker {worker.index} on shards {worker.shard_ids}, "
+                f"pid {worker.process.pid}"
+            )
+            code = await worker.process.wait()
+            workers_running.set(sum(w.running for w in self.workers))
+            if self._stopping:
+                return
+
+            if time.monotonic() - started >= self.stable_seconds:
+                failures = 0
+            delay = random.uniform(0, min(self.max_backoff, self.backoff * 2**failures))
+            failures += 1
+            worker_restarts.inc(worker=worker.index)
+            log.warning(
+                f"Worker {worker.index} exited with {code}, restarting in {delay:.1f}s"
+            )
+            await asyncio.sleep(delay)
+
+    async def run(self):
+        """Runs the workers until cancelled, then stops them."""
+        try:
+            await asyncio.gather(*(self._supervise(w) for w in self.workers))
+        finally:
+            await self.stop()
+
+    async def stop(self):
+        """Tells every worker to stop, killing those that don't in time."""
+        self._stopping = True
+        running = [w.process for w in self.workers if w.running]
+        for process in running:
+            process.terminate()
+        for process in running:
+            try:
+                await asyncio.wait_for(process.wait(), STOP_TIMEOUT)
+            except TimeoutError:
+                log.warning(f"Worker pid {process.pid} didn't stop, killing it")
+                process.kill()
+                await process.wait()
+
+    async def _fetch(
+        self, session: aiohttp.ClientSession, worker: Worker, path: str
+    ) -> aiohttp.ClientResponse | None:
+        try:
+            async with session.get(f"http://127.0.0.1:{worker.port}{path}") as response:
+                await response.read()
+                return response
+        except (aiohttp.ClientError, TimeoutError):
+            return None
+
+    async def health(self) -> tuple[dict, bool]:
+        """Returns every worker's health checks, and whether all of them passed."""
+        timeout = aiohttp.ClientTimeout(total=WORKER_REQUEST_TIMEOUT)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            responses = await asyncio.gather(
+                *(self._fetch(session, w, "/healthz") for w in self.workers)
+            )
+            checks = {
+                str(w.index): {"running": False} if r is None else await r.json()
+                for w, r in zip(self.workers, responses)
+            }
+        return checks, all(r is not None and r.status == 200 for r in responses)
+
+    async def metrics(self) -> str:
+        """Returns every worker's metrics, labelled by worker, and the supervisor's."""
+        timeout = aiohttp.ClientTimeout(total=WORKER_REQUEST_TIMEOUT)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            responses = await asyncio.gather(
+                *(self._fetch(session, w, "/metrics") for w in self.workers)
+            )
+            expositions = {
+                str(w.index): await r.text()
+                for w, r in zip(self.workers, responses)
+                if r is not None
+            }
+        return render() + merge(expositions, "worker")
+
+    def create_app(self) -> web.Application:
+        """Creates the web app that serves every worker's metrics and health."""
+
+        async def metrics(request: web.Request) -> web.Response:
+            return web.Response(
+                text=await self.metrics(),
+                headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+            )
+
+        async def healthz(request: web.Request) -> web.Response:
+            checks, healthy = await self.health()
+            return web.json_response(checks, status=200 if healthy else 503)
+
+        app = web.Application()
+        app.add_routes([web.get("/metrics", metrics), web.get("/healthz", healthz)])
+        return app
+
+
+async def main():
+    # stop the workers cleanly when docker stops the container
+    asyncio.get_running_loop().add_signal_handler(
+        signal.SIGTERM, asyncio.current_task().cancel
+    )
+
+    shard_count = SHARD_COUNT or await recommended_shard_count()
+    supervisor = Supervisor(shard_count)
+    log.info(f"Running {len(supervisor.workers)} workers on {shard_count} shards")
+
+    runner = web.AppRunner(supervisor.create_app())
+    await runner.setup()
+    await web.TCPSite(runner, port=supervisor.port).start()
+    try:
+        await supervisor.run()
+    finally:
+        await runner.cleanup()
+        log.info("MMW custodian launcher shutting down!")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import random
+from datetime import datetime, timedelta
+
+import asyncpg
+
+from app.constants import (
+    DATABASE_URL,
+    DB_HEALTH_CHECK_INTERVAL,
+    DB_HEALTH_CHECK_TIMEOUT,
+    DB_RECONNECT_BACKOFF,
+    DB_RECONNECT_MAX_BACKOFF,
+)
+from app.controllers.cache import TrackerCache, tracker_cache
+from app.database import own_backends
+from app.metrics import Counter, Gauge
+
+log = logging.getLogger(__name__)
+
+# what the triggers on the initiative tables notify, with the id of the channel changed
+CHANGES_CHANNEL = "initiative_changes"
+# how long a write can take, so that one begun before the listener last heard from the
+# database, but only committed once it had stopped listening, is still caught up on
+MAX_WRITE_SECONDS = 5
+
+# the channels, of those given, whose trackers exist and weren't written since a time,
+# in the tables of both the Postgres and the event storage
+_UNCHANGED = """
+SELECT c.channel_id FROM unnest(CAST($1 AS varchar[])) AS c(channel_id)
+WHERE (
+    EXISTS (SELECT FROM initiative_trackers t WHERE t.channel_id = c.channel_id)
+    OR EXISTS (SELECT FROM initiative_events e WHERE e.channel_id = c.channel_id)
+)
+AND NOT EXISTS (
+    SELECT FROM initiative_trackers t
+    WHERE t.channel_id = c.channel_id AND t.updated_at >= $2
+)
+AND NOT EXISTS (
+    SELECT FROM initiative_events e
+    WHERE e.channel_id = c.channel_id AND e.created_at >= $2
+)
+"""
+
+notifications = Counter(
+    "tracker_change_notifications_total",
+    "Trackers other processes changed, which were dropped from the cache",
+)
+missed_changes = Counter(
+    "tracker_change_missed_total",
+    "Trackers changed while nobody was listening, dropped on listening again",
+)
+listener_up = Gauge(
+    "tracker_change_listener_up", "Whether changes made by other processes are heard of"
+)
+
+
+class ChangeListener:
+    """Drops trackers from the cache as other processes change them.
+
+    Listens on a connection of its own, outside the pool, which is checked every
+    `interval` seconds and opened again with exponential backoff if it fails. Changes
+    made while nobody was listening aren't heard of, so on listening again the trackers
+    written since it last heard from the database are dropped, along with those deleted.
+    """
+
+    def __init__(
+        self,
+        url: str = DATABASE_URL,
+        cache: TrackerCache = tracker_cache,
+        interval: float = DB_HEALTH_CHECK_INTERVAL,
+        timeout: float = DB_HEALTH_CHECK_TIMEOUT,
+        backoff: float = DB_RECONNECT_BACKOFF,
+        max_backoff: float = DB_RECONNECT_MAX_BACKOFF,
+    ):
+        self.url = url
+        self.cache = cache
+        self.interval = interval
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.listening = asyncio.Event()
+        # the database's time when the listener last heard from it, which every change
+        # committed before was told of by then
+        self._heard_at: datetime | None = None
+        # failures since the listener last listened, which it backs off by
+        self._failures = 0
+
+    def _notified(self, connection, pid: int, channel: str, channel_id: str):
+        # this process already cached what its own connections wrote
+        if pid in own_backends:
+            return
+        notifications.inc()
+        self.cache.invalidate(channel_id)
+
+    async def _listen(self):
+        """Listens until the connection fails."""
+        connection = await asyncpg.connect(
+            self.url, server_settings={"application_name": "custodian-listener"}
+        )
+        try:
+            await connection.add_listener(CHANGES_CHANNEL, self._notified)
+            heard_at = await connection.fetchval("SELECT now()")
+            if self._heard_at is not None:
+                await self._catch_up(connection, self._heard_at)
+            self._heard_at = heard_at
+            self._failures = 0
+            self.listening.set()
+            listener_up.set(1)
+            while True:
+                await asyncio.sleep(self.interval)
+                self._heard_at = await asyncio.wait_for(
+                    connection.fetchval("SELECT now()"), self.timeout
+                )
+        finally:
+            self.listening.clear()
+            listener_up.set(0)
+            connection.terminate()
+
+    async def _catch_up(self, connection: asyncpg.Connection, heard_at: datetime):
+        """Drops the cached trackers changed since the listener last heard of changes."""
+        cached = list(self.cache)
+        since = heard_at - timedelta(seconds=MAX_WRITE_SECONDS)
+        unchanged = {row[0] for row in await connection.fetch(_UNCHANGED, cached, since)}
+        for channel_id in cached:
+            if channel_id not in unchanged:
+                missed_changes.inc()
+                self.cache.invalidate(channel_id)
+
+    async def run(self):
+        """Listens for changes until cancelled."""
+        while True:
+            try:
+                await self._listen()
+            except Exception as e:
+                delay = random.uniform(
+                    0, min(self.max_backoff, self.backoff * 2**self._failures)
+                )
+                self._failures += 1
+                log.warning(
+                    f"Stopped hearing of tracker changes ({e!r}), "
+                    f"retrying in {delay:.1f}s"
+                )
+                await asyncio.sleep(delay)
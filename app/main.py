@@ -1,9 +1,81 @@
+import asyncio
 import logging
+import signal
+import time
+from typing import Callable
 
-from app.bot.setup import bot
-from app.constants import SECRET_TOKEN
+from app.bot.setup import bot, on_own_shards
+from app.constants import (
+    SECRET_TOKEN,
+    SHARD_IDS,
+    STORAGE_BACKEND,
+    TRACKER_WARM_START_HOURS,
+)
+from app.controllers.initiative import warm_cache
+from app.listener import ChangeListener
+from app.server import start_server
+from app.storage import storage
 
 logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
+
+
+async def warm(keep: Callable[[str], bool] | None = None):
+    """Warms the tracker cache, logging rather than raising if it can't."""
+    start = time.perf_counter()
+    try:
+        warmed = await warm_cache(TRACKER_WARM_START_HOURS, keep=keep)
+    except Exception as e:
+        log.warning(f"Could not warm the tracker cache: {e!r}")
+    else:
+        log.info(
+            f"Warmed the tracker cache with {warmed} trackers in "
+            f"{time.perf_counter() - start:.2f}s"
+        )
+
+
+async def warm_own_shards():
+    # which shard a channel's guild is on is only known once the bot has connected
+    await bot.wait_until_ready()
+    await warm(on_own_shards)
+
+
+async def main():
+    # stop cleanly when docker stops the container
+    asyncio.get_running_loop().add_signal_handler(
+        signal.SIGTERM, asyncio.current_task().cancel
+    )
+
+    await storage.connect()
+    log.info(f"Connected to {STORAGE_BACKEND} storage!")
+
+    # other processes sharing the database may change trackers this one has cached
+    listener = None
+    if STORAGE_BACKEND in ("postgres", "events"):
+        listener = asyncio.create_task(ChangeListener().run())
+
+    # so the first command in each channel in play after a restart doesn't go to the
+    # database; a failure only costs that, so it doesn't stop the bot starting. A
+    # launcher's worker only warms the channels on its own shards
+    warming = None
+    if SHARD_IDS:
+        warming = asyncio.create_task(warm_own_shards())
+    else:
+        await warm()
+
+    async with bot:
+        # on the bot's own loop, so slow commands show up as event loop lag
+        runner = await start_server()
+        try:
+            await bot.start(SECRET_TOKEN)
+        finally:
+            await runner.cleanup()
+            for task in (listener, warming):
+                if task is not None:
+                    task.cancel()
+            await storage.disconnect()
+            log.info("MMW custodian shutting down!")
+
 
 if __name__ == "__main__":
-    bot.run(SECRET_TOKEN)
+    asyncio.run(main())
@@ -0,0 +1,217 @@
+import math
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Callable, Iterator
+
+Labels = tuple[tuple[str, str], ...]
+Sample = tuple[str, Labels, float]
+
+
+class Metric(ABC):
+    """A named measurement, broken down by labels."""
+
+    type = "untyped"
+
+    def __init__(self, name: str, description: str, registry: list | None = None):
+        self.name = name
+        self.description = description
+        (REGISTRY if registry is None else registry).append(self)
+
+    @staticmethod
+    def _labels(labels: dict) -> Labels:
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    @abstractmethod
+    def samples(self) -> Iterator[Sample]:
+        """Yields the metric's current values, as name suffix, labels and value."""
+
+
+class Counter(Metric):
+    """A count that only ever goes up.
+
+    If given a function, the count is whatever it returns, for counts kept elsewhere.
+    """
+
+    type = "counter"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        function: Callable[[], float] | None = None,
+        registry: list | None = None,
+    ):
+        super().__init__(name, description, registry)
+        self._function = function
+        self._values: defaultdict[Labels, float] = defaultdict(float)
+
+    def inc(self, amount: float = 1, **labels):
+        self._values[self._labels(labels)] += amount
+
+    def value(self, **labels) -> float:
+        """Returns the count for the given labels, or the total if none are given."""
+        if self._function is not None:
+            return self._function()
+        if labels:
+            return self._values.get(self._labels(labels), 0)
+        return sum(self._values.values())
+
+    def samples(self) -> Iterator[Sample]:
+        if self._function is not None:
+            yield "", (), self._function()
+        else:
+            for labels, value in self._values.items():
+                yield "", labels, value
+
+
+class Gauge(Metric):
+    """A value that can go up and down.
+
+    If given a function, the value is whatever it returns when the gauge is read.
+    """
+
+    type = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        function: Callable[[], float] | None = None,
+        registry: list | None = None,
+    ):
+        super().__init__(name, description, registry)
+        self._function = function
+        self._values: dict[Labels, float] = {}
+
+    def set(self, value: float, **labels):
+        self._values[self._labels(labels)] = value
+
+    def value(self, **labels) -> float:
+        """Returns the value for the given labels."""
+        if self._function is not None:
+            return self._function()
+        return self._values.get(self._labels(labels), 0)
+
+    def samples(self) -> Iterator[Sample]:
+        if self._function is not None:
+            yield "", (), self._function()
+        else:
+            for labels, value in self._values.items():
+                yield "", labels, value
+
+
+# seconds; suits anything from a cached lookup to a slow Discord round trip
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+class Histogram(Metric):
+    """A distribution of observations, counted into buckets by upper bound."""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+        registry: list | None = None,
+    ):
+        super().__init__(name, description, registry)
+        self.buckets = tuple(sorted(buckets))
+        # one count per bucket, plus one for observations above the last bound
+        self._counts: dict[Labels, list[int]] = {}
+        self._sums: defaultdict[Labels, float] = defaultdict(float)
+
+    def observe(self, value: float, **labels):
+        key = self._labels(labels)
+        counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+        counts[bisect_left(self.buckets, value)] += 1
+        self._sums[key] += value
+
+    def count(self, **labels) -> int:
+        """Returns how many observations were made with the given labels."""
+        return sum(self._counts.get(self._labels(labels), ()))
+
+    def sum(self, **labels) -> float:
+        """Returns the total of the observations made with the given labels."""
+        return self._sums.get(self._labels(labels), 0)
+
+    def bucket_counts(self, **labels) -> list[int]:
+        """Returns the cumulative count of observations at or below each bucket's bound."""
+        counts = self._counts.get(self._labels(labels), [0] * (len(self.buckets) + 1))
+        cumulative, total = [], 0
+        for count in counts[:-1]:
+            total += count
+            cumulative.append(total)
+        return cumulative
+
+    def samples(self) -> Iterator[Sample]:
+        for labels, counts in self._counts.items():
+            total = 0
+            for bound, count in zip(self.buckets, counts):
+                total += count
+                yield "_bucket", labels + (("le", _format_value(bound)),), total
+            total += counts[-1]
+            yield "_bucket", labels + (("le", "+Inf"),), total
+            yield "_sum", labels, self._sums[labels]
+            yield "_count", labels, total
+
+
+def _format_value(value: float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (key, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def render(registry: list[Metric] | None = None) -> str:
+    """Renders metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY if registry is None else registry:
+        lines.append(f"# HELP {metric.name} {metric.description}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for suffix, labels, value in metric.samples():
+            lines.append(
+                f"{metric.name}{suffix}{_format_labels(labels)} {_format_value(value)}"
+            )
+    return "\n".join(lines) + "\n"
+
+
+def merge(expositions: dict[str, str], label: str) -> str:
+    """Merges metrics rendered by several processes, labelling each sample with its own.
+
+    Every metric's samples are kept together under one HELP and TYPE, as Prometheus
+    needs them, in the order the metrics were first seen.
+    """
+    families: dict[str, tuple[list[str], list[str]]] = {}
+    for source, text in expositions.items():
+        source_label = _format_labels(((label, source),))[1:-1]
+        headers, samples = families.setdefault("", ([], []))
+        for line in text.splitlines():
+            if line.startswith("# "):
+                headers, samples = families.setdefault(line.split(" ")[2], ([], []))
+                if line not in headers:
+                    headers.append(line)
+            elif line:
+                series, value = line.rsplit(" ", 1)
+                name, brace, labels = series.partition("{")
+                labels = f"{source_label},{labels}" if brace else f"{source_label}}}"
+                samples.append(f"{name}{{{labels} {value}")
+    lines = [line for headers, samples in families.values() for line in headers + samples]
+    return "\n".join(lines) + "\n"
+
+
+# every metric the process has created, in creation order
+REGISTRY: list[Metric] = []
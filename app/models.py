@@ -1,15 +1,34 @@
-from databases import Database
-from sqlalchemy import Column, ForeignKey, create_engine
+from sqlalchemy import Column, ForeignKey, create_engine, func
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import declarative_base, validates
-from sqlalchemy.schema import CheckConstraint, UniqueConstraint
-from sqlalchemy.types import DateTime, Integer, String
+from sqlalchemy.schema import CheckConstraint, Index, UniqueConstraint
+from sqlalchemy.types import BigInteger, DateTime, Integer, String
 
-from app.constants import DATABASE_URL
+from app.constants import (
+    DATABASE_URL,
+    DB_COMMAND_TIMEOUT,
+    DB_MAX_INACTIVE_CONNECTION_LIFETIME,
+    DB_POOL_ACQUIRE_TIMEOUT,
+    DB_POOL_MAX_SIZE,
+    DB_POOL_MIN_SIZE,
+    DB_STATEMENT_CACHE_SIZE,
+)
+from app.database import InstrumentedDatabase, init_connection
 from app.errors import BacktrackError
 
 Base: type = declarative_base()
 engine = create_engine(DATABASE_URL)
-database = Database(DATABASE_URL)
+database = InstrumentedDatabase(
+    DATABASE_URL,
+    acquire_timeout=DB_POOL_ACQUIRE_TIMEOUT,
+    min_size=DB_POOL_MIN_SIZE,
+    max_size=DB_POOL_MAX_SIZE,
+    statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+    command_timeout=DB_COMMAND_TIMEOUT,
+    max_inactive_connection_lifetime=DB_MAX_INACTIVE_CONNECTION_LIFETIME,
+    # the hot statements are prepared on each connection as it opens
+    init=init_connection,
+)
 
 
 class InitiativeTracker(Base):
@@ -20,9 +39,21 @@ class InitiativeTracker(Base):
     current_round = Column(
         Integer, CheckConstraint("current_round >= 1"), nullable=False, default=1
     )
-    current_index = Column(
-        Integer, CheckConstraint("current_index >= 0"), nullable=False, default=0
+    # the member whose turn it is, which stays put as others join, leave or change places
+    current_member_id = Column(
+        Integer,
+        ForeignKey("initiative_members.id", ondelete="SET NULL", use_alter=True),
+        nullable=True,
+    )
+    # bumped by every write, which compares-and-swaps on it
+    version = Column(Integer, nullable=False, default=0, server_default="0")
+    # bumped by every write to the tracker, so the trackers in play can be found on start
+    # up; not indexed, so that bumping it doesn't stop those writes being HOT updates
+    updated_at = Column(
+        DateTime(timezone=True), nullable=False, server_default=func.now()
     )
+    # the pinned message that shows the tracker, which commands edit instead of replying
+    message_id = Column(String, nullable=True)
 
     @validates("current_round")
     def validate_current_round(self, key, value):
@@ -30,12 +61,6 @@ class InitiativeTracker(Base):
             raise BacktrackError("Current round cannot be less than 1")
         return value
 
-    @validates("current_index")
-    def validate_current_index(self, key, value):
-        if not value >= 0:
-            raise BacktrackError("Current index cannot be less than 0")
-        return value
-
 
 class InitiativeMember(Base):
     __tablename__ = "initiative_members"
@@ -54,3 +79,48 @@ class InitiativeMember(Base):
     tiebreaker = Column(Integer, nullable=False, default=0)
 
     deleted_at = Column(DateTime, nullable=True)
+
+
+# live members of a tracker, in turn order, without touching the table
+Index(
+    "ix_initiative_members_turn_order",
+    InitiativeMember.initiative_id,
+    InitiativeMember.init_value.desc(),
+    InitiativeMember.tiebreaker.desc(),
+    InitiativeMember.id,
+    postgresql_include=["player_name"],
+    postgresql_where=InitiativeMember.deleted_at.is_(None),
+)
+
+
+class InitiativeEvent(Base):
+    """A change to a channel's tracker, as kept by the events storage."""
+
+    __tablename__ = "initiative_events"
+    __table_args__ = (
+        UniqueConstraint("channel_id", "seq", name="unique_initiative_event"),
+    )
+
+    id = Column(BigInteger, primary_key=True)
+    channel_id = Column(String, nullable=False)
+    # numbers a channel's events from 1 with no gaps; two writers can't both add the next
+    seq = Column(Integer, nullable=False)
+    kind = Column(String, nullable=False)
+    data = Column(JSONB, nullable=False)
+    # indexed so the trackers in play can be found on start up
+    created_at = Column(
+        DateTime(timezone=True), nullable=False, server_default=func.now(), index=True
+    )
+
+
+class InitiativeSnapshot(Base):
+    """A channel's tracker as of one of its events, so only later ones are replayed."""
+
+    __tablename__ = "initiative_snapshots"
+
+    channel_id = Column(String, primary_key=True)
+    seq = Column(Integer, nullable=False)
+    state = Column(JSONB, nullable=False)
+    created_at = Column(
+        DateTime(timezone=True), nullable=False, server_default=func.now()
+    )
@@ -0,0 +1,111 @@
+import asyncio
+import logging
+
+from aiohttp import web
+
+from app.bot.setup import bot
+from app.constants import DB_POOL_MAX_SIZE, METRICS_PORT
+from app.controllers.cache import tracker_cache
+from app.database import pool_usage
+from app.metrics import Counter, Gauge, Histogram, render
+from app.models import database
+from app.storage import storage
+
+log = logging.getLogger(__name__)
+
+# how often the event loop is checked for lag, in seconds
+LAG_CHECK_INTERVAL = 1.0
+
+gateway_latency = Gauge(
+    "discord_gateway_latency_seconds",
+    "Time between a gateway heartbeat and its acknowledgement",
+    function=lambda: bot.latency,
+)
+pool_connections = Gauge(
+    "db_pool_connections",
+    "Connections the database pool has open",
+    function=lambda: pool_usage(database)[0],
+)
+pool_connections_in_use = Gauge(
+    "db_pool_connections_in_use",
+    "Connections the database pool has lent out",
+    function=lambda: pool_usage(database)[1],
+)
+pool_max_connections = Gauge(
+    "db_pool_max_connections",
+    "Connections the database pool may open",
+    function=lambda: DB_POOL_MAX_SIZE,
+)
+cache_hits = Counter(
+    "tracker_cache_hits_total",
+    "Tracker lookups served from the cache",
+    function=lambda: tracker_cache.stats.hits,
+)
+cache_misses = Counter(
+    "tracker_cache_misses_total",
+    "Tracker lookups that had to go to the database",
+    function=lambda: tracker_cache.stats.misses,
+)
+cache_evictions = Counter(
+    "tracker_cache_evictions_total",
+    "Trackers dropped from the cache for being stale or least recently used",
+    function=lambda: tracker_cache.stats.evictions,
+)
+cache_hit_ratio = Gauge(
+    "tracker_cache_hit_ratio",
+    "Fraction of tracker lookups served from the cache",
+    function=lambda: tracker_cache.stats.hit_rate,
+)
+cache_entries = Gauge(
+    "tracker_cache_entries", "Trackers in the cache", function=lambda: len(tracker_cache)
+)
+event_loop_lag = Histogram(
+    "event_loop_lag_seconds", "How late the event loop woke up from a timed sleep"
+)
+
+
+async def watch_event_loop(interval: float = LAG_CHECK_INTERVAL):
+    """Measures how late the event loop wakes up from sleeping, until cancelled."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        event_loop_lag.observe(max(loop.time() - start - interval, 0))
+
+
+async def metrics(request: web.Request) -> web.Response:
+    return web.Response(
+        text=render(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
+async def healthz(request: web.Request) -> web.Response:
+    checks = {
+        "discord": bot.is_ready() and not bot.is_closed(),
+        "database": storage.is_connected,
+    }
+    return web.json_response(checks, status=200 if all(checks.values()) else 503)
+
+
+async def _watching_event_loop(app: web.Application):
+    task = asyncio.create_task(watch_event_loop())
+    yield
+    task.cancel()
+
+
+def create_app() -> web.Application:
+    """Creates the web app that serves the bot's metrics and health."""
+    app = web.Application()
+    app.add_routes([web.get("/metrics", metrics), web.get("/healthz", healthz)])
+    app.cleanup_ctx.append(_watching_event_loop)
+    return app
+
+
+async def start_server(port: int = METRICS_PORT) -> web.AppRunner:
+    """Serves the metrics and health endpoints on the running event loop."""
+    runner = web.AppRunner(create_app())
+    await runner.setup()
+    await web.TCPSite(runner, port=port).start()
+    log.info(f"Serving metrics on port {port}")
+    return runner
@@ -0,0 +1,36 @@
+from databases import Database
+
+from app.constants import JOURNAL_PATH, SQLITE_PATH, STORAGE_BACKEND
+from app.models import database
+from app.storage.base import Storage
+from app.storage.events import EventStorage
+from app.storage.journal import JournalStorage
+from app.storage.memory import MemoryStorage
+from app.storage.postgres import PostgresStorage
+from app.storage.sqlite import SQLiteStorage
+
+
+def create_storage(backend: str = STORAGE_BACKEND) -> Storage:
+    """Creates the storage named by `backend`, as STORAGE_BACKEND names it."""
+    if backend == "postgres":
+        return PostgresStorage(database)
+    if backend == "events":
+        return EventStorage(database)
+    if backend == "journal":
+        return JournalStorage(PostgresStorage(database), JOURNAL_PATH)
+    if backend == "sqlite":
+        return SQLiteStorage(SQLITE_PATH)
+    if backend == "memory":
+        return MemoryStorage()
+    raise ValueError(f"Unknown storage backend {backend!r}")
+
+
+def as_storage(database: Database | Storage) -> Storage:
+    """Returns the storage given, or one over the Postgres database given."""
+    if isinstance(database, Storage):
+        return database
+    return PostgresStorage(database)
+
+
+# the storage the process keeps its trackers in
+storage = create_storage()
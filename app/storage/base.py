@@ -0,0 +1,184 @@
+from abc import ABC, abstractmethod
+from dataclasses import replace
+from typing import AsyncIterator
+
+from app.controllers.tracker import InitiativeTracker, Participant
+from app.errors import BacktrackError, NotFoundError, UndoUnsupportedError
+
+
+class Storage(ABC):
+    """Where initiative trackers and their members are kept.
+
+    Every write returns the tracker as it is after the write, with its participants in
+    turn order. Missing trackers and participants raise NotFoundError, names that are
+    already taken raise AlreadyExistsError, and moves back past round 1 raise
+    BacktrackError.
+    """
+
+    async def connect(self):
+        """Gets the storage ready for use."""
+
+    async def disconnect(self):
+        """Releases whatever the storage holds open."""
+
+    @property
+    def is_connected(self) -> bool:
+        return True
+
+    @abstractmethod
+    async def create_tracker(
+        self, channel_id: str, current_round: int
+    ) -> InitiativeTracker:
+        """Creates an empty tracker for a channel."""
+
+    @abstractmethod
+    async def get_tracker(self, channel_id: str) -> InitiativeTracker:
+        """Returns a channel's tracker."""
+
+    @abstractmethod
+    def recent_trackers(self, hours: int, limit: int) -> AsyncIterator[InitiativeTracker]:
+        """Yields the `limit` trackers last written within `hours`, oldest first."""
+
+    @abstractmethod
+    async def delete_tracker(self, channel_id: str):
+        """Deletes a channel's tracker and its members."""
+
+    @abstractmethod
+    async def set_message(self, channel_id: str, message_id: str | None):
+        """Sets the pinned message that shows a tracker, or clears it."""
+
+    @abstractmethod
+    async def add_participants(
+        self, channel_id: str, participants: list[Participant]
+    ) -> InitiativeTracker:
+        """Adds participants to a tracker."""
+
+    @abstractmethod
+    async def remove_participant(self, channel_id: str, name: str) -> InitiativeTracker:
+        """Removes a participant from a tracker, by name."""
+
+    @abstractmethod
+    async def update_participant(
+        self, channel_id: str, name: str, initiative: int, tiebreaker: int
+    ) -> InitiativeTracker:
+        """Changes a participant's initiative and tiebreaker."""
+
+    @abstractmethod
+    async def move(self, channel_id: str, steps: int) -> InitiativeTracker:
+        """Moves the current participant `steps` places, wrapping between rounds."""
+
+    @abstractmethod
+    async def goto_participant(self, channel_id: str, name: str) -> InitiativeTracker:
+        """Moves to a participant, by name."""
+
+    @abstractmethod
+    async def goto_round(self, channel_id: str, to_round: int) -> InitiativeTracker:
+        """Moves to the first participant of a round."""
+
+    async def undo(self, channel_id: str, steps: int) -> InitiativeTracker | None:
+        """Undoes the last `steps` changes, returning None if that undoes the tracker.
+
+        Raises NothingToUndoError if there aren't that many. Only storages that keep
+        trackers' histories can undo, and the others raise UndoUnsupportedError.
+        """
+        raise UndoUnsupportedError("Changes to trackers aren't kept here to undo!")
+
+    async def redo(self, channel_id: str, steps: int) -> InitiativeTracker | None:
+        """Redoes the last `steps` changes undone, since the last change made."""
+        raise UndoUnsupportedError("Changes to trackers aren't kept here to redo!")
+
+
+def tracker_not_found(channel_id: str) -> NotFoundError:
+    return NotFoundError(f"Initiative tracker for channel {channel_id} not found!")
+
+
+def participant_not_found(name: str) -> NotFoundError:
+    return NotFoundError(f"Participant {name} not found in this initiative!")
+
+
+# The rules below are the ones the Postgres statements follow, for storages that work on
+# whole trackers in the process. The tracker points at the member whose turn it is, and
+# only navigation, the first member joining and the current member leaving move it, each
+# bumping the tracker's version.
+
+
+def turn_order(participant: Participant) -> tuple[int, int, int]:
+    """Sorts saved participants by initiative, then tiebreaker, highest first."""
+    return -participant.initiative, -participant.tiebreaker, participant.id
+
+
+def pointed_at(
+    tracker: InitiativeTracker, member_id: int | None, current_round: int | None = None
+) -> InitiativeTracker:
+    """Returns the tracker pointing at another member, and in another round if given."""
+    return replace(
+        tracker,
+        current_member_id=member_id,
+        current_round=tracker.current_round if current_round is None else current_round,
+        version=tracker.version + 1,
+    )
+
+
+def joined(
+    tracker: InitiativeTracker, participants: list[Participant]
+) -> InitiativeTracker:
+    """Returns the tracker with saved participants added to it."""
+    merged = tuple(sorted(tracker.participants + tuple(participants), key=turn_order))
+    if tracker.current_member_id is not None or not participants:
+        return replace(tracker, participants=merged)
+    # whoever was implicitly current before stays current
+    first = (tracker.participants or sorted(participants, key=turn_order))[0]
+    return pointed_at(replace(tracker, participants=merged), first.id)
+
+
+def without(tracker: InitiativeTracker, name: str) -> InitiativeTracker:
+    """Returns the tracker without a participant, passing their turn on if it was."""
+    position = tracker.find_position(name)
+    if position is None:
+        raise participant_not_found(name)
+    removed = tracker.participants[position]
+    rest = tracker.participants[:position] + tracker.participants[position + 1 :]
+    if removed.id != tracker.current_member_id:
+        return replace(tracker, participants=rest)
+    # whoever was after them takes their turn, wrapping round to the first
+    successor = rest[position % len(rest)].id if rest else None
+    return pointed_at(replace(tracker, participants=rest), successor)
+
+
+def changed(
+    tracker: InitiativeTracker, name: str, initiative: int, tiebreaker: int
+) -> InitiativeTracker:
+    """Returns the tracker with a participant's initiative changed."""
+    participant = tracker.find_participant(name)
+    if participant is None:
+        raise participant_not_found(name)
+    participants = [p for p in tracker.participants if p.id != participant.id]
+    participants.append(Participant(name, initiative, tiebreaker, participant.id))
+    return replace(tracker, participants=tuple(sorted(participants, key=turn_order)))
+
+
+def moved(tracker: InitiativeTracker, steps: int) -> InitiativeTracker:
+    """Returns the tracker `steps` places on, wrapping around between rounds."""
+    if not tracker.participants:
+        return tracker
+    # floor division, so that stepping back past the first participant loses a round
+    rounds, position = divmod(tracker.current_index + steps, len(tracker.participants))
+    if tracker.current_round + rounds < 1:
+        raise BacktrackError("Cannot go back before round 1")
+    return pointed_at(
+        tracker, tracker.participants[position].id, tracker.current_round + rounds
+    )
+
+
+def went_to(tracker: InitiativeTracker, name: str) -> InitiativeTracker:
+    """Returns the tracker pointing at a participant, by name."""
+    participant = tracker.find_participant(name)
+    if participant is None:
+        raise participant_not_found(name)
+    return pointed_at(tracker, participant.id)
+
+
+def went_to_round(tracker: InitiativeTracker, to_round: int) -> InitiativeTracker:
+    """Returns the tracker at the first participant of a round."""
+    first = tracker.participants[0].id if tracker.participants else None
+    return pointed_at(tracker, first, to_round)
@@ -0,0 +1,467 @@
+import asyncio
+import json
+import logging
+import random
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from typing import AsyncIterator
+
+from databases import Database
+
+from app.constants import EVENT_SNAPSHOT_INTERVAL, TRACKER_CACHE_SIZE, UNDO_DEPTH
+from app.controllers.tracker import InitiativeTracker, Participant
+from app.database import ConnectionKeeper, Statement, fetch_statement
+from app.errors import (
+    AlreadyExistsError,
+    BacktrackError,
+    ConflictError,
+    NotFoundError,
+    NothingToUndoError,
+)
+from app.storage.base import (
+    Storage,
+    changed,
+    joined,
+    moved,
+    tracker_not_found,
+    went_to,
+    went_to_round,
+    without,
+)
+from app.storage.postgres import (
+    MAX_WRITE_ATTEMPTS,
+    RETRY_BACKOFF,
+    write_conflicts,
+    write_retries,
+)
+
+log = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, slots=True)
+class Event:
+    seq: int
+    kind: str
+    data: dict
+    # the event's row, which a tracker created by it is known by
+    id: int | None = None
+
+
+@dataclass(frozen=True, slots=True)
+class History:
+    """A channel's tracker as its events leave it, and the trackers it was and may be.
+
+    `past` holds the trackers changes can be undone back to, most recent first, and
+    `future` those undoing went back from, which redo returns to.
+    """
+
+    seq: int = 0
+    tracker: InitiativeTracker | None = None
+    past: tuple[InitiativeTracker | None, ...] = ()
+    future: tuple[InitiativeTracker | None, ...] = ()
+    # members are numbered within their channel, so events can say who they add
+    next_member_id: int = 1
+
+
+def _existing(channel_id: str, tracker: InitiativeTracker | None) -> InitiativeTracker:
+    if tracker is None:
+        raise tracker_not_found(channel_id)
+    return tracker
+
+
+def _travel(
+    history: History, steps: int, back: bool, channel_id: str
+) -> tuple[InitiativeTracker | None, tuple, tuple]:
+    """Undoes or redoes `steps` changes, and returns the tracker and the stacks after."""
+    source, target = history.past, history.future
+    if not back:
+        source, target = target, source
+    if steps > len(source):
+        raise NothingToUndoError(
+            f"Only {len(source)} changes to {'undo' if back else 'redo'} in channel "
+            f"{channel_id}!"
+        )
+    passed = (history.tracker,) + source[: steps - 1]
+    tracker = source[steps - 1]
+    if tracker is not None:
+        # which message shows the tracker isn't a change to it, so isn't undone
+        current = history.tracker or tracker
+        tracker = replace(
+            tracker, message_id=current.message_id, version=current.version + 1
+        )
+    return tracker, source[steps:], (tuple(reversed(passed)) + target)[:UNDO_DEPTH]
+
+
+def apply(history: History, channel_id: str, event: Event) -> History:
+    """Returns the history after an event, raising the error that stops it being made."""
+    tracker, data = history.tracker, event.data
+    next_member_id = history.next_member_id
+
+    if event.kind == "message":
+        tracker = replace(_existing(channel_id, tracker), message_id=data["message_id"])
+        return replace(history, seq=event.seq, tracker=tracker)
+    if event.kind in ("undo", "redo"):
+        back = event.kind == "undo"
+        tracker, source, target = _travel(history, data["steps"], back, channel_id)
+        past, future = (source, target) if back else (target, source)
+        return replace(history, seq=event.seq, tracker=tracker, past=past, future=future)
+
+    if event.kind == "create":
+        if tracker is not None:
+            raise AlreadyExistsError(
+                f"Initiative tracker for channel {channel_id} already exists!"
+            )
+        new = InitiativeTracker(event.id, channel_id, data["current_round"])
+    elif event.kind == "delete":
+        _existing(channel_id, tracker)
+        new = None
+    elif event.kind == "add":
+        tracker = _existing(channel_id, tracker)
+        participants = [Participant(n, i, t, id) for id, n, i, t in data["participants"]]
+        names = {p.name for p in tracker.participants}
+        for p in participants:
+            if p.name in names:
+                raise AlreadyExistsError(
+                    f"Participant {p.name} already exists in this initiative!"
+                )
+            names.add(p.name)
+        new = joined(tracker, participants)
+        next_member_id = max([next_member_id] + [p.id + 1 for p in participants])
+    elif event.kind == "remove":
+        new = without(_existing(channel_id, tracker), data["name"])
+    elif event.kind == "update":
+        new = changed(
+            _existing(channel_id, tracker),
+            data["name"],
+            data["initiative"],
+            data["tiebreaker"],
+        )
+    elif event.kind == "move":
+        new = moved(_existing(channel_id, tracker), data["steps"])
+    elif event.kind == "goto":
+        new = went_to(_existing(channel_id, tracker), data["name"])
+    elif event.kind == "round":
+        new = went_to_round(_existing(channel_id, tracker), data["to_round"])
+    else:
+        raise ValueError(f"Unknown initiative event {event.kind!r}")
+
+    return History(
+        seq=event.seq,
+        tracker=new,
+        past=((tracker,) + history.past)[:UNDO_DEPTH],
+        future=(),
+        next_member_id=next_member_id,
+    )
+
+
+def _next(
+    history: History, channel_id: str, kind: str, payload: dict
+) -> tuple[Event, History]:
+    """Returns a command's event, as the next in a history, and the history after it."""
+    data = payload
+    if kind == "add":
+        # numbered here, so that replaying the event numbers them the same way
+        data = {
+            "participants": [
+                [history.next_member_id + i, p.name, p.initiative, p.tiebreaker]
+                for i, p in enumerate(payload["participants"])
+            ]
+        }
+    event = Event(history.seq + 1, kind, data)
+    return event, apply(history, channel_id, event)
+
+
+def _encode(history: History) -> str:
+    """Encodes a history for a snapshot, writing each distinct participant list once."""
+    rosters, positions = [], {}
+
+    def encode(tracker: InitiativeTracker | None):
+        if tracker is None:
+            return None
+        # most of the trackers in a history share their participants with another
+        key = id(tracker.participants)
+        if key not in positions:
+            positions[key] = len(rosters)
+            rosters.append(
+                [[p.id, p.name, p.initiative, p.tiebreaker] for p in tracker.participants]
+            )
+        return [
+            tracker.id,
+            tracker.current_round,
+            tracker.current_member_id,
+            tracker.version,
+            tracker.message_id,
+            positions[key],
+        ]
+
+    return json.dumps(
+        {
+            "seq": history.seq,
+            "tracker": encode(history.tracker),
+            "past": [encode(t) for t in history.past],
+            "future": [encode(t) for t in history.future],
+            "next_member_id": history.next_member_id,
+            "rosters": rosters,
+        }
+    )
+
+
+def _decode(channel_id: str, state: str | None) -> History:
+    if state is None:
+        return History()
+    state = json.loads(state)
+    rosters = [
+        tuple(Participant(n, i, t, id) for id, n, i, t in roster)
+        for roster in state["rosters"]
+    ]
+
+    def decode(tracker: list | None) -> InitiativeTracker | None:
+        if tracker is None:
+            return None
+        *columns, roster = tracker
+        return InitiativeTracker(*columns[:1], channel_id, *columns[1:], rosters[roster])
+
+    return History(
+        seq=state["seq"],
+        tracker=decode(state["tracker"]),
+        past=tuple(decode(t) for t in state["past"]),
+        future=tuple(decode(t) for t in state["future"]),
+        next_member_id=state["next_member_id"],
+    )
+
+
+def _history_from_row(channel_id: str, row) -> History:
+    """Rebuilds a history from its latest snapshot and the events after it."""
+    history = _decode(channel_id, row["state"])
+    for event in json.loads(row["tail"] or "[]"):
+        history = apply(history, channel_id, Event(**event))
+    return history
+
+
+_TAIL = """(
+    SELECT json_agg(
+        json_build_object('seq', e.seq, 'kind', e.kind, 'data', e.data, 'id', e.id)
+        ORDER BY e.seq
+    )
+    FROM initiative_events e
+    WHERE e.channel_id = c.channel_id AND e.seq > coalesce(s.seq, 0)
+) AS tail"""
+
+_LOAD_HISTORY = Statement(
+    "load_history",
+    f"""
+SELECT c.channel_id, CAST(s.state AS text) AS state, {_TAIL}
+FROM (SELECT CAST(:channel_id AS text) AS channel_id) c
+LEFT JOIN initiative_snapshots s ON s.channel_id = c.channel_id
+""",
+)
+
+# an event that another writer numbered first is not written, and nothing comes back
+_APPEND_EVENT = Statement(
+    "append_event",
+    """
+INSERT INTO initiative_events (channel_id, seq, kind, data)
+VALUES (:channel_id, :seq, :kind, CAST(:data AS jsonb))
+ON CONFLICT (channel_id, seq) DO NOTHING
+RETURNING id
+""",
+)
+
+_SAVE_SNAPSHOT = """
+INSERT INTO initiative_snapshots (channel_id, seq, state)
+VALUES (:channel_id, :seq, CAST(:state AS jsonb))
+ON CONFLICT (channel_id) DO UPDATE
+SET seq = excluded.seq, state = excluded.state, created_at = now()
+WHERE initiative_snapshots.seq < excluded.seq
+"""
+
+# the channels with events in the last :hours, oldest first, as _RECENT_TRACKERS
+_RECENT_HISTORIES = f"""
+SELECT c.channel_id, CAST(s.state AS text) AS state, {_TAIL}
+FROM (
+    SELECT channel_id, max(created_at) AS updated_at FROM initiative_events
+    WHERE created_at > now() - make_interval(hours => :hours)
+    GROUP BY channel_id ORDER BY updated_at DESC LIMIT :limit
+) c
+LEFT JOIN initiative_snapshots s ON s.channel_id = c.channel_id
+ORDER BY c.updated_at
+"""
+
+
+class EventStorage(Storage):
+    """Keeps every change to every tracker in Postgres, as an append-only log of events.
+
+    A tracker is rebuilt from its latest snapshot and the events since, and snapshotted
+    every EVENT_SNAPSHOT_INTERVAL events. Each write is a single insert of the channel's
+    next event, checked against the channel's history as this process last saw it; if
+    another writer added that event first, the history is reloaded and the write tried
+    again. Any change can be undone, up to UNDO_DEPTH of them, and redone.
+    """
+
+    def __init__(
+        self, database: Database, snapshot_interval: int = EVENT_SNAPSHOT_INTERVAL
+    ):
+        self.database = database
+        self.snapshot_interval = snapshot_interval
+        # the history last seen of recently written channels, so writes needn't read first
+        self._histories: OrderedDict[str, History] = OrderedDict()
+        self._keeping: asyncio.Task | None = None
+
+    async def connect(self):
+        # kept connected the same way as PostgresStorage
+        keeper = ConnectionKeeper(self.database)
+        await keeper.connect()
+        self._keeping = asyncio.create_task(keeper.run())
+
+    async def disconnect(self):
+        if self._keeping is not None:
+            self._keeping.cancel()
+            self._keeping = None
+        await self.database.disconnect()
+
+    @property
+    def is_connected(self) -> bool:
+        return self.database.is_connected
+
+    def _remember(self, channel_id: str, history: History):
+        self._histories[channel_id] = history
+        self._histories.move_to_end(channel_id)
+        if len(self._histories) > TRACKER_CACHE_SIZE:
+            self._histories.popitem(last=False)
+
+    async def _load(self, channel_id: str) -> History:
+        row = await fetch_statement(
+            self.database, _LOAD_HISTORY, {"channel_id": channel_id}
+        )
+        history = _history_from_row(channel_id, row)
+        self._remember(channel_id, history)
+        return history
+
+    async def _append(self, channel_id: str, kind: str, payload: dict) -> History:
+        """Adds an event to a channel's log, and returns the history it leads to."""
+        history = self._histories.get(channel_id)
+        for attempt in range(MAX_WRITE_ATTEMPTS):
+            if attempt:
+                write_retries.inc(operation=kind)
+                await asyncio.sleep(random.uniform(0, RETRY_BACKOFF * 2**attempt))
+
+            if history is None:
+                history = await self._load(channel_id)
+                event, new = _next(history, channel_id, kind, payload)
+            else:
+                try:
+                    event, new = _next(history, channel_id, kind, payload)
+                except (
+                    AlreadyExistsError,
+                    BacktrackError,
+                    NotFoundError,
+                    NothingToUndoError,
+                ):
+                    # only wrong, perhaps, about a channel another process has changed
+                    history = await self._load(channel_id)
+                    event, new = _next(history, channel_id, kind, payload)
+
+            row = await fetch_statement(
+                self.database,
+                _APPEND_EVENT,
+                {
+                    "channel_id": channel_id,
+                    "seq": event.seq,
+                    "kind": kind,
+                    "data": json.dumps(event.data),
+                },
+            )
+            if row is not None:
+                break
+
+            write_conflicts.inc(operation=kind)
+            log.info(f"{kind} lost a race in channel {channel_id}, retrying")
+            history = None
+        else:
+            raise ConflictError(
+                f"Initiative tracker for channel {channel_id} "
+                "is changing too fast to update!"
+            )
+
+        if kind == "create":
+            new = replace(new, tracker=replace(new.tracker, id=row["id"]))
+        self._remember(channel_id, new)
+        if new.seq % self.snapshot_interval == 0:
+            try:
+                await self.database.execute(
+                    _SAVE_SNAPSHOT,
+                    {"channel_id": channel_id, "seq": new.seq, "state": _encode(new)},
+                )
+            except Exception:
+                # the event is written, and the channel is rebuilt from the last snapshot
+                # and more events until the next one
+                log.exception(f"Could not snapshot the tracker in channel {channel_id}")
+        return new
+
+    async def create_tracker(
+        self, channel_id: str, current_round: int
+    ) -> InitiativeTracker:
+        history = await self._append(
+            channel_id, "create", {"current_round": current_round}
+        )
+        return history.tracker
+
+    async def get_tracker(self, channel_id: str) -> InitiativeTracker:
+        history = await self._load(channel_id)
+        return _existing(channel_id, history.tracker)
+
+    async def recent_trackers(
+        self, hours: int, limit: int
+    ) -> AsyncIterator[InitiativeTracker]:
+        async for row in self.database.iterate(
+            _RECENT_HISTORIES, {"hours": hours, "limit": limit}
+        ):
+            history = _history_from_row(row["channel_id"], row)
+            if history.tracker is not None:
+                yield history.tracker
+
+    async def delete_tracker(self, channel_id: str):
+        await self._append(channel_id, "delete", {})
+
+    async def set_message(self, channel_id: str, message_id: str | None):
+        await self._append(channel_id, "message", {"message_id": message_id})
+
+    async def add_participants(
+        self, channel_id: str, participants: list[Participant]
+    ) -> InitiativeTracker:
+        history = await self._append(channel_id, "add", {"participants": participants})
+        return history.tracker
+
+    async def remove_participant(self, channel_id: str, name: str) -> InitiativeTracker:
+        history = await self._append(channel_id, "remove", {"name": name})
+        return history.tracker
+
+    async def update_participant(
+        self, channel_id: str, name: str, initiative: int, tiebreaker: int
+    ) -> InitiativeTracker:
+        history = await self._append(
+            channel_id,
+            "update",
+            {"name": name, "initiative": initiative, "tiebreaker": tiebreaker},
+        )
+        return history.tracker
+
+    async def move(self, channel_id: str, steps: int) -> InitiativeTracker:
+        history = await self._append(channel_id, "move", {"steps": steps})
+        return history.tracker
+
+    async def goto_participant(self, channel_id: str, name: str) -> InitiativeTracker:
+        history = await self._append(channel_id, "goto", {"name": name})
+        return history.tracker
+
+    async def goto_round(self, channel_id: str, to_round: int) -> InitiativeTracker:
+        history = await self._append(channel_id, "round", {"to_round": to_round})
+        return history.tracker
+
+    async def undo(self, channel_id: str, steps: int) -> InitiativeTracker | None:
+        history = await self._append(channel_id, "undo", {"steps": steps})
+        return history.tracker
+
+    async def redo(self, channel_id: str, steps: int) -> InitiativeTracker | None:
+        history = await self._append(channel_id, "redo", {"steps": steps})
+        return history.tracker
@@ -0,0 +1,451 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from typing import AsyncIterator
+
+from app.constants import (
+    JOURNAL_FLUSH_INTERVAL,
+    JOURNAL_REPLAY_ATTEMPTS,
+    TRACKER_CACHE_SIZE,
+    TRACKER_CACHE_TTL,
+)
+from app.controllers.tracker import InitiativeTracker, Participant
+from app.errors import (
+    AlreadyExistsError,
+    BacktrackError,
+    JournalReplayError,
+    NotFoundError,
+)
+from app.metrics import Counter, Gauge, Histogram
+from app.storage.base import Storage
+from app.storage.memory import MemoryStorage
+
+log = logging.getLogger(__name__)
+
+journal_fsync_seconds = Histogram(
+    "journal_fsync_seconds", "Time taken to write and sync changes to the journal"
+)
+pending_changes = Gauge(
+    "journal_pending_changes", "Journalled changes not yet written to the backing storage"
+)
+flushed_changes = Counter(
+    "journal_flushed_changes_total", "Journalled changes written to the backing storage"
+)
+dropped_changes = Counter(
+    "journal_dropped_changes_total",
+    "Journalled changes the backing storage refused, and which were set aside",
+)
+evicted_trackers = Counter(
+    "journal_evicted_trackers_total",
+    "Flushed trackers dropped from memory, to be loaded again when next used",
+)
+
+
+@dataclass(frozen=True)
+class JournalEntry:
+    """A change made to a tracker, as written to the journal.
+
+    `operation` names the Storage method that makes the change, and `arguments` are what
+    it is called with after the channel id, as JSON would have them.
+    """
+
+    seq: int
+    channel_id: str
+    operation: str
+    arguments: tuple
+
+    def to_json(self) -> str:
+        return json.dumps(
+            [self.seq, self.channel_id, self.operation, self.arguments],
+            separators=(",", ":"),
+        )
+
+    @classmethod
+    def from_json(cls, line: str) -> "JournalEntry":
+        seq, channel_id, operation, arguments = json.loads(line)
+        return cls(seq, channel_id, operation, tuple(arguments))
+
+
+def _encode(operation: str, arguments: tuple) -> tuple:
+    if operation == "add_participants":
+        return ([[p.name, p.initiative, p.tiebreaker] for p in arguments[0]],)
+    return arguments
+
+
+def _decode(operation: str, arguments: tuple) -> tuple:
+    if operation == "add_participants":
+        return ([Participant(*p) for p in arguments[0]],)
+    return arguments
+
+
+def _coalesced(entries: list[JournalEntry]) -> list[JournalEntry]:
+    """Merges a channel's consecutive moves into one, as moving is additive."""
+    merged: list[JournalEntry] = []
+    for entry in entries:
+        if entry.operation == "move" and merged and merged[-1].operation == "move":
+            steps = merged[-1].arguments[0] + entry.arguments[0]
+            entry = JournalEntry(entry.seq, entry.channel_id, "move", (steps,))
+            merged.pop()
+        merged.append(entry)
+    return merged
+
+
+def _read_journal(path: str) -> list[JournalEntry]:
+    """Reads the entries in a journal, up to a last one cut short by a crash."""
+    entries = []
+    try:
+        with open(path, encoding="utf-8") as journal:
+            for line in journal:
+                try:
+                    entries.append(JournalEntry.from_json(line))
+                except ValueError:
+                    log.warning("Ignoring a partly written entry at the end of %s", path)
+                    break
+    except FileNotFoundError:
+        pass
+    return entries
+
+
+def _read_marks(path: str) -> dict[str, int]:
+    """Reads how far each channel's changes were flushed, by the last entry flushed."""
+    marks: dict[str, int] = {}
+    try:
+        with open(path, encoding="utf-8") as flushed:
+            for line in flushed:
+                try:
+                    channel_id, seq = json.loads(line)
+                except ValueError:
+                    break
+                marks[channel_id] = max(seq, marks.get(channel_id, 0))
+    except FileNotFoundError:
+        pass
+    return marks
+
+
+def _append_line(path: str, line: str):
+    with open(path, "a", encoding="utf-8") as file:
+        file.write(line + "\n")
+        file.flush()
+        os.fsync(file.fileno())
+
+
+class JournalStorage(MemoryStorage):
+    """Keeps trackers in the process, writing them behind to another storage.
+
+    Changes are made in memory and written to a local journal, synced to disk before
+    they are answered, so commands never wait on the database. Every `flush_interval`
+    seconds the changes since the last flush are made to the backing storage, channels
+    side by side, and the journal is cut down to those that haven't been. Whatever was
+    journalled but never flushed is flushed on connecting, before anything is answered.
+
+    Each change flushed is marked as such in `path`.flushed, which replaying skips past,
+    so a crash before the journal is cut doesn't flush changes twice; only one between
+    making a change and marking it can. Changes the backing storage refuses are set
+    aside in `path`.refused, in the journal's format.
+
+    Like the tracker cache, it keeps at most `max_size` trackers in memory, and drops
+    those unused for `ttl` seconds, least recently used first. Only trackers with all
+    their changes flushed are dropped, and they are loaded again when next used.
+
+    The process must be the only one writing the backing storage's trackers.
+    """
+
+    def __init__(
+        self,
+        backing: Storage,
+        path: str,
+        flush_interval: float = JOURNAL_FLUSH_INTERVAL,
+        clock=time.time,
+        replay_attempts: int = JOURNAL_REPLAY_ATTEMPTS,
+        max_size: int = TRACKER_CACHE_SIZE,
+        ttl: float = TRACKER_CACHE_TTL,
+    ):
+        super().__init__(clock)
+        self.backing = backing
+        self.path = path
+        self.flushed_path = path + ".flushed"
+        self.refused_path = path + ".refused"
+        self.flush_interval = flush_interval
+        self.replay_attempts = replay_attempts
+        self.max_size = max_size
+        self.ttl = ttl
+        # when each tracker in memory was last used, least recently first
+        self._used: OrderedDict[str, float] = OrderedDict()
+        self._file = None
+        self._seq = 0
+        # the last entry written to the journal, so one sync covers all the entries
+        # made while the last was being synced
+        self._written = 0
+        self._unwritten: list[JournalEntry] = []
+        self._pending: list[JournalEntry] = []
+        # channels deleted here, which the backing storage may still have
+        self._deleted: set[str] = set()
+        self._file_lock = asyncio.Lock()
+        self._marks_lock = asyncio.Lock()
+        self._flush_lock = asyncio.Lock()
+        self._stopping = asyncio.Event()
+        self._flusher: asyncio.Task | None = None
+
+    async def connect(self):
+        await self.backing.connect()
+        journalled = _read_journal(self.path)
+        marks = _read_marks(self.flushed_path)
+        self._pending = [e for e in journalled if e.seq > marks.get(e.channel_id, 0)]
+        # numbered after whatever the marks are of, which may outlive their entries
+        self._seq = self._written = max(
+            [e.seq for e in journalled] + list(marks.values()), default=0
+        )
+        if len(self._pending) < len(journalled):
+            log.info(
+                "Skipping %d journalled changes already flushed",
+                len(journalled) - len(self._pending),
+            )
+        if self._pending:
+            log.info("Replaying %d journalled changes", len(self._pending))
+        for attempt in range(self.replay_attempts):
+            if attempt:
+                await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            if not self._pending:
+                break
+        else:
+            raise JournalReplayError(
+                f"{len(self._pending)} journalled changes in {self.path} couldn't be "
+                "written to the backing storage"
+            )
+        # the journal may have been empty, or cut short
+        await self._rewrite()
+        self._stopping.clear()
+        self._flusher = asyncio.create_task(self._flush_periodically())
+
+    async def disconnect(self):
+        if self._flusher is not None:
+            self._stopping.set()
+            await self._flusher
+            self._flusher = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        await self.backing.disconnect()
+
+    @property
+    def is_connected(self) -> bool:
+        return self.backing.is_connected
+
+    async def _flush_periodically(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.flush_interval)
+            except TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception:
+                log.exception("Failed to flush the journal")
+
+    async def flush(self) -> int | None:
+        """Makes the journalled changes to the backing storage, and returns how many.
+
+        Changes the backing storage refuses, as it no longer agrees with the journal,
+        are logged and set aside. Those that fail otherwise stay journalled, with the
+        rest of their channel's, to be tried again. Returns None if there was nothing
+        to do.
+        """
+        async with self._flush_lock:
+            batch, self._pending = self._pending, []
+            if not batch:
+                self._evict()
+                return None
+            by_channel: defaultdict[str, list[JournalEntry]] = defaultdict(list)
+            for entry in batch:
+                by_channel[entry.channel_id].append(entry)
+            unflushed = await asyncio.gather(
+                *(self._flush_channel(_coalesced(e)) for e in by_channel.values())
+            )
+            failed = sorted((e for f in unflushed for e in f), key=lambda e: e.seq)
+            self._pending = failed + self._pending
+            await self._rewrite()
+            self._evict()
+            return len(batch) - len(failed)
+
+    def _evict(self):
+        """Drops idle trackers from memory, and those past `max_size`, once flushed."""
+        pending = {e.channel_id for e in self._pending}
+        # the backing storage no longer has those whose deletion was flushed
+        self._deleted &= pending
+        idle_since = self._clock() - self.ttl
+        for channel_id, used in list(self._used.items()):
+            if used > idle_since and len(self._used) <= self.max_size:
+                break
+            if channel_id in pending:
+                continue
+            del self._used[channel_id]
+            if self._trackers.pop(channel_id, None) is not None:
+                del self._updated[channel_id]
+                evicted_trackers.inc()
+
+    async def _flush_channel(self, entries: list[JournalEntry]) -> list[JournalEntry]:
+        """Makes one channel's changes in order, returning those it couldn't make."""
+        for i, entry in enumerate(entries):
+            try:
+                await getattr(self.backing, entry.operation)(
+                    entry.channel_id, *_decode(entry.operation, entry.arguments)
+                )
+            except (AlreadyExistsError, BacktrackError, NotFoundError) as e:
+                log.error(
+                    "The backing storage refused journalled %s for channel %s, "
+                    "setting it aside in %s: %s",
+                    entry.operation,
+                    entry.channel_id,
+                    self.refused_path,
+                    e,
+                )
+                dropped_changes.inc()
+                await self._write_line(self.refused_path, entry.to_json())
+            except Exception:
+                log.exception("Failed to flush channel %s", entry.channel_id)
+                return entries[i:]
+            else:
+                flushed_changes.inc()
+            await self._write_line(
+                self.flushed_path, json.dumps([entry.channel_id, entry.seq])
+            )
+        return []
+
+    async def _write_line(self, path: str, line: str):
+        async with self._marks_lock:
+            await asyncio.to_thread(_append_line, path, line)
+
+    def _append(self, entries: list[JournalEntry]):
+        self._file.write("".join(e.to_json() + "\n" for e in entries))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _replace(self, entries: list[JournalEntry]):
+        if self._file is not None:
+            self._file.close()
+        temporary = self.path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as journal:
+            journal.write("".join(e.to_json() + "\n" for e in entries))
+            journal.flush()
+            os.fsync(journal.fileno())
+        os.replace(temporary, self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    async def _rewrite(self):
+        """Cuts the journal down to the changes that are still to be flushed."""
+        async with self._file_lock:
+            # entries still waiting to be written will be, after this
+            written = [e for e in self._pending if e.seq <= self._written]
+            await asyncio.to_thread(self._replace, written)
+        # the journal no longer has the entries they mark
+        async with self._marks_lock:
+            await asyncio.to_thread(self._forget_marks)
+        pending_changes.set(len(self._pending))
+
+    def _forget_marks(self):
+        try:
+            os.remove(self.flushed_path)
+        except FileNotFoundError:
+            pass
+
+    async def _journal(self, entry: JournalEntry):
+        """Writes an entry to the journal, returning once it's synced to disk."""
+        self._unwritten.append(entry)
+        self._pending.append(entry)
+        pending_changes.set(len(self._pending))
+        async with self._file_lock:
+            if entry.seq <= self._written:
+                # synced along with an earlier one
+                return
+            entries, self._unwritten = self._unwritten, []
+            start = time.perf_counter()
+            await asyncio.to_thread(self._append, entries)
+            journal_fsync_seconds.observe(time.perf_counter() - start)
+            self._written = entries[-1].seq
+
+    def _touch(self, channel_id: str):
+        self._used[channel_id] = self._clock()
+        self._used.move_to_end(channel_id)
+
+    async def _load(self, channel_id: str):
+        """Brings a channel's tracker into memory from the backing storage, if there."""
+        if channel_id in self._trackers or channel_id in self._deleted:
+            return
+        try:
+            tracker = await self.backing.get_tracker(channel_id)
+        except NotFoundError:
+            return
+        # another command may have loaded it meanwhile, and changed it since
+        if channel_id not in self._trackers:
+            self._trackers[channel_id] = tracker
+            self._updated[channel_id] = self._clock()
+            self._touch(channel_id)
+
+    async def _write(self, operation: str, channel_id: str, *arguments):
+        """Makes a change in memory, then journals it."""
+        await self._load(channel_id)
+        result = await getattr(super(), operation)(channel_id, *arguments)
+        self._touch(channel_id)
+        self._seq += 1
+        await self._journal(
+            JournalEntry(self._seq, channel_id, operation, _encode(operation, arguments))
+        )
+        return result
+
+    async def create_tracker(
+        self, channel_id: str, current_round: int
+    ) -> InitiativeTracker:
+        tracker = await self._write("create_tracker", channel_id, current_round)
+        self._deleted.discard(channel_id)
+        return tracker
+
+    async def get_tracker(self, channel_id: str) -> InitiativeTracker:
+        await self._load(channel_id)
+        tracker = self._get(channel_id)
+        self._touch(channel_id)
+        return tracker
+
+    async def recent_trackers(
+        self, hours: int, limit: int
+    ) -> AsyncIterator[InitiativeTracker]:
+        # so that the backing storage knows every tracker there is
+        await self.flush()
+        async for tracker in self.backing.recent_trackers(hours, limit):
+            if tracker.channel_id not in self._deleted:
+                yield self._trackers.get(tracker.channel_id, tracker)
+
+    async def delete_tracker(self, channel_id: str):
+        await self._write("delete_tracker", channel_id)
+        self._deleted.add(channel_id)
+
+    async def set_message(self, channel_id: str, message_id: str | None):
+        await self._write("set_message", channel_id, message_id)
+
+    async def add_participants(
+        self, channel_id: str, participants: list[Participant]
+    ) -> InitiativeTracker:
+        return await self._write("add_participants", channel_id, participants)
+
+    async def remove_participant(self, channel_id: str, name: str) -> InitiativeTracker:
+        return await self._write("remove_participant", channel_id, name)
+
+    async def update_participant(
+        self, channel_id: str, name: str, initiative: int, tiebreaker: int
+    ) -> InitiativeTracker:
+        return await self._write(
+            "update_participant", channel_id, name, initiative, tiebreaker
+        )
+
+    async def move(self, channel_id: str, steps: int) -> InitiativeTracker:
+        return await self._write("move", channel_id, steps)
+
+    async def goto_participant(self, channel_id: str, name: str) -> InitiativeTracker:
+        return await self._write("goto_participant", channel_id, name)
+
+    async def goto_round(self, channel_id: str, to_round: int) -> InitiativeTracker:
+        return await self._write("goto_round", channel_id, to_round)
@@ -0,0 +1,121 @@
+import itertools
+import time
+from dataclasses import replace
+from typing import AsyncIterator
+
+from app.controllers.tracker import InitiativeTracker, Participant
+from app.errors import AlreadyExistsError
+from app.storage.base import (
+    Storage,
+    changed,
+    joined,
+    moved,
+    tracker_not_found,
+    went_to,
+    went_to_round,
+    without,
+)
+
+
+class MemoryStorage(Storage):
+    """Keeps trackers in the process, for tests and deployments that can lose them.
+
+    Nothing here waits, so every operation happens at once as far as other commands are
+    concerned, and trackers never conflict.
+    """
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self._trackers: dict[str, InitiativeTracker] = {}
+        # when each tracker was last written
+        self._updated: dict[str, float] = {}
+        self._tracker_ids = itertools.count(1)
+
+    def _get(self, channel_id: str) -> InitiativeTracker:
+        tracker = self._trackers.get(channel_id)
+        if tracker is None:
+            raise tracker_not_found(channel_id)
+        return tracker
+
+    def _put(self, new: InitiativeTracker) -> InitiativeTracker:
+        self._trackers[new.channel_id] = new
+        # as with the Postgres statements, membership changes count as writes too
+        self._updated[new.channel_id] = self._clock()
+        return new
+
+    async def create_tracker(
+        self, channel_id: str, current_round: int
+    ) -> InitiativeTracker:
+        if channel_id in self._trackers:
+            raise AlreadyExistsError(
+                f"Initiative tracker for channel {channel_id} already exists!"
+            )
+        tracker = InitiativeTracker(next(self._tracker_ids), channel_id, current_round)
+        self._trackers[channel_id] = tracker
+        self._updated[channel_id] = self._clock()
+        return tracker
+
+    async def get_tracker(self, channel_id: str) -> InitiativeTracker:
+        return self._get(channel_id)
+
+    async def recent_trackers(
+        self, hours: int, limit: int
+    ) -> AsyncIterator[InitiativeTracker]:
+        since = self._clock() - hours * 3600
+        recent = sorted(
+            (updated, channel_id)
+            for channel_id, updated in self._updated.items()
+            if updated > since
+        )
+        for _, channel_id in recent[max(len(recent) - limit, 0) :]:
+            yield self._trackers[channel_id]
+
+    async def delete_tracker(self, channel_id: str):
+        self._get(channel_id)
+        del self._trackers[channel_id]
+        del self._updated[channel_id]
+
+    async def set_message(self, channel_id: str, message_id: str | None):
+        self._trackers[channel_id] = replace(self._get(channel_id), message_id=message_id)
+        self._updated[channel_id] = self._clock()
+
+    async def add_participants(
+        self, channel_id: str, participants: list[Participant]
+    ) -> InitiativeTracker:
+        tracker = self._get(channel_id)
+        names = {p.name for p in tracker.participants}
+        for p in participants:
+            if p.name in names:
+                raise AlreadyExistsError(
+                    f"Participant {p.name} already exists in this initiative!"
+                )
+            names.add(p.name)
+        # numbered within the tracker, which may have been loaded from elsewhere
+        first = max((p.id for p in tracker.participants), default=0) + 1
+        saved = [
+            Participant(p.name, p.initiative, p.tiebreaker, first + i)
+            for i, p in enumerate(participants)
+        ]
+        return self._put(joined(tracker, saved))
+
+    async def remove_participant(self, channel_id: str, name: str) -> InitiativeTracker:
+        tracker = self._get(channel_id)
+        return self._put(without(tracker, name))
+
+    async def update_participant(
+        self, channel_id: str, name: str, initiative: int, tiebreaker: int
+    ) -> InitiativeTracker:
+        tracker = self._get(channel_id)
+        return self._put(changed(tracker, name, initiative, tiebreaker))
+
+    async def move(self, channel_id: str, steps: int) -> InitiativeTracker:
+        tracker = self._get(channel_id)
+        return self._put(moved(tracker, steps))
+
+    async def goto_participant(self, channel_id: str, name: str) -> InitiativeTracker:
+        tracker = self._get(channel_id)
+        return self._put(went_to(tracker, name))
+
+    async def goto_round(self, channel_id: str, to_round: int) -> InitiativeTracker:
+        tracker = self._get(channel_id)
+        return self._put(went_to_round(tracker, to_round))
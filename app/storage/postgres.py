@@ -0,0 +1,559 @@
+import asyncio
+import json
+import logging
+import random
+from functools import lru_cache
+from typing import AsyncIterator
+
+from asyncpg.exceptions import ForeignKeyViolationError, UniqueViolationError
+from databases import Database
+
+from app.constants import TRACKER_CACHE_SIZE
+from app.controllers.tracker import InitiativeTracker, Participant
+from app.database import ConnectionKeeper, Statement, fetch_statement
+from app.errors import AlreadyExistsError, BacktrackError, ConflictError
+from app.metrics import Counter
+from app.storage.base import Storage, participant_not_found, tracker_not_found
+
+log = logging.getLogger(__name__)
+
+# how many times a write is tried before giving up on a tracker that others keep changing
+MAX_WRITE_ATTEMPTS = 5
+# seconds; retries back off exponentially from this, jittered so writers fall out of step
+RETRY_BACKOFF = 0.005
+
+write_conflicts = Counter(
+    "initiative_write_conflicts_total",
+    "Tracker writes that lost a compare-and-swap to another writer",
+)
+write_retries = Counter(
+    "initiative_write_retries_total", "Tracker writes that were retried after a conflict"
+)
+
+
+# Every mutation below is a single statement, so the new state of the tracker comes
+# back from the same round trip that changed it. In each of them, `tracker` is the
+# channel's tracker row and `live_members` its members as they were when the statement
+# started, `members` is the member list after the statement, and `final` is the tracker
+# row after the statement.
+#
+# The tracker points at the member whose turn it is rather than at a position in the
+# turn order, so members can join, leave and change places without moving the pointer.
+# Only navigation moves it, along with the two membership changes that have to: the
+# first member joining, and the current member leaving. Those writes are a
+# compare-and-swap on the tracker's version, which each of them bumps: if another command
+# changed the tracker since `tracker` was read, `updated` is empty, nothing else is
+# written, and `conflict` tells the caller to try again. Other membership changes only
+# bump the tracker's updated_at, in `touched`, so that it still counts as in play.
+_TRACKER_CTE = (
+    "tracker AS (SELECT * FROM initiative_trackers WHERE channel_id = :channel_id)"
+)
+# only the columns in ix_initiative_members_turn_order, so members can be read index-only
+_LIVE_MEMBERS_CTE = """live_members AS (
+    SELECT m.id, m.player_name, m.init_value, m.tiebreaker
+    FROM initiative_members m JOIN tracker t ON m.initiative_id = t.id
+    WHERE m.deleted_at IS NULL
+)"""
+# the member the tracker points at, or the first one if it doesn't point at anybody
+_CURRENT_MEMBER_CTE = """current_member AS (
+    SELECT m.id, m.init_value, m.tiebreaker
+    FROM initiative_members m JOIN tracker t ON m.id = t.current_member_id
+    UNION ALL (
+        SELECT m.id, m.init_value, m.tiebreaker
+        FROM initiative_members m JOIN tracker t ON m.initiative_id = t.id
+        WHERE t.current_member_id IS NULL AND m.deleted_at IS NULL
+        ORDER BY m.init_value DESC, m.tiebreaker DESC, m.id LIMIT 1
+    )
+)"""
+_FINAL_CTE = """final AS (
+    SELECT * FROM updated
+    UNION ALL SELECT * FROM tracker WHERE NOT EXISTS (SELECT FROM updated)
+)"""
+_TURN_ORDER = "init_value DESC, tiebreaker DESC, id"
+_PARTICIPANTS_JSON = f"""json_agg(
+    json_build_object(
+        'id', p.id, 'name', p.player_name,
+        'initiative', p.init_value, 'tiebreaker', p.tiebreaker
+    )
+    ORDER BY p.init_value DESC, p.tiebreaker DESC, p.id
+)"""
+_TRACKER_COLUMNS = f"""f.id, f.channel_id, f.current_round, f.current_member_id,
+    f.version, f.message_id,
+    (SELECT {_PARTICIPANTS_JSON} FROM members p) AS participants"""
+
+
+def _conflict(attempted: str = "TRUE") -> str:
+    """Flags a write that was attempted but lost the compare-and-swap."""
+    return f"({attempted}) AND NOT EXISTS (SELECT FROM updated) AS conflict"
+
+
+_GET_INITIATIVE = Statement(
+    "get_initiative",
+    f"""
+SELECT f.id, f.channel_id, f.current_round, f.current_member_id, f.version,
+    f.message_id,
+    {_PARTICIPANTS_JSON} FILTER (WHERE p.id IS NOT NULL) AS participants
+FROM initiative_trackers f
+LEFT JOIN initiative_members p ON p.initiative_id = f.id AND p.deleted_at IS NULL
+WHERE f.channel_id = :channel_id
+GROUP BY f.id
+""",
+)
+
+_ADD_PARTICIPANTS = Statement(
+    "add_participants",
+    f"""
+WITH {_TRACKER_CTE},
+{_LIVE_MEMBERS_CTE},
+entries AS (
+    SELECT * FROM ROWS FROM (
+        jsonb_to_recordset(CAST(:entries AS jsonb))
+            AS (name text, initiative integer, tiebreaker integer)
+    ) WITH ORDINALITY AS e(name, initiative, tiebreaker, position)
+),
+new_members AS (
+    INSERT INTO initiative_members (initiative_id, player_name, init_value, tiebreaker)
+    SELECT t.id, e.name, e.initiative, e.tiebreaker FROM tracker t, entries e
+    ORDER BY e.position
+    RETURNING id, player_name, init_value, tiebreaker
+),
+members AS (SELECT * FROM live_members UNION ALL SELECT * FROM new_members),
+updated AS (
+    -- only a tracker that doesn't point at anybody yet needs its pointer set; whoever
+    -- was implicitly current before stays current
+    UPDATE initiative_trackers it SET version = it.version + 1, updated_at = now(),
+        current_member_id = coalesce(
+            (SELECT id FROM live_members ORDER BY {_TURN_ORDER} LIMIT 1),
+            (SELECT id FROM new_members ORDER BY {_TURN_ORDER} LIMIT 1)
+        )
+    FROM tracker t
+    WHERE it.id = t.id AND it.current_member_id IS NULL
+        AND EXISTS (SELECT FROM new_members)
+    RETURNING it.*
+),
+touched AS (
+    UPDATE initiative_trackers it SET updated_at = now()
+    FROM tracker t
+    WHERE it.id = t.id AND t.current_member_id IS NOT NULL
+        AND EXISTS (SELECT FROM new_members)
+),
+{_FINAL_CTE}
+SELECT {_TRACKER_COLUMNS}, FALSE AS conflict FROM final f
+""",
+)
+
+_REMOVE_PARTICIPANT = Statement(
+    "remove_participant",
+    f"""
+WITH {_TRACKER_CTE},
+{_LIVE_MEMBERS_CTE},
+target AS (SELECT * FROM live_members WHERE player_name = :player_name),
+members AS (SELECT * FROM live_members WHERE id NOT IN (SELECT id FROM target)),
+successor AS (
+    -- whoever was after the removed member takes their turn, wrapping round to the first
+    SELECT m.id FROM members m, target g
+    ORDER BY (m.init_value, m.tiebreaker, g.id) < (g.init_value, g.tiebreaker, m.id) DESC,
+        m.init_value DESC, m.tiebreaker DESC, m.id
+    LIMIT 1
+),
+updated AS (
+    UPDATE initiative_trackers it SET version = it.version + 1, updated_at = now(),
+        current_member_id = (SELECT id FROM successor)
+    FROM tracker t, target g
+    WHERE it.id = t.id AND it.version = t.version AND it.current_member_id = g.id
+    RETURNING it.*
+),
+removed AS (
+    DELETE FROM initiative_members m USING target g
+    WHERE m.id = g.id
+        AND (NOT EXISTS (SELECT FROM tracker t WHERE t.current_member_id = g.id)
+            OR EXISTS (SELECT FROM updated))
+    RETURNING m.id
+),
+touched AS (
+    UPDATE initiative_trackers it SET updated_at = now()
+    FROM tracker t
+    WHERE it.id = t.id
+        AND EXISTS (SELECT FROM removed) AND NOT EXISTS (SELECT FROM updated)
+),
+{_FINAL_CTE}
+SELECT {_TRACKER_COLUMNS}, EXISTS (SELECT FROM target) AS found,
+    {_conflict(
+        "EXISTS (SELECT FROM tracker t, target g WHERE t.current_member_id = g.id)"
+    )}
+FROM final f
+""",
+)
+
+_UPDATE_PARTICIPANT = Statement(
+    "update_participant",
+    f"""
+WITH {_TRACKER_CTE},
+{_LIVE_MEMBERS_CTE},
+target AS (SELECT id FROM live_members WHERE player_name = :player_name),
+updated_member AS (
+    UPDATE initiative_members m SET init_value = :init_value, tiebreaker = :tiebreaker
+    FROM target g
+    WHERE m.id = g.id
+    RETURNING m.id, m.player_name, m.init_value, m.tiebreaker
+),
+touched AS (
+    UPDATE initiative_trackers it SET updated_at = now()
+    FROM tracker t
+    WHERE it.id = t.id AND EXISTS (SELECT FROM updated_member)
+),
+members AS (
+    SELECT * FROM live_members WHERE id NOT IN (SELECT id FROM target)
+    UNION ALL SELECT * FROM updated_member
+)
+SELECT {_TRACKER_COLUMNS}, EXISTS (SELECT FROM target) AS found, FALSE AS conflict
+FROM tracker f
+""",
+)
+
+
+def _step_query(forward: bool) -> str:
+    """Builds a move of one participant, found with a keyset lookup on the turn order."""
+    after, later_id, order, round_change = (
+        ("<", ">", "m.init_value DESC, m.tiebreaker DESC, m.id", 1)
+        if forward
+        else (">", "<", "m.init_value, m.tiebreaker, m.id DESC", -1)
+    )
+    return f"""
+WITH {_TRACKER_CTE},
+{_LIVE_MEMBERS_CTE},
+members AS (SELECT * FROM live_members),
+{_CURRENT_MEMBER_CTE},
+neighbour AS (
+    SELECT m.id, 0 AS round_change
+    FROM initiative_members m, tracker t, current_member c
+    WHERE m.initiative_id = t.id AND m.deleted_at IS NULL
+        AND (m.init_value, m.tiebreaker) {after}= (c.init_value, c.tiebreaker)
+        AND ((m.init_value, m.tiebreaker) {after} (c.init_value, c.tiebreaker)
+            OR m.id {later_id} c.id)
+    ORDER BY {order} LIMIT 1
+),
+wrapped AS (
+    -- past either end of the turn order, carry on from the other end in the next round
+    SELECT m.id, {round_change} AS round_change
+    FROM initiative_members m JOIN tracker t ON m.initiative_id = t.id
+    WHERE m.deleted_at IS NULL AND NOT EXISTS (SELECT FROM neighbour)
+    ORDER BY {order} LIMIT 1
+),
+target AS (
+    SELECT t.id, t.version, g.id AS member_id,
+        t.current_round + g.round_change AS current_round
+    FROM tracker t, (SELECT * FROM neighbour UNION ALL SELECT * FROM wrapped) g
+),
+updated AS (
+    UPDATE initiative_trackers it SET version = it.version + 1, updated_at = now(),
+        current_member_id = g.member_id, current_round = g.current_round
+    FROM target g
+    WHERE it.id = g.id AND it.version = g.version AND g.current_round >= 1
+    RETURNING it.*
+),
+{_FINAL_CTE}
+SELECT {_TRACKER_COLUMNS},
+    EXISTS (SELECT FROM target WHERE current_round < 1) AS backtracked,
+    {_conflict("EXISTS (SELECT FROM target WHERE current_round >= 1)")}
+FROM final f
+"""
+
+
+_NEXT_PARTICIPANT = Statement("next_participant", _step_query(forward=True))
+_PREVIOUS_PARTICIPANT = Statement("previous_participant", _step_query(forward=False))
+
+_MOVE_PARTICIPANT = Statement(
+    "move_participant",
+    f"""
+WITH {_TRACKER_CTE},
+{_LIVE_MEMBERS_CTE},
+members AS (SELECT * FROM live_members),
+{_CURRENT_MEMBER_CTE},
+ranked AS (
+    SELECT id, row_number() OVER (ORDER BY {_TURN_ORDER}) - 1 AS position FROM members
+),
+target AS (
+    -- floor division, so that stepping back past the first participant loses a round
+    SELECT t.id, t.version, r.id AS member_id,
+        t.current_round + floor(CAST(p.position + :steps AS numeric) / c.n)
+            AS current_round
+    FROM tracker t, (SELECT count(*) AS n FROM members) c,
+        (SELECT r.position FROM ranked r JOIN current_member m ON r.id = m.id) p, ranked r
+    WHERE r.position = mod(mod(p.position + :steps, c.n) + c.n, c.n)
+),
+updated AS (
+    UPDATE initiative_trackers it SET version = it.version + 1, updated_at = now(),
+        current_member_id = g.member_id, current_round = g.current_round
+    FROM target g
+    WHERE it.id = g.id AND it.version = g.version AND g.current_round >= 1
+    RETURNING it.*
+),
+{_FINAL_CTE}
+SELECT {_TRACKER_COLUMNS},
+    EXISTS (SELECT FROM target WHERE current_round < 1) AS backtracked,
+    {_conflict("EXISTS (SELECT FROM target WHERE current_round >= 1)")}
+FROM final f
+""",
+)
+
+_GOTO_PARTICIPANT = Statement(
+    "goto_participant",
+    f"""
+WITH {_TRACKER_CTE},
+{_LIVE_MEMBERS_CTE},
+members AS (SELECT * FROM live_members),
+target AS (SELECT id FROM members WHERE player_name = :target_name),
+updated AS (
+    UPDATE initiative_trackers it SET version = it.version + 1, updated_at = now(),
+        current_member_id = g.id
+    FROM tracker t, target g
+    WHERE it.id = t.id AND it.version = t.version
+    RETURNING it.*
+),
+{_FINAL_CTE}
+SELECT {_TRACKER_COLUMNS}, EXISTS (SELECT FROM target) AS found,
+    {_conflict("EXISTS (SELECT FROM target)")}
+FROM final f
+""",
+)
+
+_GOTO_ROUND = Statement(
+    "goto_round",
+    f"""
+WITH {_TRACKER_CTE},
+{_LIVE_MEMBERS_CTE},
+members AS (SELECT * FROM live_members),
+updated AS (
+    UPDATE initiative_trackers it SET version = it.version + 1, updated_at = now(),
+        current_round = :to_round,
+        current_member_id = (SELECT id FROM members ORDER BY {_TURN_ORDER} LIMIT 1)
+    FROM tracker t
+    WHERE it.id = t.id AND it.version = t.version
+    RETURNING it.*
+),
+{_FINAL_CTE}
+SELECT {_TRACKER_COLUMNS}, {_conflict()} FROM final f
+""",
+)
+
+# the trackers written most recently within the last :hours, oldest first, so that the
+# most recent are the last to be evicted from the cache they are loaded into
+_RECENT_TRACKERS = f"""
+SELECT f.id, f.channel_id, f.current_round, f.current_member_id, f.version,
+    f.message_id,
+    (
+        SELECT {_PARTICIPANTS_JSON} FROM initiative_members p
+        WHERE p.initiative_id = f.id AND p.deleted_at IS NULL
+    ) AS participants
+FROM (
+    SELECT * FROM initiative_trackers
+    WHERE updated_at > now() - make_interval(hours => :hours)
+    ORDER BY updated_at DESC LIMIT :limit
+) f
+ORDER BY f.updated_at
+"""
+
+
+@lru_cache(maxsize=TRACKER_CACHE_SIZE)
+def _participants_from_json(participants: str | None) -> tuple[Participant, ...]:
+    # cached, so that trackers whose members haven't changed share their participants,
+    # and with them their rendering
+    if not participants:
+        return ()
+    return tuple(Participant(**p) for p in json.loads(participants))
+
+
+def _tracker_from_row(row) -> InitiativeTracker:
+    """Builds an initiative tracker from a row returned by one of the queries above."""
+    return InitiativeTracker(
+        id=row["id"],
+        channel_id=row["channel_id"],
+        current_round=row["current_round"],
+        current_member_id=row["current_member_id"],
+        version=row["version"],
+        message_id=row["message_id"],
+        participants=_participants_from_json(row["participants"]),
+    )
+
+
+class PostgresStorage(Storage):
+    """Keeps trackers in Postgres, where any number of bot processes can share them.
+
+    Each operation is one of the statements above, and so one round trip; writes that
+    lose a race to another writer are retried.
+    """
+
+    def __init__(self, database: Database):
+        self.database = database
+        self._keeping: asyncio.Task | None = None
+
+    async def connect(self):
+        # the pool outlives gateway reconnects, so commands never find it missing
+        keeper = ConnectionKeeper(self.database)
+        await keeper.connect()
+        self._keeping = asyncio.create_task(keeper.run())
+
+    async def disconnect(self):
+        if self._keeping is not None:
+            self._keeping.cancel()
+            self._keeping = None
+        await self.database.disconnect()
+
+    @property
+    def is_connected(self) -> bool:
+        return self.database.is_connected
+
+    async def _write(self, operation: str, query: Statement, values: dict):
+        """Runs one of the mutations above, retrying it while it loses races to others."""
+        for attempt in range(MAX_WRITE_ATTEMPTS):
+            if attempt:
+                write_retries.inc(operation=operation)
+                await asyncio.sleep(random.uniform(0, RETRY_BACKOFF * 2**attempt))
+
+            try:
+                row = await fetch_statement(self.database, query, values)
+            except ForeignKeyViolationError:
+                # the member being pointed at was removed by another command mid-write
+                row = {"conflict": True}
+            if row is None:
+                raise tracker_not_found(values["channel_id"])
+            if not row["conflict"]:
+                return row
+
+            write_conflicts.inc(operation=operation)
+            log.info(
+                f"{operation} lost a race in channel {values['channel_id']}, retrying"
+            )
+
+        raise ConflictError(
+            f"Initiative tracker for channel {values['channel_id']} "
+            "is changing too fast to update!"
+        )
+
+    async def create_tracker(
+        self, channel_id: str, current_round: int
+    ) -> InitiativeTracker:
+        try:
+            tracker_id = await self.database.execute(
+                "INSERT INTO initiative_trackers (channel_id, current_round) "
+                "VALUES (:channel_id, :current_round) RETURNING id",
+                {"channel_id": channel_id, "current_round": current_round},
+            )
+        except UniqueViolationError:
+            raise AlreadyExistsError(
+                f"Initiative tracker for channel {channel_id} already exists!"
+            )
+        return InitiativeTracker(
+            id=tracker_id, channel_id=channel_id, current_round=current_round
+        )
+
+    async def get_tracker(self, channel_id: str) -> InitiativeTracker:
+        row = await fetch_statement(
+            self.database, _GET_INITIATIVE, {"channel_id": channel_id}
+        )
+        if row is None:
+            raise tracker_not_found(channel_id)
+        return _tracker_from_row(row)
+
+    async def recent_trackers(
+        self, hours: int, limit: int
+    ) -> AsyncIterator[InitiativeTracker]:
+        async for row in self.database.iterate(
+            _RECENT_TRACKERS, {"hours": hours, "limit": limit}
+        ):
+            yield _tracker_from_row(row)
+
+    async def delete_tracker(self, channel_id: str):
+        deleted_id = await self.database.execute(
+            "DELETE FROM initiative_trackers WHERE channel_id = :channel_id RETURNING id",
+            {"channel_id": channel_id},
+        )
+        if deleted_id is None:
+            raise tracker_not_found(channel_id)
+
+    async def set_message(self, channel_id: str, message_id: str | None):
+        tracker_id = await self.database.execute(
+            "UPDATE initiative_trackers SET message_id = :message_id, updated_at = now() "
+            "WHERE channel_id = :channel_id RETURNING id",
+            {"channel_id": channel_id, "message_id": message_id},
+        )
+        if tracker_id is None:
+            raise tracker_not_found(channel_id)
+
+    async def add_participants(
+        self, channel_id: str, participants: list[Participant]
+    ) -> InitiativeTracker:
+        entries = [
+            {"name": p.name, "initiative": p.initiative, "tiebreaker": p.tiebreaker}
+            for p in participants
+        ]
+        try:
+            row = await self._write(
+                "add_participants",
+                _ADD_PARTICIPANTS,
+                {"channel_id": channel_id, "entries": json.dumps(entries)},
+            )
+        except UniqueViolationError as e:
+            raise AlreadyExistsError(
+                f"Participant already exists in this initiative! {e.detail}"
+            )
+        return _tracker_from_row(row)
+
+    async def remove_participant(self, channel_id: str, name: str) -> InitiativeTracker:
+        row = await self._write(
+            "remove_participant",
+            _REMOVE_PARTICIPANT,
+            {"channel_id": channel_id, "player_name": name},
+        )
+        if not row["found"]:
+            raise participant_not_found(name)
+        return _tracker_from_row(row)
+
+    async def update_participant(
+        self, channel_id: str, name: str, initiative: int, tiebreaker: int
+    ) -> InitiativeTracker:
+        row = await self._write(
+            "update_participant",
+            _UPDATE_PARTICIPANT,
+            {
+                "channel_id": channel_id,
+                "player_name": name,
+                "init_value": initiative,
+                "tiebreaker": tiebreaker,
+            },
+        )
+        if not row["found"]:
+            raise participant_not_found(name)
+        return _tracker_from_row(row)
+
+    async def move(self, channel_id: str, steps: int) -> InitiativeTracker:
+        values = {"channel_id": channel_id}
+        if steps == 1:
+            query = _NEXT_PARTICIPANT
+        elif steps == -1:
+            query = _PREVIOUS_PARTICIPANT
+        else:
+            query = _MOVE_PARTICIPANT
+            values["steps"] = steps
+
+        row = await self._write("move_participant", query, values)
+        if row["backtracked"]:
+            raise BacktrackError("Cannot go back before round 1")
+        return _tracker_from_row(row)
+
+    async def goto_participant(self, channel_id: str, name: str) -> InitiativeTracker:
+        row = await self._write(
+            "goto_participant",
+            _GOTO_PARTICIPANT,
+            {"channel_id": channel_id, "target_name": name},
+        )
+        if not row["found"]:
+            raise participant_not_found(name)
+        return _tracker_from_row(row)
+
+    async def goto_round(self, channel_id: str, to_round: int) -> InitiativeTracker:
+        row = await self._write(
+            "goto_round", _GOTO_ROUND, {"channel_id": channel_id, "to_round": to_round}
+        )
+        return _tracker_from_row(row)
@@ -0,0 +1,282 @@
+import asyncio
+import sqlite3
+import time
+from functools import lru_cache
+from typing import AsyncIterator
+
+from app.constants import TRACKER_CACHE_SIZE
+from app.controllers.tracker import InitiativeTracker, Participant
+from app.errors import AlreadyExistsError
+from app.storage.base import (
+    Storage,
+    changed,
+    joined,
+    moved,
+    tracker_not_found,
+    went_to,
+    went_to_round,
+    without,
+)
+
+# the same tables as the Postgres schema, less what only matters with several writers
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS initiative_trackers (
+    id INTEGER PRIMARY KEY,
+    channel_id TEXT NOT NULL UNIQUE,
+    current_round INTEGER NOT NULL CHECK (current_round >= 1),
+    current_member_id INTEGER REFERENCES initiative_members (id) ON DELETE SET NULL,
+    version INTEGER NOT NULL DEFAULT 0,
+    message_id TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS initiative_members (
+    id INTEGER PRIMARY KEY,
+    initiative_id INTEGER NOT NULL REFERENCES initiative_trackers (id) ON DELETE CASCADE,
+    player_name TEXT NOT NULL,
+    init_value INTEGER NOT NULL,
+    tiebreaker INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (initiative_id, player_name)
+);
+CREATE INDEX IF NOT EXISTS ix_initiative_members_turn_order
+    ON initiative_members (initiative_id, init_value DESC, tiebreaker DESC, id);
+CREATE INDEX IF NOT EXISTS ix_initiative_trackers_updated_at
+    ON initiative_trackers (updated_at);
+"""
+
+_TRACKER_COLUMNS = "id, channel_id, current_round, current_member_id, version, message_id"
+
+
+@lru_cache(maxsize=TRACKER_CACHE_SIZE)
+def _participants_from_rows(rows: tuple[tuple, ...]) -> tuple[Participant, ...]:
+    # cached, so that trackers whose members haven't changed share their participants,
+    # and with them their rendering
+    return tuple(
+        Participant(name, initiative, tiebreaker, id)
+        for id, name, initiative, tiebreaker in rows
+    )
+
+
+class SQLiteStorage(Storage):
+    """Keeps trackers in a SQLite file, for a single bot process with no database server.
+
+    The file is opened once, and its tables made if they don't exist. Operations take
+    turns on the one connection, each in its own transaction, reading the tracker and
+    writing back only what changed. They run in a worker thread, so that waiting on the
+    disk never holds up the event loop.
+    """
+
+    def __init__(self, path: str, clock=time.time):
+        self.path = path
+        self._clock = clock
+        self._connection: sqlite3.Connection | None = None
+        self._lock = asyncio.Lock()
+
+    def _open(self) -> sqlite3.Connection:
+        # transactions are begun explicitly, rather than by whatever statement is first,
+        # and each operation may run in a different worker thread
+        connection = sqlite3.connect(
+            self.path, isolation_level=None, check_same_thread=False
+        )
+        connection.execute("PRAGMA foreign_keys = ON")
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.executescript(_SCHEMA)
+        return connection
+
+    async def connect(self):
+        self._connection = await asyncio.to_thread(self._open)
+
+    async def disconnect(self):
+        if self._connection is not None:
+            async with self._lock:
+                await asyncio.to_thread(self._connection.close)
+            self._connection = None
+
+    @property
+    def is_connected(self) -> bool:
+        return self._connection is not None
+
+    async def _read(self, operation, *args):
+        """Runs `operation` on the connection in a worker thread, when it's its turn."""
+        async with self._lock:
+            return await asyncio.to_thread(operation, self._connection, *args)
+
+    async def _transact(self, operation, *args):
+        """Runs `operation` like `_read`, in a transaction of its own."""
+        return await self._read(self._in_transaction, operation, *args)
+
+    @staticmethod
+    def _in_transaction(connection: sqlite3.Connection, operation, *args):
+        # taking the write lock up front, so a transaction never has to upgrade to it
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            result = operation(connection, *args)
+        except BaseException:
+            connection.rollback()
+            raise
+        connection.commit()
+        return result
+
+    def _load(self, connection: sqlite3.Connection, channel_id: str) -> InitiativeTracker:
+        row = connection.execute(
+            f"SELECT {_TRACKER_COLUMNS} FROM initiative_trackers WHERE channel_id = ?",
+            (channel_id,),
+        ).fetchone()
+        if row is None:
+            raise tracker_not_found(channel_id)
+        return self._tracker(connection, row)
+
+    def _tracker(self, connection: sqlite3.Connection, row) -> InitiativeTracker:
+        members = connection.execute(
+            "SELECT id, player_name, init_value, tiebreaker FROM initiative_members "
+            "WHERE initiative_id = ? ORDER BY init_value DESC, tiebreaker DESC, id",
+            (row[0],),
+        ).fetchall()
+        return InitiativeTracker(
+            *row, participants=_participants_from_rows(tuple(members))
+        )
+
+    def _save(self, connection: sqlite3.Connection, new: InitiativeTracker):
+        """Writes the tracker row, which every change marks as just written."""
+        connection.execute(
+            "UPDATE initiative_trackers SET current_round = ?, current_member_id = ?, "
+            "version = ?, updated_at = ? WHERE id = ?",
+            (
+                new.current_round,
+                new.current_member_id,
+                new.version,
+                self._clock(),
+                new.id,
+            ),
+        )
+
+    async def create_tracker(
+        self, channel_id: str, current_round: int
+    ) -> InitiativeTracker:
+        def create(connection: sqlite3.Connection) -> InitiativeTracker:
+            try:
+                cursor = connection.execute(
+                    "INSERT INTO initiative_trackers "
+                    "(channel_id, current_round, updated_at) VALUES (?, ?, ?)",
+                    (channel_id, current_round, self._clock()),
+                )
+            except sqlite3.IntegrityError as err:
+                raise AlreadyExistsError(
+                    f"Initiative tracker for channel {channel_id} already exists!"
+                ) from err
+            return InitiativeTracker(cursor.lastrowid, channel_id, current_round)
+
+        return await self._transact(create)
+
+    async def get_tracker(self, channel_id: str) -> InitiativeTracker:
+        return await self._read(self._load, channel_id)
+
+    async def recent_trackers(
+        self, hours: int, limit: int
+    ) -> AsyncIterator[InitiativeTracker]:
+        def recent(connection: sqlite3.Connection) -> list[InitiativeTracker]:
+            rows = connection.execute(
+                f"SELECT {_TRACKER_COLUMNS} FROM ("
+                "SELECT * FROM initiative_trackers WHERE updated_at > ? "
+                "ORDER BY updated_at DESC LIMIT ?"
+                ") ORDER BY updated_at",
+                (self._clock() - hours * 3600, limit),
+            ).fetchall()
+            return [self._tracker(connection, row) for row in rows]
+
+        for tracker in await self._read(recent):
+            yield tracker
+
+    async def delete_tracker(self, channel_id: str):
+        def delete(connection: sqlite3.Connection):
+            cursor = connection.execute(
+                "DELETE FROM initiative_trackers WHERE channel_id = ?", (channel_id,)
+            )
+            if not cursor.rowcount:
+                raise tracker_not_found(channel_id)
+
+        await self._transact(delete)
+
+    async def set_message(self, channel_id: str, message_id: str | None):
+        def set_message(connection: sqlite3.Connection):
+            cursor = connection.execute(
+                "UPDATE initiative_trackers SET message_id = ?, updated_at = ? "
+                "WHERE channel_id = ?",
+                (message_id, self._clock(), channel_id),
+            )
+            if not cursor.rowcount:
+                raise tracker_not_found(channel_id)
+
+        await self._transact(set_message)
+
+    async def add_participants(
+        self, channel_id: str, participants: list[Participant]
+    ) -> InitiativeTracker:
+        def add(connection: sqlite3.Connection) -> InitiativeTracker:
+            tracker = self._load(connection, channel_id)
+            saved = []
+            for p in participants:
+                try:
+                    cursor = connection.execute(
+                        "INSERT INTO initiative_members "
+                        "(initiative_id, player_name, init_value, tiebreaker) "
+                        "VALUES (?, ?, ?, ?)",
+                        (tracker.id, p.name, p.initiative, p.tiebreaker),
+                    )
+                except sqlite3.IntegrityError as err:
+                    raise AlreadyExistsError(
+                        f"Participant {p.name} already exists in this initiative!"
+                    ) from err
+                saved.append(
+                    Participant(p.name, p.initiative, p.tiebreaker, cursor.lastrowid)
+                )
+            new = joined(tracker, saved)
+            self._save(connection, new)
+            return new
+
+        return await self._transact(add)
+
+    async def remove_participant(self, channel_id: str, name: str) -> InitiativeTracker:
+        def remove(connection: sqlite3.Connection) -> InitiativeTracker:
+            tracker = self._load(connection, channel_id)
+            new = without(tracker, name)
+            self._save(connection, new)
+            connection.execute(
+                "DELETE FROM initiative_members WHERE id = ?",
+                (tracker.find_participant(name).id,),
+            )
+            return new
+
+        return await self._transact(remove)
+
+    async def update_participant(
+        self, channel_id: str, name: str, initiative: int, tiebreaker: int
+    ) -> InitiativeTracker:
+        def update(connection: sqlite3.Connection) -> InitiativeTracker:
+            tracker = self._load(connection, channel_id)
+            new = changed(tracker, name, initiative, tiebreaker)
+            connection.execute(
+                "UPDATE initiative_members SET init_value = ?, tiebreaker = ? "
+                "WHERE id = ?",
+                (initiative, tiebreaker, new.find_participant(name).id),
+            )
+            self._save(connection, new)
+            return new
+
+        return await self._transact(update)
+
+    def _navigated(
+        self, connection: sqlite3.Connection, channel_id: str, navigation, *args
+    ) -> InitiativeTracker:
+        tracker = self._load(connection, channel_id)
+        new = navigation(tracker, *args)
+        self._save(connection, new)
+        return new
+
+    async def move(self, channel_id: str, steps: int) -> InitiativeTracker:
+        return await self._transact(self._navigated, channel_id, moved, steps)
+
+    async def goto_participant(self, channel_id: str, name: str) -> InitiativeTracker:
+        return await self._transact(self._navigated, channel_id, went_to, name)
+
+    async def goto_round(self, channel_id: str, to_round: int) -> InitiativeTracker:
+        return await self._transact(self._navigated, channel_id, went_to_round, to_round)
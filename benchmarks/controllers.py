@@ -0,0 +1,270 @@
+"""Drives every initiative controller function against the configured Postgres.
+
+Seeds `--channels` trackers of between `--min-participants` and `--max-participants`
+members each, times `--iterations` calls of every operation, and reports latency
+percentiles, statements per call and throughput. `--save` writes the results as a JSON
+baseline, and `--compare` checks them against one, exiting non-zero on a regression.
+
+Run with `python -m benchmarks.controllers`.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+from dataclasses import asdict, dataclass
+from typing import Awaitable, Callable
+
+from databases import Database
+
+from app.constants import DATABASE_URL
+from app.controllers import initiative
+from app.controllers.cache import TrackerCache
+from tests.helpers import CountingDatabase
+
+# far enough from round 1 that moving back never runs out of rounds
+START_ROUND = 100
+
+
+@dataclass
+class Result:
+    p50: float
+    p95: float
+    p99: float
+    queries: float
+    throughput: float
+
+    @classmethod
+    def from_run(
+        cls, latencies: list[float], statements: int, elapsed: float
+    ) -> "Result":
+        """Summarises the latencies, in seconds, of one operation's calls."""
+        percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+        return cls(
+            p50=percentiles[49] * 1000,
+            p95=percentiles[94] * 1000,
+            p99=percentiles[98] * 1000,
+            queries=statements / len(latencies),
+            throughput=len(latencies) / elapsed,
+        )
+
+
+async def seed(db: Database, sizes: list[int]):
+    """Seeds a tracker per size, with that many members, part way through a round."""
+    await unseed(db)
+    await db.execute(
+        "INSERT INTO initiative_trackers (channel_id, current_round) "
+        "SELECT 'bench-' || i, :round FROM generate_series(1, :channels) i",
+        {"round": START_ROUND, "channels": len(sizes)},
+    )
+    await db.execute(
+        "INSERT INTO initiative_members "
+        "(initiative_id, player_name, init_value, tiebreaker) "
+        "SELECT t.id, 'player ' || i, i % 30, i % 3 "
+        "FROM unnest(CAST(:sizes AS integer[])) WITH ORDINALITY s(size, channel) "
+        "JOIN initiative_trackers t ON t.channel_id = 'bench-' || s.channel, "
+        "generate_series(1, s.size) i "
+        "ORDER BY t.id, i",
+        {"sizes": sizes},
+    )
+    await db.execute(
+        "UPDATE initiative_trackers t SET current_member_id = ("
+        "SELECT m.id FROM initiative_members m WHERE m.initiative_id = t.id "
+        "ORDER BY m.init_value DESC, m.tiebreaker DESC, m.id LIMIT 1"
+        ") WHERE t.channel_id LIKE 'bench-%'"
+    )
+    await db.execute("VACUUM ANALYZE initiative_trackers")
+    await db.execute("VACUUM ANALYZE initiative_members")
+
+
+async def unseed(db: Database):
+    await db.execute("DELETE FROM initiative_trackers WHERE channel_id LIKE 'bench-%'")
+
+
+def operations(
+    db: Database, cache: TrackerCache, channels: list[int], rng: random.Random
+) -> dict[str, Callable[[int], Awaitable]]:
+    """Returns each operation as a function of the call number.
+
+    Calls with the same number use the same channel, so that what one operation adds
+    the next can remove, and concurrent calls never touch the same tracker.
+    """
+    options = {"database": db, "cache": cache}
+
+    def channel(i: int) -> str:
+        return f"bench-{channels[i]}"
+
+    return {
+        "create_initiative": lambda i: initiative.create_initiative(
+            f"bench-new-{i}", **options
+        ),
+        "get_initiative": lambda i: initiative.get_initiative(channel(i), **options),
+        "add_participant": lambda i: initiative.add_participant(
+            channel(i), f"newcomer {i}", rng.randrange(30), **options
+        ),
+        "add_participants": lambda i: initiative.add_participants(
+            channel(i),
+            [
+                initiative.Participant(f"group {i} {n}", rng.randrange(30))
+                for n in range(5)
+            ],
+            **options,
+        ),
+        "update_participant": lambda i: initiative.update_participant(
+            channel(i), "player 1", rng.randrange(30), **options
+        ),
+        "next_participant": lambda i: initiative.next_participant(channel(i), **options),
+        "previous_participant": lambda i: initiative.previous_participant(
+            channel(i), **options
+        ),
+        "move_participant": lambda i: initiative.next_participant(
+            channel(i), steps=3, **options
+        ),
+        "goto_participant": lambda i: initiative.goto_participant(
+            channel(i), "player 2", **options
+        ),
+        "goto_round": lambda i: initiative.goto_round(channel(i), START_ROUND, **options),
+        "remove_participant": lambda i: initiative.remove_participant(
+            channel(i), f"newcomer {i}", **options
+        ),
+        "delete_initiative": lambda i: initiative.delete_initiative(
+            f"bench-new-{i}", **options
+        ),
+    }
+
+
+async def run(
+    db: CountingDatabase,
+    call: Callable[[int], Awaitable],
+    iterations: int,
+    concurrency: int,
+) -> Result:
+    """Makes `iterations` calls, at most `concurrency` at a time, and times each one."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def timed(i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            await call(i)
+            latencies.append(time.perf_counter() - start)
+
+    db.statements = 0
+    start = time.perf_counter()
+    await asyncio.gather(*(timed(i) for i in range(iterations)))
+    return Result.from_run(latencies, db.statements, time.perf_counter() - start)
+
+
+def compare(
+    results: dict[str, Result], baseline: dict[str, dict], tolerance: float
+) -> list[str]:
+    """Prints how the results changed from the baseline, and returns the regressions."""
+    regressions = []
+    print(
+        f"\n{'operation':<22} {'base p95':>9} {'p95':>9} {'change':>8} "
+        f"{'base q':>7} {'q':>5}"
+    )
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = Result(**baseline[name])
+        change = result.p95 / before.p95 - 1
+        flags = []
+        if change > tolerance:
+            flags.append("slower")
+        if result.queries > before.queries:
+            flags.append("more queries")
+        if flags:
+            regressions.append(name)
+        print(
+            f"{name:<22} {before.p95:>9.2f} {result.p95:>9.2f} {change:>+8.0%} "
+            f"{before.queries:>7.1f} {result.queries:>5.1f}  {', '.join(flags)}"
+        )
+    return regressions
+
+
+async def main(args: argparse.Namespace) -> int:
+    if args.iterations > args.channels:
+        raise SystemExit("--iterations can't be more than --channels")
+
+    rng = random.Random(args.seed)
+    sizes = [
+        rng.randint(args.min_participants, args.max_participants)
+        for _ in range(args.channels)
+    ]
+    # so that every get goes to the database
+    cache = TrackerCache(max_size=0)
+    results = {}
+
+    async with CountingDatabase(DATABASE_URL) as db:
+        print(f"Seeding {args.channels} channels with {sum(sizes)} participants...")
+        await seed(db, sizes)
+        try:
+            channels = rng.sample(range(1, args.channels + 1), args.iterations)
+            print(
+                f"\n{'operation':<22} {'p50':>8} {'p95':>8} {'p99':>8} {'queries':>8} "
+                f"{'ops/s':>8}  (ms)"
+            )
+            for name, call in operations(db, cache, channels, rng).items():
+                result = await run(db, call, args.iterations, args.concurrency)
+                results[name] = result
+                print(
+                    f"{name:<22} {result.p50:>8.2f} {result.p95:>8.2f} "
+                    f"{result.p99:>8.2f} {result.queries:>8.1f} {result.throughput:>8.0f}"
+                )
+        finally:
+            await unseed(db)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(
+                {
+                    "config": vars(args) | {"save": None, "compare": None},
+                    "operations": {name: asdict(r) for name, r in results.items()},
+                },
+                f,
+                indent=2,
+            )
+        print(f"\nSaved baseline to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        changed = [
+            key
+            for key, value in baseline["config"].items()
+            if key not in ("save", "compare", "tolerance") and getattr(args, key) != value
+        ]
+        if changed:
+            print(f"\nWarning: the baseline was run with different {', '.join(changed)}")
+        regressions = compare(results, baseline["operations"], args.tolerance)
+        if regressions:
+            print(f"\nRegressed: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--channels", type=int, default=1_000)
+    parser.add_argument("--min-participants", type=int, default=5)
+    parser.add_argument("--max-participants", type=int, default=500)
+    parser.add_argument("--iterations", type=int, default=200, help="calls per operation")
+    parser.add_argument("--concurrency", type=int, default=1, help="calls at a time")
+    parser.add_argument("--seed", type=int, default=0, help="for the random data")
+    parser.add_argument("--save", metavar="PATH", help="write the results as a baseline")
+    parser.add_argument("--compare", metavar="PATH", help="compare against a baseline")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="how much slower p95 can get before it counts as a regression",
+    )
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
@@ -0,0 +1,110 @@
+"""Compares running the hot statements through databases with running them prepared.
+
+Seeds one tracker of `--participants` members, then times `--iterations` sequential
+calls of each read and navigation statement both ways, on one pooled connection each:
+through SQLAlchemy's compilation and databases' record wrapping, as any query runs, and
+straight down the connection to the copy prepared on it when it opened. asyncpg caches
+the plan of both once they have run, so the difference is the per-call overhead the
+fast path saves.
+
+Run with `python -m benchmarks.statements`.
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+
+from app.constants import DATABASE_URL
+from app.database import InstrumentedDatabase, prepare_statements
+from app.storage import postgres
+
+CHANNEL = "bench-statements"
+
+STATEMENTS = {
+    "get_initiative": (postgres._GET_INITIATIVE, {}),
+    "next_participant": (postgres._NEXT_PARTICIPANT, {}),
+    "previous_participant": (postgres._PREVIOUS_PARTICIPANT, {}),
+    "goto_participant": (postgres._GOTO_PARTICIPANT, {"target_name": "player 1"}),
+}
+
+
+async def seed(db: InstrumentedDatabase, participants: int):
+    await unseed(db)
+    await db.execute(
+        "INSERT INTO initiative_trackers (channel_id, current_round) "
+        "VALUES (:channel, 1)",
+        {"channel": CHANNEL},
+    )
+    await db.execute(
+        "INSERT INTO initiative_members "
+        "(initiative_id, player_name, init_value, tiebreaker) "
+        "SELECT t.id, 'player ' || i, i % 30, i % 3 "
+        "FROM initiative_trackers t, generate_series(1, :participants) i "
+        "WHERE t.channel_id = :channel",
+        {"channel": CHANNEL, "participants": participants},
+    )
+
+
+async def unseed(db: InstrumentedDatabase):
+    await db.execute(
+        "DELETE FROM initiative_trackers WHERE channel_id = :channel",
+        {"channel": CHANNEL},
+    )
+
+
+async def time_calls(call, iterations: int) -> list[float]:
+    """Returns the time, in microseconds, that each of `iterations` calls took."""
+    # once untimed, so both ways start from a warm statement cache
+    await call()
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await call()
+        latencies.append((time.perf_counter() - start) * 1_000_000)
+    return latencies
+
+
+async def main(args: argparse.Namespace) -> int:
+    plain = InstrumentedDatabase(DATABASE_URL, min_size=1, max_size=1)
+    prepared = InstrumentedDatabase(
+        DATABASE_URL, min_size=1, max_size=1, init=prepare_statements
+    )
+    async with plain, prepared:
+        await seed(plain, args.participants)
+        try:
+            print(
+                f"{'statement':<22} {'before p50':>11} {'after p50':>10} "
+                f"{'before mean':>12} {'after mean':>11} {'saved':>8}  (µs)"
+            )
+            for name, (statement, values) in STATEMENTS.items():
+                values = {"channel_id": CHANNEL, **values}
+                before = await time_calls(
+                    lambda: plain.fetch_one(statement.sql, values), args.iterations
+                )
+                after = await time_calls(
+                    lambda: prepared.fetch_prepared(statement, values), args.iterations
+                )
+                saved = statistics.mean(before) - statistics.mean(after)
+                print(
+                    f"{name:<22} {statistics.median(before):>11.0f} "
+                    f"{statistics.median(after):>10.0f} {statistics.mean(before):>12.0f} "
+                    f"{statistics.mean(after):>11.0f} {saved:>8.0f}"
+                )
+        finally:
+            await unseed(plain)
+    return 0
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--participants", type=int, default=20)
+    parser.add_argument(
+        "--iterations", type=int, default=2_000, help="calls per statement"
+    )
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
@@ -0,0 +1,61 @@
+"""Times the in-memory initiative tracker at a range of sizes.
+
+"render" renders a tracker from scratch, "moved" one just moved on from a rendered one,
+which only has to move the marker, and "window" only as much as fits in a Discord
+message. "complete" suggests names for a prefix, as autocomplete does on each keypress.
+
+Run with `python -m benchmarks.tracker`.
+"""
+
+import timeit
+from dataclasses import replace
+
+from app.constants import DISCORD_MESSAGE_LIMIT
+from app.controllers.tracker import InitiativeTracker, Participant, _blocks
+
+SIZES = (10, 100, 1_000, 5_000)
+
+
+def make_tracker(size: int) -> InitiativeTracker:
+    """Builds a tracker of `size` participants, halfway through its turn order."""
+    participants = tuple(
+        Participant(f"player {i}", size - i, i % 3, id=i) for i in range(size)
+    )
+    return InitiativeTracker(
+        id=1,
+        channel_id="benchmark",
+        current_round=1,
+        current_member_id=size // 2,
+        participants=participants,
+    )
+
+
+def time_per_call(func) -> float:
+    """Returns how long one call of `func` takes, in microseconds."""
+    calls, seconds = timeit.Timer(func).autorange()
+    return seconds / calls * 1_000_000
+
+
+def main():
+    print(
+        f"{'participants':>12} {'build':>10} {'find':>10} {'current':>10} {'render':>10} "
+        f"{'moved':>10} {'window':>10} {'complete':>10}  (µs)"
+    )
+    for size in SIZES:
+        tracker = make_tracker(size)
+        last_name = tracker.participants[-1].name
+        moved = replace(tracker, current_member_id=size // 2 + 1)
+        timings = (
+            time_per_call(lambda: make_tracker(size)),
+            time_per_call(lambda: tracker.find_participant(last_name)),
+            time_per_call(lambda: tracker.current_participant),
+            time_per_call(lambda: (_blocks.clear(), str(tracker))),
+            time_per_call(lambda: str(moved)),
+            time_per_call(lambda: moved.render(DISCORD_MESSAGE_LIMIT)),
+            time_per_call(lambda: moved.complete_name("player 1")),
+        )
+        print(f"{size:>12} " + " ".join(f"{t:>10.2f}" for t in timings))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""add tracker updated at
+
+Revision ID: 1e48a8a4706d
+Revises: 8f88bace49df
+Create Date: 2026-10-18 16:35:39.875811
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "1e48a8a4706d"
+down_revision: Union[str, None] = "8f88bace49df"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # bumped by every write to the tracker, so the trackers in play can be found on start
+    # up; not indexed, so that bumping it doesn't stop those writes being HOT updates
+    op.add_column(
+        "initiative_trackers",
+        sa.Column(
+            "updated_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.func.now(),
+            nullable=False,
+        ),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("initiative_trackers", "updated_at")
@@ -0,0 +1,64 @@
+"""add initiative events
+
+Revision ID: 40c12b96f8dd
+Revises: 541521990a2c
+Create Date: 2026-10-18 16:50:27.800861
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = "40c12b96f8dd"
+down_revision: Union[str, None] = "541521990a2c"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # every change to a channel's tracker, for the events storage
+    op.create_table(
+        "initiative_events",
+        sa.Column("id", sa.BigInteger(), nullable=False),
+        sa.Column("channel_id", sa.String(), nullable=False),
+        sa.Column("seq", sa.Integer(), nullable=False),
+        sa.Column("kind", sa.String(), nullable=False),
+        sa.Column("data", postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+        sa.Column(
+            "created_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("channel_id", "seq", name="unique_initiative_event"),
+    )
+    op.create_index(
+        op.f("ix_initiative_events_created_at"),
+        "initiative_events",
+        ["created_at"],
+        unique=False,
+    )
+    op.create_table(
+        "initiative_snapshots",
+        sa.Column("channel_id", sa.String(), nullable=False),
+        sa.Column("seq", sa.Integer(), nullable=False),
+        sa.Column("state", postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+        sa.Column(
+            "created_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.PrimaryKeyConstraint("channel_id"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("initiative_snapshots")
+    op.drop_index(op.f("ix_initiative_events_created_at"), table_name="initiative_events")
+    op.drop_table("initiative_events")
@@ -0,0 +1,29 @@
+"""add tracker message id
+
+Revision ID: 541521990a2c
+Revises: 1e48a8a4706d
+Create Date: 2026-10-18 16:37:02.917051
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "541521990a2c"
+down_revision: Union[str, None] = "1e48a8a4706d"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # the pinned message that shows the tracker, which commands edit instead of replying
+    op.add_column(
+        "initiative_trackers", sa.Column("message_id", sa.String(), nullable=True)
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("initiative_trackers", "message_id")
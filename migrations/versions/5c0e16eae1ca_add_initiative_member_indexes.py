@@ -0,0 +1,34 @@
+"""add initiative member indexes
+
+Revision ID: 5c0e16eae1ca
+Revises: 01c16e8e6aa7
+Create Date: 2026-10-18 16:06:35.790767
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "5c0e16eae1ca"
+down_revision: Union[str, None] = "01c16e8e6aa7"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # live members of a tracker in turn order, readable without touching the table
+    op.create_index(
+        "ix_initiative_members_turn_order",
+        "initiative_members",
+        ["initiative_id", sa.text("init_value DESC"), sa.text("tiebreaker DESC"), "id"],
+        unique=False,
+        postgresql_include=["player_name"],
+        postgresql_where=sa.text("deleted_at IS NULL"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_initiative_members_turn_order", table_name="initiative_members")
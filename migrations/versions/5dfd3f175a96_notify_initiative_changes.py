@@ -0,0 +1,60 @@
+"""notify initiative changes
+
+Revision ID: 5dfd3f175a96
+Revises: 40c12b96f8dd
+Create Date: 2026-10-18 16:57:46.498806
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "5dfd3f175a96"
+down_revision: Union[str, None] = "40c12b96f8dd"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # tells other processes which channel's tracker changed, once per transaction, as
+    # Postgres folds identical notifications in a transaction into one
+    op.execute("""
+        CREATE FUNCTION notify_initiative_change() RETURNS trigger AS $$
+        DECLARE
+            changed RECORD;
+            channel VARCHAR;
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                changed := OLD;
+            ELSE
+                changed := NEW;
+            END IF;
+            IF TG_TABLE_NAME = 'initiative_members' THEN
+                SELECT channel_id INTO channel
+                FROM initiative_trackers WHERE id = changed.initiative_id;
+            ELSE
+                channel := changed.channel_id;
+            END IF;
+            -- members deleted along with their tracker are told of by the tracker
+            IF channel IS NOT NULL THEN
+                PERFORM pg_notify('initiative_changes', channel);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """)
+    for table in ("initiative_trackers", "initiative_members", "initiative_events"):
+        op.execute(f"""
+            CREATE TRIGGER {table}_notify
+            AFTER INSERT OR UPDATE OR DELETE ON {table}
+            FOR EACH ROW EXECUTE PROCEDURE notify_initiative_change()
+            """)
+
+
+def downgrade() -> None:
+    for table in ("initiative_trackers", "initiative_members", "initiative_events"):
+        op.execute(f"DROP TRIGGER {table}_notify ON {table}")
+    op.execute("DROP FUNCTION notify_initiative_change()")
@@ -0,0 +1,65 @@
+"""point trackers at their current member
+
+Revision ID: 8f88bace49df
+Revises: 99c284d7028c
+Create Date: 2026-10-18 16:19:52.911485
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "8f88bace49df"
+down_revision: Union[str, None] = "99c284d7028c"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "initiative_trackers", sa.Column("current_member_id", sa.Integer(), nullable=True)
+    )
+    op.create_foreign_key(
+        "initiative_trackers_current_member_id_fkey",
+        "initiative_trackers",
+        "initiative_members",
+        ["current_member_id"],
+        ["id"],
+        ondelete="SET NULL",
+    )
+    op.execute("""
+        UPDATE initiative_trackers t SET current_member_id = (
+            SELECT m.id FROM initiative_members m
+            WHERE m.initiative_id = t.id AND m.deleted_at IS NULL
+            ORDER BY m.init_value DESC, m.tiebreaker DESC, m.id
+            OFFSET t.current_index LIMIT 1
+        )
+        """)
+    op.drop_column("initiative_trackers", "current_index")
+
+
+def downgrade() -> None:
+    op.add_column(
+        "initiative_trackers",
+        sa.Column("current_index", sa.Integer(), server_default="0", nullable=False),
+    )
+    op.execute("""
+        UPDATE initiative_trackers t SET current_index = (
+            SELECT count(*) FROM initiative_members m, initiative_members c
+            WHERE c.id = t.current_member_id AND m.initiative_id = t.id
+                AND m.deleted_at IS NULL
+                AND (m.init_value, m.tiebreaker, c.id)
+                    > (c.init_value, c.tiebreaker, m.id)
+        )
+        WHERE t.current_member_id IS NOT NULL
+        """)
+    op.alter_column("initiative_trackers", "current_index", server_default=None)
+    op.drop_constraint(
+        "initiative_trackers_current_member_id_fkey",
+        "initiative_trackers",
+        type_="foreignkey",
+    )
+    op.drop_column("initiative_trackers", "current_member_id")
@@ -0,0 +1,30 @@
+"""add tracker version
+
+Revision ID: 99c284d7028c
+Revises: 5c0e16eae1ca
+Create Date: 2026-10-18 16:13:38.001046
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "99c284d7028c"
+down_revision: Union[str, None] = "5c0e16eae1ca"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # bumped by every write, which compares-and-swaps on it
+    op.add_column(
+        "initiative_trackers",
+        sa.Column("version", sa.Integer(), server_default="0", nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("initiative_trackers", "version")
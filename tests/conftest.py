@@ -1,6 +1,16 @@
 import pytest
 
+from app.controllers.cache import tracker_cache
+
 
 @pytest.fixture(scope="function")
 def channel_id():
     return "1234567890"
+
+
+@pytest.fixture(autouse=True)
+def clear_tracker_cache():
+    # each test rolls back its database, so cached trackers must not leak between tests
+    tracker_cache.clear()
+    yield
+    tracker_cache.clear()
@@ -0,0 +1,25 @@
+"""Helpers shared by the tests and the benchmarks."""
+
+from databases import Database
+
+
+class CountingDatabase(Database):
+    """A database that counts the statements sent through it."""
+
+    statements = 0
+
+    async def fetch_all(self, *args, **kwargs):
+        self.statements += 1
+        return await super().fetch_all(*args, **kwargs)
+
+    async def fetch_one(self, *args, **kwargs):
+        self.statements += 1
+        return await super().fetch_one(*args, **kwargs)
+
+    async def fetch_val(self, *args, **kwargs):
+        self.statements += 1
+        return await super().fetch_val(*args, **kwargs)
+
+    async def execute(self, *args, **kwargs):
+        self.statements += 1
+        return await super().execute(*args, **kwargs)
@@ -0,0 +1,69 @@
+from app.controllers.cache import TrackerCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_get_returns_none_and_counts_a_miss_when_empty():
+    cache = TrackerCache(max_size=2, ttl=10)
+    assert cache.get("1") is None
+    assert cache.stats.misses == 1
+    assert cache.stats.hits == 0
+
+
+def test_put_then_get_counts_a_hit():
+    cache = TrackerCache(max_size=2, ttl=10)
+    cache.put(1, "tracker")
+    assert cache.get("1") == "tracker"
+    assert cache.stats.hits == 1
+    assert cache.stats.hit_rate == 1.0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TrackerCache(max_size=2, ttl=10)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+
+    assert "b" not in cache
+    assert "a" in cache
+    assert "c" in cache
+    assert cache.stats.evictions == 1
+
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = TrackerCache(max_size=2, ttl=10, clock=clock)
+    cache.put("a", 1)
+
+    clock.now = 9.9
+    assert cache.get("a") == 1
+    clock.now = 10
+    assert cache.get("a") is None
+    assert cache.stats.evictions == 1
+    assert len(cache) == 0
+
+
+def test_invalidate_drops_an_entry():
+    cache = TrackerCache(max_size=2, ttl=10)
+    cache.put("a", 1)
+    cache.invalidate("a")
+    cache.invalidate("missing")
+    assert cache.get("a") is None
+
+
+def test_peek_returns_stale_entries_without_counting_a_lookup():
+    clock = FakeClock()
+    cache = TrackerCache(max_size=2, ttl=10, clock=clock)
+    cache.put("a", 1)
+    clock.now = 11
+
+    assert cache.peek("a") == 1
+    assert cache.peek("b") is None
+    assert cache.stats.hits == cache.stats.misses == 0
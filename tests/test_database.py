@@ -0,0 +1,195 @@
+import asyncio
+import logging
+
+import pytest
+
+from app.constants import DATABASE_URL
+from app.controllers import initiative
+from app.errors import PoolExhaustedError
+from app.database import (
+    ConnectionKeeper,
+    InstrumentedDatabase,
+    Statement,
+    command_queries,
+    finish_command,
+    pool_exhausted,
+    pool_wait_seconds,
+    prepare_statements,
+    query_seconds,
+    reconnects,
+    start_command,
+    statements,
+)
+
+
+@pytest.mark.asyncio
+async def test_statements_are_counted_against_the_current_command(channel_id):
+    async with InstrumentedDatabase(DATABASE_URL, force_rollback=True) as db:
+        before = command_queries.count(command="init add")
+
+        start_command("init", channel_id)
+        stats = start_command("init add", channel_id)
+        await initiative.create_initiative(channel_id, database=db)
+        await initiative.add_participant(channel_id, "Alice", 15, database=db)
+        assert finish_command() is stats
+
+        assert stats.command == "init add"
+        assert stats.queries == 2
+        assert stats.db_seconds > 0
+        assert command_queries.count(command="init add") == before + 1
+        assert finish_command() is None
+
+
+@pytest.mark.asyncio
+async def test_statements_outside_a_command_are_still_timed(channel_id):
+    async with InstrumentedDatabase(DATABASE_URL, force_rollback=True) as db:
+        before = query_seconds.count(command="none")
+        await db.fetch_val("SELECT 1")
+        async for _ in db.iterate("SELECT generate_series(1, 3)"):
+            pass
+        assert query_seconds.count(command="none") == before + 2
+
+
+@pytest.mark.asyncio
+async def test_commands_over_budget_are_logged(channel_id, caplog):
+    async with InstrumentedDatabase(DATABASE_URL, force_rollback=True) as db:
+        start_command("init spam", channel_id)
+        for _ in range(4):
+            await db.fetch_val("SELECT 1")
+        with caplog.at_level(logging.WARNING, logger="app.database"):
+            finish_command()
+
+        assert "init spam" in caplog.text
+        assert "sent 4 statements" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_waiting_for_a_connection_is_timed_separately():
+    async with InstrumentedDatabase(DATABASE_URL, min_size=1, max_size=1) as db:
+        waits = pool_wait_seconds.count(command="none")
+        queries = query_seconds.count(command="none")
+        await db.fetch_val("SELECT 1")
+        assert pool_wait_seconds.count(command="none") == waits + 1
+        assert query_seconds.count(command="none") == queries + 1
+
+
+@pytest.mark.asyncio
+async def test_statements_give_up_when_the_pool_is_exhausted():
+    async with InstrumentedDatabase(
+        DATABASE_URL, min_size=1, max_size=1, acquire_timeout=0.05
+    ) as db:
+        exhausted = pool_exhausted.value()
+        held = asyncio.Event()
+        release = asyncio.Event()
+
+        async def hold_the_only_connection():
+            async with db.connection():
+                held.set()
+                await release.wait()
+
+        holder = asyncio.create_task(hold_the_only_connection())
+        await held.wait()
+        with pytest.raises(PoolExhaustedError):
+            await db.fetch_val("SELECT 1")
+        assert pool_exhausted.value() == exhausted + 1
+
+        release.set()
+        await holder
+        assert await db.fetch_val("SELECT 1") == 1
+
+
+class FlakyDatabase:
+    """A database that fails to connect a given number of times first."""
+
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.attempts = 0
+        self.is_connected = False
+
+    async def connect(self):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise ConnectionRefusedError("Postgres isn't up yet")
+        self.is_connected = True
+
+
+@pytest.mark.asyncio
+async def test_connecting_retries_until_the_database_is_up():
+    db = FlakyDatabase(failures=3)
+    await ConnectionKeeper(db, backoff=0.001).connect()
+    assert db.attempts == 4
+    assert db.is_connected
+
+
+@pytest.mark.asyncio
+async def test_a_failed_health_check_rebuilds_the_pool():
+    async with InstrumentedDatabase(DATABASE_URL) as db:
+        keeper = ConnectionKeeper(db, interval=0.01, backoff=0.001)
+        before = reconnects.value()
+        assert await keeper.check()
+
+        # as if the pool had broken underneath us
+        await db.disconnect()
+        assert not await keeper.check()
+
+        running = asyncio.create_task(keeper.run())
+        try:
+            while reconnects.value() == before:
+                await asyncio.sleep(0.01)
+            while not db.is_connected:
+                await asyncio.sleep(0.01)
+        finally:
+            running.cancel()
+
+        assert await db.fetch_val("SELECT 1") == 1
+
+
+def test_statements_are_rewritten_with_positional_parameters():
+    statement = Statement(
+        "test", "SELECT :a::text, :b, :a WHERE x = ANY(CAST(:c AS integer[]))"
+    )
+    del statements["test"]
+    assert statement.positional_sql == (
+        "SELECT $1::text, $2, $1 WHERE x = ANY(CAST($3 AS integer[]))"
+    )
+    assert statement.arguments({"c": [1], "b": 2, "a": "x"}) == ["x", 2, [1]]
+
+
+@pytest.mark.asyncio
+async def test_hot_statements_are_prepared_once_per_connection(channel_id):
+    async with InstrumentedDatabase(
+        DATABASE_URL, force_rollback=True, init=prepare_statements
+    ) as db:
+        prepared_statements = "SELECT statement FROM pg_prepared_statements"
+        prepared = {row[0] for row in await db.fetch_all(prepared_statements)}
+        assert {s.positional_sql for s in statements.values()} <= prepared
+
+        start_command("init next", channel_id)
+        await initiative.create_initiative(channel_id, database=db)
+        await initiative.add_participant(channel_id, "Alice", 15, database=db)
+        await initiative.add_participant(channel_id, "Bob", 10, database=db)
+        tracker = await initiative.next_participant(channel_id, database=db)
+        stats = finish_command()
+
+        assert tracker.current_participant.name == "Bob"
+        assert stats.queries == 4
+        # only the statement that creates trackers, which isn't a hot one, was new
+        after = {row[0] for row in await db.fetch_all(prepared_statements)}
+        assert len(after - prepared) == 1
+
+
+@pytest.mark.asyncio
+async def test_hot_statements_stay_prepared_after_the_connection_is_given_back():
+    async with InstrumentedDatabase(
+        DATABASE_URL, min_size=1, max_size=1, init=prepare_statements
+    ) as db:
+        prepared_statements = "SELECT statement FROM pg_prepared_statements"
+        prepared = {row[0] for row in await db.fetch_all(prepared_statements)}
+
+        get_initiative = statements["get_initiative"]
+        for _ in range(3):
+            # each call takes the one pooled connection and gives it back
+            assert await db.fetch_prepared(get_initiative, {"channel_id": "none"}) is None
+
+        after = {row[0] for row in await db.fetch_all(prepared_statements)}
+        assert after == prepared
@@ -0,0 +1,203 @@
+import pytest
+from databases import Database
+
+from app.constants import DATABASE_URL
+from app.controllers import initiative
+from app.controllers.cache import TrackerCache
+from app.controllers.tracker import Participant
+from app.errors import NotFoundError, NothingToUndoError, UndoUnsupportedError
+from app.storage import EventStorage, MemoryStorage, create_storage, events, postgres
+
+PARTY = [Participant("Alice", 15), Participant("Bob", 10), Participant("Charlie", 5)]
+PARTY_STATE = [("Alice", 15), ("Bob", 10), ("Charlie", 5)]
+
+
+def state(tracker) -> tuple:
+    """The parts of a tracker a player sees."""
+    return (
+        tracker.current_round,
+        tracker.current_participant and tracker.current_participant.name,
+        [(p.name, p.initiative) for p in tracker.participants],
+    )
+
+
+@pytest.mark.asyncio
+async def test_undoes_and_redoes_any_kind_of_change(channel_id):
+    async with Database(DATABASE_URL, force_rollback=True) as db:
+        storage = EventStorage(db)
+        await storage.create_tracker(channel_id, 1)
+        await storage.add_participants(channel_id, PARTY)
+        goto = await storage.goto_participant(channel_id, "Charlie")
+        update = await storage.update_participant(channel_id, "Bob", 20, 0)
+        remove = await storage.remove_participant(channel_id, "Charlie")
+
+        tracker = await storage.undo(channel_id, 1)
+        assert state(tracker) == state(update)
+        tracker = await storage.undo(channel_id, 2)
+        assert state(tracker) == (1, "Alice", PARTY_STATE)
+
+        tracker = await storage.redo(channel_id, 1)
+        assert state(tracker) == state(goto)
+        tracker = await storage.redo(channel_id, 2)
+        assert state(tracker) == state(remove)
+        with pytest.raises(NothingToUndoError):
+            await storage.redo(channel_id, 1)
+
+        # and what is read back is what undoing left
+        assert state(await storage.get_tracker(channel_id)) == state(remove)
+
+
+@pytest.mark.asyncio
+async def test_undoes_starting_and_ending_trackers(channel_id):
+    async with Database(DATABASE_URL, force_rollback=True) as db:
+        storage = EventStorage(db)
+        await storage.create_tracker(channel_id, 1)
+        added = await storage.add_participants(channel_id, PARTY)
+        await storage.delete_tracker(channel_id)
+
+        tracker = await storage.undo(channel_id, 1)
+        assert state(tracker) == state(added)
+
+        assert await storage.undo(channel_id, 2) is None
+        with pytest.raises(NotFoundError):
+            await storage.get_tracker(channel_id)
+        with pytest.raises(NothingToUndoError):
+            await storage.undo(channel_id, 1)
+
+        tracker = await storage.redo(channel_id, 2)
+        assert state(tracker) == state(added)
+
+
+@pytest.mark.asyncio
+async def test_a_new_change_cannot_be_redone_past(channel_id):
+    async with Database(DATABASE_URL, force_rollback=True) as db:
+        storage = EventStorage(db)
+        await storage.create_tracker(channel_id, 1)
+        await storage.add_participants(channel_id, PARTY)
+        await storage.move(channel_id, 2)
+        await storage.undo(channel_id, 1)
+
+        tracker = await storage.move(channel_id, 1)
+        assert tracker.current_participant.name == "Bob"
+        with pytest.raises(NothingToUndoError):
+            await storage.redo(channel_id, 1)
+
+
+@pytest.mark.asyncio
+async def test_pinning_a_tracker_is_not_undone(channel_id):
+    async with Database(DATABASE_URL, force_rollback=True) as db:
+        storage = EventStorage(db)
+        await storage.create_tracker(channel_id, 1)
+        await storage.add_participants(channel_id, PARTY)
+        await storage.set_message(channel_id, "42")
+
+        tracker = await storage.undo(channel_id, 1)
+        assert tracker.participants == ()
+        assert tracker.message_id == "42"
+
+
+@pytest.mark.asyncio
+async def test_trackers_are_rebuilt_from_a_snapshot_and_the_events_after_it(channel_id):
+    async with Database(DATABASE_URL, force_rollback=True) as db:
+        storage = EventStorage(db, snapshot_interval=3)
+        await storage.create_tracker(channel_id, 1)
+        await storage.add_participants(channel_id, PARTY)
+        await storage.move(channel_id, 4)
+        await storage.remove_participant(channel_id, "Bob")
+        await storage.undo(channel_id, 1)
+        await storage.add_participants(channel_id, [Participant("Dana", 12)])
+        last = await storage.move(channel_id, 1)
+
+        snapshot = await db.fetch_one(
+            "SELECT seq FROM initiative_snapshots WHERE channel_id = :channel_id",
+            {"channel_id": channel_id},
+        )
+        assert snapshot["seq"] == 6
+
+        # another process, with nothing cached, sees the same tracker and history
+        fresh = EventStorage(db, snapshot_interval=3)
+        assert state(await fresh.get_tracker(channel_id)) == state(last)
+        assert (await fresh.get_tracker(channel_id)).id == last.id
+        tracker = await fresh.undo(channel_id, 3)
+        assert state(tracker) == (1, "Alice", PARTY_STATE)
+
+        tracker = await storage.redo(channel_id, 1)
+        assert state(tracker) == (2, "Bob", PARTY_STATE)
+
+
+@pytest.mark.asyncio
+async def test_a_failed_snapshot_does_not_fail_the_write(channel_id, monkeypatch):
+    def encode(history):
+        raise RuntimeError("no room for the snapshot")
+
+    monkeypatch.setattr(events, "_encode", encode)
+    async with Database(DATABASE_URL, force_rollback=True) as db:
+        storage = EventStorage(db, snapshot_interval=2)
+        await storage.create_tracker(channel_id, 1)
+        tracker = await storage.add_participants(channel_id, PARTY)
+
+        # and the tracker is rebuilt from its events alone
+        fresh = EventStorage(db, snapshot_interval=2)
+        assert state(await fresh.get_tracker(channel_id)) == state(tracker)
+
+
+@pytest.mark.asyncio
+async def test_writers_that_fall_behind_catch_up(channel_id):
+    async with Database(DATABASE_URL, force_rollback=True) as db:
+        first, second = EventStorage(db), EventStorage(db)
+        await first.create_tracker(channel_id, 1)
+        await second.add_participants(channel_id, [Participant("Alice", 15)])
+        conflicts = postgres.write_conflicts.value(operation="add")
+
+        # the first only knows of the tracker it created, so numbers its event the same
+        # as the second's, and has to read the tracker again
+        tracker = await first.add_participants(channel_id, [Participant("Bob", 10)])
+        assert [p.name for p in tracker.participants] == ["Alice", "Bob"]
+        assert postgres.write_conflicts.value(operation="add") == conflicts + 1
+
+        # or finds a participant it hasn't heard of yet
+        await second.add_participants(channel_id, [Participant("Charlie", 5)])
+        tracker = await first.goto_participant(channel_id, "Charlie")
+        assert tracker.current_participant.name == "Charlie"
+
+
+@pytest.mark.asyncio
+async def test_controllers_undo_through_the_cache(channel_id):
+    async with Database(DATABASE_URL, force_rollback=True) as db:
+        storage, cache = EventStorage(db), TrackerCache()
+        await initiative.create_initiative(channel_id, database=storage, cache=cache)
+        await initiative.add_participants(
+            channel_id, PARTY, database=storage, cache=cache
+        )
+
+        tracker = await initiative.undo(channel_id, database=storage, cache=cache)
+        assert cache.get(channel_id) is tracker
+        assert await initiative.undo(channel_id, database=storage, cache=cache) is None
+        assert cache.get(channel_id) is None
+
+        with pytest.raises(ValueError):
+            await initiative.redo(channel_id, 0, database=storage, cache=cache)
+
+
+@pytest.mark.asyncio
+async def test_only_storages_keeping_histories_undo(channel_id):
+    storage = MemoryStorage()
+    await storage.create_tracker(channel_id, 1)
+    with pytest.raises(UndoUnsupportedError):
+        await storage.undo(channel_id, 1)
+    with pytest.raises(UndoUnsupportedError):
+        await storage.redo(channel_id, 1)
+
+
+@pytest.mark.asyncio
+async def test_connects_as_the_configured_storage():
+    # as app.main connects the storage STORAGE_BACKEND names
+    storage = create_storage("events")
+    await storage.connect()
+    try:
+        assert storage.is_connected
+        with pytest.raises(NotFoundError):
+            await storage.get_tracker("never-started")
+    finally:
+        await storage.disconnect()
+    assert not storage.is_connected
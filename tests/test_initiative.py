@@ -1,9 +1,14 @@
+import asyncio
+
 import pytest
 from databases import Database
 
 from app.constants import DATABASE_URL
 from app.controllers import initiative
-from app.errors import AlreadyExistsError, BacktrackError, NotFoundError
+from app.controllers.cache import TrackerCache, tracker_cache
+from app.errors import AlreadyExistsError, BacktrackError, ConflictError, NotFoundError
+from app.storage import postgres
+from tests.helpers import CountingDatabase
 
 
 # NOTE: doing the inefficient thing and creating a new Database object for each test
@@ -66,6 +71,13 @@ async def test_delete_initiative_deletes_an_initiative(channel_id):
         assert db_entry is None
 
 
+@pytest.mark.asyncio
+async def test_delete_initiative_errors_if_no_initiative(channel_id):
+    async with Database(DATABASE_URL, force_rollback=True) as db:
+        with pytest.raises(NotFoundError):
+            await initiative.delete_initiative(channel_id, database=db)
+
+
 @pytest.mark.asyncio
 async def test_add_participant_adds_a_participant(channel_id):
     async with Database(DATABASE_URL, force_rollback=True) as db:
@@ -88,7 +100,7 @@ async def test_add_participant_adds_a_participant(channel_id):
             initiative.Participant("Bob", 10),
         )
         db_entry = await db.fetch_all(
-            "SELECT * FROM initiative_members WHERE initiative_id = :initiative_id",
+            "SELECT * FROM initiative_members WHERE initiative_id = :initiative_id ORDER BY id",
             {"initiative_id": tracker.id},
         )
         assert len(db_entry) == 2
@@ -117,6 +129,55 @@ async def test_add_participant_errors_on_duplicate(channel_id):
             await initiative.add_participant(channel_id, "Bob", 10, database=db)
 
 
+@pytest.mark.asyncio
+async def test_add_participants_adds_many_participants_at_once(channel_id):
+    async with CountingDatabase(DATABASE_URL, force_rollback=True) as db:
+        await initiative.create_initiative(channel_id, database=db)
+        await initiative.add_participant(channel_id, "Bob", 10, database=db)
+
+        db.statements = 0
+        tracker = await initiative.add_participants(
+            channel_id,
+            [
+                initiative.Participant("Alice", 15),
+                initiative.Participant("Charlie", 5),
+                initiative.Participant("Deborah", 10, tiebreaker=1),
+                initiative.Participant("Eve", 10),
+            ],
+            database=db,
+        )
+        assert db.statements == 1
+        assert tracker.participants == (
+            initiative.Participant("Alice", 15),
+            initiative.Participant("Deborah", 10, tiebreaker=1),
+            initiative.Participant("Bob", 10),
+            initiative.Participant("Eve", 10),
+            initiative.Participant("Charlie", 5),
+        )
+        assert [p.name for p in tracker.participants] == [
+            "Alice",
+            "Deborah",
+            "Bob",
+            "Eve",
+            "Charlie",
+        ]
+        assert tracker.current_participant.name == "Bob"
+
+
+@pytest.mark.asyncio
+async def test_add_participants_adds_nobody_if_anyone_already_exists(channel_id):
+    async with Database(DATABASE_URL, force_rollback=True) as db:
+        await initiative.create_initiative(channel_id, database=db)
+        await initiative.add_participant(channel_id, "Bob", 10, database=db)
+
+        with pytest.raises(AlreadyExistsError):
+            await initiative.add_participants(
+                channel_id,
+                [initiative.Participant("Alice", 15), initiative.Participant("Bob", 5)],
+                database=db,
+            )
+
+
 @pytest.mark.asyncio
 async def test_participant_order_is_correct(channel_id):
     async with Database(DATABASE_URL, force_rollback=True) as db:
@@ -171,7 +232,6 @@ async def test_remove_participant_removes_a_participant(channel_id):
         assert len(db_entry) == 0
 
 
-@pytest.mark.skip(reason="Still thinking of a good way to do this")
 @pytest.mark.asyncio
 async def test_remove_participant_errors_if_not_present(channel_id):
     async with Database(DATABASE_URL, force_rollback=True) as db:
@@ -208,7 +268,6 @@ async def test_update_participant_updates_an_initiative(channel_id):
         assert db_entry[0]["tiebreaker"] == 2
 
 
-@pytest.mark.skip(reason="Still thinking of a good way to do this")
 @pytest.mark.asyncio
 async def test_update_participant_errors_if_not_present(channel_id):
     async with Database(DATABASE_URL, force_rollback=True) as db:
@@ -236,6 +295,69 @@ async def test_current_participant_does_not_change_when_participants_are_added(
         assert tracker.current_participant == initiative.Participant("Bob", 10)
 
 
+@pytest.mark.asyncio
+async def test_current_participant_does_not_change_when_participants_change_places(
+    channel_id,
+):
+    async with Database(DATABASE_URL, force_rollback=True) as db:
+        await initiative.create_initiative(channel_id, database=db)
+        for name, value in (("Alice", 15), ("Bob", 10), ("Charlie", 5)):
+            await initiative.add_participant(channel_id, name, value, database=db)
+        await initiative.next_participant(channel_id, database=db)
+
+        tracker = await initiative.update_participant(channel_id, "Bob", 20, database=db)
+        assert tracker.current_participant.name == "Bob"
+        assert tracker.current_index == 0
+
+        tracker = await initiative.update_participant(
+            channel_id, "Charlie", 25, database=db
+        )
+        assert tracker.current_participant.name == "Bob"
+        assert tracker.current_index == 1
+
+        tracker = await initiative.next_participant(channel_id, database=db)
+        assert tracker.current_participant.name == "Alice"
+
+
+@pytest.mark.asyncio
+async def test_removing_the_current_participant_passes_the_turn_on(channel_id):
+    async with Database(DATABASE_URL, force_rollback=True) as db:
+        await initiative.create_initiative(channel_id, database=db)
+        for name, value in (("Alice", 15), ("Bob", 10), ("Charlie", 5)):
+            await initiative.add_participant(channel_id, name, value, database=db)
+        await initiative.next_participant(channel_id, database=db)
+
+        tracker = await initiative.remove_participant(channel_id, "Bob", database=db)
+        assert tracker.current_participant.name == "Charlie"
+
+        tracker = await initiative.remove_participant(channel_id, "Charlie", database=db)
+        assert tracker.current_participant.name == "Alice"
+        assert tracker.current_round == 1
+
+        tracker = await initiative.remove_participant(channel_id, "Alice", database=db)
+        assert tracker.current_participant is None
+        assert tracker.current_member_id is None
+
+
+@pytest.mark.asyncio
+async def test_membership_changes_leave_the_tracker_alone(channel_id):
+    async with Database(DATABASE_URL, force_rollback=True) as db:
+        await initiative.create_initiative(channel_id, database=db)
+        tracker = await initiative.add_participant(channel_id, "Alice", 15, database=db)
+        # pointing the tracker at its first participant is the only write it needs
+        assert tracker.version == 1
+
+        await initiative.add_participant(channel_id, "Bob", 10, database=db)
+        await initiative.update_participant(channel_id, "Bob", 20, database=db)
+        tracker = await initiative.remove_participant(channel_id, "Bob", database=db)
+        assert tracker.version == 1
+
+        tracker_cache.clear()
+        tracker = await initiative.get_initiative(channel_id, database=db)
+        assert tracker.version == 1
+        assert tracker.current_participant.name == "Alice"
+
+
 @pytest.mark.asyncio
 async def test_next_participant_goes_to_the_next_participant(channel_id):
     async with Database(DATABASE_URL, force_rollback=True) as db:
@@ -303,6 +425,64 @@ async def test_previous_participant_goes_to_the_last_participant_when_at_the_beg
         assert tracker.current_participant == initiative.Participant("Alice", 15)
 
 
+@pytest.mark.asyncio
+async def test_next_participant_moves_several_steps_at_once(channel_id):
+    async with CountingDatabase(DATABASE_URL, force_rollback=True) as db:
+        await initiative.create_initiative(channel_id, database=db)
+        for name, value in (("Alice", 15), ("Bob", 10), ("Charlie", 5)):
+            await initiative.add_participant(channel_id, name, value, database=db)
+
+        db.statements = 0
+        tracker = await initiative.next_participant(channel_id, steps=7, database=db)
+        assert db.statements == 1
+        assert tracker.current_round == 3
+        assert tracker.current_participant == initiative.Participant("Bob", 10)
+
+        tracker = await initiative.previous_participant(channel_id, steps=4, database=db)
+        assert tracker.current_round == 2
+        assert tracker.current_participant == initiative.Participant("Alice", 15)
+
+        tracker = await initiative.previous_participant(channel_id, steps=2, database=db)
+        assert tracker.current_round == 1
+        assert tracker.current_participant == initiative.Participant("Bob", 10)
+
+        with pytest.raises(ValueError):
+            await initiative.next_participant(channel_id, steps=0, database=db)
+
+
+@pytest.mark.asyncio
+async def test_previous_participant_cannot_step_back_past_round_one(channel_id):
+    async with Database(DATABASE_URL, force_rollback=True) as db:
+        await initiative.create_initiative(channel_id, database=db)
+        for name, value in (("Alice", 15), ("Bob", 10), ("Charlie", 5)):
+            await initiative.add_participant(channel_id, name, value, database=db)
+        await initiative.next_participant(channel_id, steps=4, database=db)
+
+        with pytest.raises(BacktrackError):
+            await initiative.previous_participant(channel_id, steps=5, database=db)
+
+        tracker_cache.clear()
+        tracker = await initiative.get_initiative(channel_id, database=db)
+        assert tracker.current_round == 2
+        assert tracker.current_participant == initiative.Participant("Bob", 10)
+
+
+@pytest.mark.asyncio
+async def test_goto_round_goes_to_the_start_of_a_round(channel_id):
+    async with Database(DATABASE_URL, force_rollback=True) as db:
+        await initiative.create_initiative(channel_id, database=db)
+        for name, value in (("Alice", 15), ("Bob", 10), ("Charlie", 5)):
+            await initiative.add_participant(channel_id, name, value, database=db)
+        await initiative.next_participant(channel_id, database=db)
+
+        tracker = await initiative.goto_round(channel_id, 4, database=db)
+        assert tracker.current_round == 4
+        assert tracker.current_participant == initiative.Participant("Alice", 15)
+
+        with pytest.raises(BacktrackError):
+            await initiative.goto_round(channel_id, 0, database=db)
+
+
 @pytest.mark.asyncio
 async def test_goto_participant_goes_to_the_specified_participant(channel_id):
     async with Database(DATABASE_URL, force_rollback=True) as db:
@@ -362,3 +542,296 @@ async def test_next_participant_and_previous_participant_wrap_around(channel_id)
 
         with pytest.raises(BacktrackError):
             tracker = await initiative.previous_participant(channel_id, database=db)
+
+
+@pytest.mark.asyncio
+async def test_cached_tracker_matches_the_database(channel_id):
+    async with Database(DATABASE_URL, force_rollback=True) as db:
+        cache = TrackerCache()
+        await initiative.create_initiative(channel_id, database=db, cache=cache)
+        await initiative.add_participant(
+            channel_id, "Alice", 15, database=db, cache=cache
+        )
+        await initiative.add_participant(channel_id, "Bob", 10, database=db, cache=cache)
+        await initiative.next_participant(channel_id, database=db, cache=cache)
+        await initiative.add_participant(
+            channel_id, "Charlie", 12, database=db, cache=cache
+        )
+        await initiative.update_participant(
+            channel_id, "Alice", 5, database=db, cache=cache
+        )
+
+        cached = await initiative.get_initiative(channel_id, database=db, cache=cache)
+        assert cache.stats.misses == 0
+
+        cache.clear()
+        fresh = await initiative.get_initiative(channel_id, database=db, cache=cache)
+        assert cache.stats.misses == 1
+        assert cached == fresh
+        assert cached.participants == fresh.participants
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "command, args",
+    [
+        (initiative.add_participant, ("Deborah", 12)),
+        (initiative.remove_participant, ("Bob",)),
+        (initiative.update_participant, ("Bob", 20)),
+        (initiative.next_participant, ()),
+        (initiative.previous_participant, ()),
+        (initiative.goto_participant, ("Charlie",)),
+        (initiative.goto_round, (3,)),
+        (initiative.delete_initiative, ()),
+    ],
+)
+async def test_commands_issue_a_single_statement(channel_id, command, args):
+    async with CountingDatabase(DATABASE_URL, force_rollback=True) as db:
+        await initiative.create_initiative(channel_id, current_round=2, database=db)
+        for name, value in (("Alice", 15), ("Bob", 10), ("Charlie", 5)):
+            await initiative.add_participant(channel_id, name, value, database=db)
+
+        db.statements = 0
+        await command(channel_id, *args, database=db)
+        assert db.statements == 1
+
+
+@pytest.mark.asyncio
+async def test_get_initiative_only_reads_the_database_on_a_cache_miss(channel_id):
+    async with CountingDatabase(DATABASE_URL, force_rollback=True) as db:
+        await initiative.create_initiative(channel_id, database=db)
+        await initiative.add_participant(channel_id, "Alice", 15, database=db)
+
+        db.statements = 0
+        await initiative.get_initiative(channel_id, database=db)
+        assert db.statements == 0
+
+        tracker_cache.clear()
+        await initiative.get_initiative(channel_id, database=db)
+        assert db.statements == 1
+
+
+@pytest.mark.asyncio
+async def test_warm_cache_loads_the_trackers_in_play(channel_id):
+    async with Database(DATABASE_URL, force_rollback=True) as db:
+        for channel in (channel_id, "idle"):
+            await initiative.create_initiative(channel, database=db)
+            await initiative.add_participant(channel, "Alice", 15, database=db)
+            await initiative.add_participant(channel, "Bob", 10, database=db)
+        await db.execute(
+            "UPDATE initiative_trackers SET updated_at = now() - interval '1 day'"
+        )
+        tracker = await initiative.next_participant(channel_id, database=db)
+
+        cache = TrackerCache()
+        assert await initiative.warm_cache(6, database=db, cache=cache) >= 1
+        assert cache.get(channel_id) == tracker
+        assert cache.get(channel_id).current_participant.name == "Bob"
+        assert "idle" not in cache
+
+
+@pytest.mark.asyncio
+async def test_warm_cache_only_loads_the_channels_kept_and_not_yet_cached():
+    async with Database(DATABASE_URL, force_rollback=True) as db:
+        for channel in ("ours", "theirs", "cached"):
+            await initiative.create_initiative(channel, database=db)
+
+        cache = TrackerCache()
+        cache.put("cached", "fresh")
+        keep = lambda channel_id: channel_id != "theirs"
+        assert await initiative.warm_cache(6, database=db, cache=cache, keep=keep) >= 1
+        assert "ours" in cache
+        assert "theirs" not in cache
+        assert cache.get("cached") == "fresh"
+
+
+@pytest.mark.asyncio
+async def test_membership_changes_keep_a_tracker_in_play():
+    async with Database(DATABASE_URL, force_rollback=True) as db:
+        for channel in ("joined", "left", "changed", "idle"):
+            await initiative.create_initiative(channel, database=db)
+            await initiative.add_participant(channel, "Alice", 15, database=db)
+            await initiative.add_participant(channel, "Bob", 10, database=db)
+        await db.execute(
+            "UPDATE initiative_trackers SET updated_at = now() - interval '1 day'"
+        )
+        # none of which move the tracker's pointer
+        await initiative.add_participant("joined", "Carol", 5, database=db)
+        await initiative.remove_participant("left", "Bob", database=db)
+        await initiative.update_participant("changed", "Bob", 12, database=db)
+
+        cache = TrackerCache()
+        assert await initiative.warm_cache(6, database=db, cache=cache) >= 3
+        assert all(c in cache for c in ("joined", "left", "changed"))
+        assert "idle" not in cache
+
+
+@pytest.mark.asyncio
+async def test_set_message_pins_a_message_to_the_tracker(channel_id):
+    async with Database(DATABASE_URL, force_rollback=True) as db:
+        await initiative.create_initiative(channel_id, database=db)
+        await initiative.add_participant(channel_id, "Alice", 15, database=db)
+
+        await initiative.set_message(channel_id, 1234, database=db)
+        tracker = await initiative.get_initiative(channel_id, database=db)
+        assert tracker.message_id == "1234"
+        # and it comes back from writes too
+        tracker = await initiative.next_participant(channel_id, database=db)
+        assert tracker.message_id == "1234"
+
+        await initiative.set_message(channel_id, None, database=db)
+        tracker = await initiative.get_initiative(channel_id, database=db)
+        assert tracker.message_id is None
+
+        with pytest.raises(NotFoundError):
+            await initiative.set_message("nowhere", 1234, database=db)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_writers_do_not_lose_updates():
+    # this needs committed data, since each writer has its own connection
+    channel_id = "concurrent-writers"
+    async with Database(DATABASE_URL) as first, Database(DATABASE_URL) as second:
+        await initiative.create_initiative(channel_id, database=first)
+        try:
+            for name, value in (("Alice", 15), ("Bob", 10), ("Charlie", 5)):
+                await initiative.add_participant(channel_id, name, value, database=first)
+
+            async def press_next(db, times):
+                for _ in range(times):
+                    await initiative.next_participant(channel_id, database=db)
+
+            await asyncio.gather(press_next(first, 10), press_next(second, 10))
+
+            tracker_cache.clear()
+            tracker = await initiative.get_initiative(channel_id, database=first)
+            assert tracker.current_round == 7
+            assert tracker.current_index == 2
+            # one version for the first add, which points the tracker at Alice, and each next
+            assert tracker.version == 21
+        finally:
+            await initiative.delete_initiative(channel_id, database=first)
+
+
+class ConflictingDatabase:
+    """A database on which every write loses its compare-and-swap."""
+
+    async def fetch_one(self, query, values):
+        return {"conflict": True}
+
+
+@pytest.mark.asyncio
+async def test_writes_give_up_after_repeated_conflicts(channel_id):
+    conflicts = postgres.write_conflicts.value(operation="move_participant")
+    retries = postgres.write_retries.value(operation="move_participant")
+
+    with pytest.raises(ConflictError):
+        await initiative.next_participant(channel_id, database=ConflictingDatabase())
+
+    attempts = postgres.MAX_WRITE_ATTEMPTS
+    assert (
+        postgres.write_conflicts.value(operation="move_participant")
+        == conflicts + attempts
+    )
+    assert (
+        postgres.write_retries.value(operation="move_participant")
+        == retries + attempts - 1
+    )
+
+
+def test_tracker_finds_participants_by_name():
+    participants = tuple(
+        initiative.Participant(f"player {i}", 100 - i, id=i) for i in range(100)
+    )
+    tracker = initiative.InitiativeTracker(
+        1, "channel", 1, current_member_id=42, participants=participants
+    )
+
+    assert tracker.find_participant("player 7") is participants[7]
+    assert tracker.find_position("player 7") == 7
+    assert tracker.find_participant("nobody") is None
+    assert tracker.find_position("nobody") is None
+    assert tracker.current_index == 42
+
+
+def test_tracker_only_marks_the_current_participant():
+    # equal initiatives, so only the member id tells them apart
+    tracker = initiative.InitiativeTracker(
+        1,
+        "channel",
+        1,
+        current_member_id=2,
+        participants=(
+            initiative.Participant("Alice", 10, id=1),
+            initiative.Participant("Bob", 10, id=2),
+        ),
+    )
+
+    assert str(tracker).count("<==") == 1
+    assert "Bob  <==" in str(tracker)
+
+
+def test_big_trackers_are_rendered_around_the_current_participant():
+    participants = tuple(
+        initiative.Participant(f"player {i}", 1000 - i, id=i) for i in range(500)
+    )
+    tracker = initiative.InitiativeTracker(
+        1, "channel", 1, current_member_id=250, participants=participants
+    )
+
+    assert tracker.render() == str(tracker)
+    assert len(str(tracker)) > 2000
+    window = tracker.render(2000)
+    assert len(window) <= 2000
+    assert "player 250  <==" in window
+    assert "player 249 \n" in window and "player 251 \n" in window
+    assert window.startswith("Round 1\n Participants:\n ... ")
+    assert window.endswith(" more")
+
+
+@pytest.mark.asyncio
+async def test_moving_only_moves_the_marker(channel_id):
+    async with Database(DATABASE_URL, force_rollback=True) as db:
+        await initiative.create_initiative(channel_id, database=db)
+        await initiative.add_participant(channel_id, "Alice", 15, database=db)
+        await initiative.add_participant(channel_id, "Bob", 10, database=db)
+
+        first = await initiative.next_participant(channel_id, database=db)
+        second = await initiative.next_participant(channel_id, database=db)
+        # the members didn't change, so neither did what renders them
+        assert first.participants is second.participants
+        assert str(first) == "Round 1\n Participants:\n 15 (0): Alice \n10 (0): Bob  <=="
+        assert str(second) == "Round 2\n Participants:\n 15 (0): Alice  <==\n10 (0): Bob "
+
+
+def test_tracker_completes_names_by_prefix_ignoring_case():
+    names = ["alice", "Alfred", "Bob", "albert", "Alina", "Zed"]
+    participants = tuple(
+        initiative.Participant(name, 10, id=i) for i, name in enumerate(names)
+    )
+    tracker = initiative.InitiativeTracker(1, "channel", 1, participants=participants)
+
+    assert tracker.complete_name("al") == ["albert", "Alfred", "alice", "Alina"]
+    assert tracker.complete_name("ALI") == ["alice", "Alina"]
+    assert tracker.complete_name("al", limit=2) == ["albert", "Alfred"]
+    assert tracker.complete_name("") == sorted(names, key=str.casefold)
+    assert tracker.complete_name("x") == []
+
+
+@pytest.mark.asyncio
+async def test_participant_names_are_completed_from_the_cache(channel_id):
+    async with Database(DATABASE_URL, force_rollback=True) as db:
+        cache = TrackerCache()
+        assert initiative.complete_participant(channel_id, "", cache=cache) == []
+
+        options = {"database": db, "cache": cache}
+        await initiative.create_initiative(channel_id, **options)
+        for name, value in (("Alice", 15), ("Albert", 10), ("Bob", 5)):
+            await initiative.add_participant(channel_id, name, value, **options)
+        assert initiative.complete_participant(channel_id, "al", cache=cache) == [
+            "Albert",
+            "Alice",
+        ]
+
+        await initiative.remove_participant(channel_id, "Albert", **options)
+        assert initiative.complete_participant(channel_id, "al", cache=cache) == ["Alice"]
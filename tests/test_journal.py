@@ -0,0 +1,242 @@
+import json
+
+import pytest
+from databases import Database
+
+from app.constants import DATABASE_URL
+from app.controllers.tracker import Participant
+from app.errors import JournalReplayError, NotFoundError
+from app.storage import JournalStorage, MemoryStorage, PostgresStorage
+from app.storage.journal import JournalEntry, dropped_changes, evicted_trackers
+
+PARTY = [Participant("Alice", 15), Participant("Bob", 10), Participant("Charlie", 5)]
+
+
+class CountingStorage(MemoryStorage):
+    """Counts the trackers read and moves made, and fails the first `failures` moves."""
+
+    def __init__(self, failures: int = 0):
+        super().__init__()
+        self.loads = 0
+        self.moves = 0
+        self.failures = failures
+
+    async def get_tracker(self, channel_id: str):
+        self.loads += 1
+        return await super().get_tracker(channel_id)
+
+    async def move(self, channel_id: str, steps: int):
+        self.moves += 1
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("database went away")
+        return await super().move(channel_id, steps)
+
+
+def journalled(path) -> list[JournalEntry]:
+    with open(path, encoding="utf-8") as journal:
+        return [JournalEntry.from_json(line) for line in journal]
+
+
+def turn(tracker) -> tuple:
+    return tracker.current_round, tracker.current_participant.name
+
+
+@pytest.mark.asyncio
+async def test_changes_are_journalled_then_written_behind(channel_id, tmp_path):
+    backing, path = MemoryStorage(), tmp_path / "trackers.journal"
+    storage = JournalStorage(backing, str(path), flush_interval=3600)
+    await storage.connect()
+    await storage.create_tracker(channel_id, 1)
+    await storage.add_participants(channel_id, PARTY)
+    tracker = await storage.move(channel_id, 1)
+
+    assert [e.operation for e in journalled(path)] == [
+        "create_tracker",
+        "add_participants",
+        "move",
+    ]
+    with pytest.raises(NotFoundError):
+        await backing.get_tracker(channel_id)
+
+    assert await storage.flush() == 3
+    assert turn(await backing.get_tracker(channel_id)) == turn(tracker) == (1, "Bob")
+    assert journalled(path) == []
+    await storage.disconnect()
+
+
+@pytest.mark.asyncio
+async def test_consecutive_moves_are_written_as_one(channel_id, tmp_path):
+    backing = CountingStorage()
+    storage = JournalStorage(backing, str(tmp_path / "trackers.journal"), 3600)
+    await storage.connect()
+    await storage.create_tracker(channel_id, 1)
+    await storage.add_participants(channel_id, PARTY)
+    for steps in (1, 1, 2, -1):
+        tracker = await storage.move(channel_id, steps)
+
+    await storage.flush()
+    assert backing.moves == 1
+    assert turn(await backing.get_tracker(channel_id)) == turn(tracker) == (2, "Alice")
+    await storage.disconnect()
+
+
+@pytest.mark.asyncio
+async def test_failed_writes_stay_journalled_and_are_retried(channel_id, tmp_path):
+    backing, path = CountingStorage(failures=1), tmp_path / "trackers.journal"
+    storage = JournalStorage(backing, str(path), flush_interval=3600)
+    await storage.connect()
+    await storage.create_tracker(channel_id, 1)
+    await storage.add_participants(channel_id, PARTY)
+    await storage.move(channel_id, 1)
+
+    assert await storage.flush() == 2
+    assert [e.operation for e in journalled(path)] == ["move"]
+
+    tracker = await storage.goto_participant(channel_id, "Charlie")
+    assert await storage.flush() == 2
+    assert turn(await backing.get_tracker(channel_id)) == turn(tracker)
+    assert journalled(path) == []
+    await storage.disconnect()
+
+
+@pytest.mark.asyncio
+async def test_flushed_trackers_are_dropped_from_memory_until_used_again(tmp_path):
+    now = [0.0]
+    backing = CountingStorage(failures=1)
+    storage = JournalStorage(
+        backing,
+        str(tmp_path / "trackers.journal"),
+        3600,
+        clock=lambda: now[0],
+        max_size=2,
+        ttl=60,
+    )
+    await storage.connect()
+    for channel_id in ("a", "b", "c"):
+        await storage.create_tracker(channel_id, 1)
+        await storage.add_participants(channel_id, PARTY)
+    evicted, loads = evicted_trackers.value(), backing.loads
+
+    # past the size, the tracker used least recently goes once it's flushed
+    await storage.flush()
+    assert evicted_trackers.value() == evicted + 1
+    await storage.get_tracker("c")
+    assert backing.loads == loads
+    assert turn(await storage.get_tracker("a")) == (1, "Alice")
+    assert backing.loads == loads + 1
+
+    # idle ones go too, but not while they have changes still to flush
+    await storage.move("b", 1)
+    now[0] += 61
+    await storage.flush()
+    assert evicted_trackers.value() == evicted + 3
+    await storage.flush()
+    assert evicted_trackers.value() == evicted + 4
+    assert turn(await storage.get_tracker("b")) == (1, "Bob")
+    assert backing.loads == loads + 2
+    await storage.disconnect()
+
+
+@pytest.mark.asyncio
+async def test_unflushed_changes_are_replayed_on_connecting(channel_id, tmp_path):
+    backing, path = MemoryStorage(), tmp_path / "trackers.journal"
+    entries = [
+        JournalEntry(1, channel_id, "create_tracker", (1,)),
+        JournalEntry(2, channel_id, "add_participants", ([["Alice", 15, 0]],)),
+        JournalEntry(3, "missing", "move", (1,)),
+    ]
+    # the process died part way through writing the last entry
+    path.write_text("".join(e.to_json() + "\n" for e in entries) + '[4,"', "utf-8")
+    dropped = dropped_changes.value()
+
+    storage = JournalStorage(backing, str(path), flush_interval=3600)
+    await storage.connect()
+    assert [p.name for p in (await backing.get_tracker(channel_id)).participants] == [
+        "Alice"
+    ]
+    assert dropped_changes.value() == dropped + 1
+    assert journalled(path) == []
+    # the refused move is kept for somebody to look into
+    assert journalled(f"{path}.refused") == [entries[2]]
+
+    # and what comes after is numbered after what was replayed
+    await storage.move(channel_id, 1)
+    assert [e.seq for e in journalled(path)] == [4]
+    await storage.disconnect()
+    assert journalled(path) == []
+
+
+@pytest.mark.asyncio
+async def test_changes_flushed_before_a_crash_are_not_replayed(channel_id, tmp_path):
+    path = tmp_path / "trackers.journal"
+    entries = [
+        JournalEntry(1, channel_id, "create_tracker", (1,)),
+        JournalEntry(2, channel_id, "add_participants", ([["Alice", 15, 0]],)),
+        JournalEntry(3, channel_id, "add_participants", ([["Bob", 10, 0]],)),
+        JournalEntry(4, channel_id, "move", (1,)),
+        JournalEntry(5, channel_id, "move", (1,)),
+    ]
+    path.write_text("".join(e.to_json() + "\n" for e in entries), "utf-8")
+    async with Database(DATABASE_URL, force_rollback=True) as db:
+        backing = PostgresStorage(db)
+        # the process died after flushing the first four, before cutting the journal
+        await backing.create_tracker(channel_id, 1)
+        await backing.add_participants(channel_id, [Participant("Alice", 15)])
+        await backing.add_participants(channel_id, [Participant("Bob", 10)])
+        await backing.move(channel_id, 1)
+        (tmp_path / "trackers.journal.flushed").write_text(
+            "".join(json.dumps([channel_id, seq]) + "\n" for seq in range(1, 5)),
+            "utf-8",
+        )
+
+        storage = JournalStorage(backing, str(path), flush_interval=3600)
+        await storage.connect()
+        tracker = await backing.get_tracker(channel_id)
+        assert [p.name for p in tracker.participants] == ["Alice", "Bob"]
+        assert turn(tracker) == (2, "Alice")
+        assert journalled(path) == []
+
+        # and what comes after is numbered after what was flushed
+        await storage.move(channel_id, 1)
+        assert [e.seq for e in journalled(path)] == [6]
+        await storage.flush()
+        assert turn(await backing.get_tracker(channel_id)) == (2, "Bob")
+        await storage.disconnect()
+
+
+@pytest.mark.asyncio
+async def test_gives_up_on_a_journal_it_cannot_replay(channel_id, tmp_path):
+    backing, path = CountingStorage(failures=10), tmp_path / "trackers.journal"
+    await backing.create_tracker(channel_id, 1)
+    path.write_text(JournalEntry(1, channel_id, "move", (1,)).to_json() + "\n", "utf-8")
+
+    storage = JournalStorage(backing, str(path), 0.001, replay_attempts=3)
+    with pytest.raises(JournalReplayError):
+        await storage.connect()
+    assert backing.moves == 3
+    assert journalled(path) == [JournalEntry(1, channel_id, "move", (1,))]
+
+
+@pytest.mark.asyncio
+async def test_reads_and_deletes_trackers_only_the_backing_storage_has(
+    channel_id, tmp_path
+):
+    backing = MemoryStorage()
+    await backing.create_tracker(channel_id, 1)
+    await backing.add_participants(channel_id, PARTY)
+    storage = JournalStorage(backing, str(tmp_path / "trackers.journal"), 3600)
+    await storage.connect()
+
+    tracker = await storage.add_participants(channel_id, [Participant("Dana", 1)])
+    assert len({p.id for p in tracker.participants}) == 4
+
+    # the backing storage still has it until the deletion is flushed
+    await storage.delete_tracker(channel_id)
+    with pytest.raises(NotFoundError):
+        await storage.get_tracker(channel_id)
+    assert [t async for t in storage.recent_trackers(1, 10)] == []
+
+    await storage.disconnect()
+    with pytest.raises(NotFoundError):
+        await backing.get_tracker(channel_id)
@@ -0,0 +1,103 @@
+import asyncio
+import socket
+import sys
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from app.bot.setup import shard_of
+from app.launcher import Supervisor, assign_shards, worker_restarts
+
+
+def unused_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_shares_shards_out_evenly():
+    assert assign_shards(6, 4) == [[0], [1, 2], [3], [4, 5]]
+    assert assign_shards(3, 1) == [[0, 1, 2]]
+    assert len(Supervisor(shard_count=2, worker_count=8).workers) == 2
+
+
+def test_refuses_to_share_sqlite_between_workers():
+    with pytest.raises(ValueError):
+        Supervisor(2, 2, storage_backend="sqlite")
+    assert len(Supervisor(2, 1, storage_backend="sqlite").workers) == 1
+
+
+def test_guilds_are_on_the_shard_discord_sends_them_down():
+    # by the guild id's timestamp, above its lowest 22 bits
+    assert shard_of(5 << 22, 4) == 1
+    assert shard_of((6 << 22) - 1, 4) == 1
+    assert shard_of(6 << 22, 4) == 2
+
+
+@pytest.mark.asyncio
+async def test_restarts_workers_that_exit(caplog):
+    # each worker exits with how many shards it was given
+    command = (
+        sys.executable,
+        "-c",
+        "import os, sys; sys.exit(len(os.environ['SHARD_IDS'].split(',')))",
+    )
+    supervisor = Supervisor(4, 2, command=command, backoff=0.001, max_backoff=0.001)
+    restarts = worker_restarts.value(worker=1)
+    task = asyncio.create_task(supervisor.run())
+    for _ in range(500):
+        if worker_restarts.value(worker=1) >= restarts + 2:
+            break
+        await asyncio.sleep(0.01)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert worker_restarts.value(worker=1) >= restarts + 2
+    assert "Worker 1 exited with 2" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_stops_its_workers_when_cancelled():
+    command = (sys.executable, "-c", "import time; time.sleep(60)")
+    supervisor = Supervisor(2, 2, command=command)
+    task = asyncio.create_task(supervisor.run())
+    for _ in range(500):
+        if all(w.running for w in supervisor.workers):
+            break
+        await asyncio.sleep(0.01)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert not any(w.running for w in supervisor.workers)
+
+
+@pytest.mark.asyncio
+async def test_serves_every_workers_health_and_metrics():
+    async def healthz(request):
+        return web.json_response({"discord": True, "database": True})
+
+    async def metrics(request):
+        return web.Response(text='# HELP up Up\n# TYPE up gauge\nup{shard="0"} 1\n')
+
+    worker = web.Application()
+    worker.add_routes([web.get("/healthz", healthz), web.get("/metrics", metrics)])
+    supervisor = Supervisor(2, 2)
+    async with TestServer(worker) as server:
+        supervisor.workers[0].port = server.port
+        # the second worker isn't running
+        supervisor.workers[1].port = unused_port()
+
+        async with TestClient(TestServer(supervisor.create_app())) as client:
+            response = await client.get("/healthz")
+            assert response.status == 503
+            assert await response.json() == {
+                "0": {"discord": True, "database": True},
+                "1": {"running": False},
+            }
+
+            text = await (await client.get("/metrics")).text()
+            assert 'up{worker="0",shard="0"} 1' in text
+            assert "# TYPE launcher_worker_restarts_total counter" in text
@@ -0,0 +1,127 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import asyncpg
+import pytest
+from databases import Database
+
+from app.constants import DATABASE_URL
+from app.controllers.cache import TrackerCache
+from app.controllers.tracker import Participant
+from app.database import own_backends
+from app.errors import NotFoundError
+from app.listener import CHANGES_CHANNEL, ChangeListener, missed_changes
+from app.storage import EventStorage, PostgresStorage
+
+
+@asynccontextmanager
+async def listening(**options):
+    """Yields a listening cache, a database it hears the writes of, and the listener."""
+    cache = TrackerCache()
+    listener = ChangeListener(cache=cache, **options)
+    task = asyncio.create_task(listener.run())
+    # notifications are only sent as writes commit, so these aren't rolled back
+    async with Database(DATABASE_URL) as db:
+        try:
+            await asyncio.wait_for(listener.listening.wait(), 5)
+            yield cache, db, listener
+        finally:
+            for channel_id in ("listened-1", "listened-2"):
+                try:
+                    await PostgresStorage(db).delete_tracker(channel_id)
+                except NotFoundError:
+                    pass
+            await db.execute(
+                "DELETE FROM initiative_events WHERE channel_id LIKE 'listened-%'"
+            )
+            task.cancel()
+
+
+async def dropped(cache: TrackerCache, channel_id: str) -> bool:
+    """Waits for a channel to be dropped from the cache, returning whether it was."""
+    for _ in range(100):
+        if channel_id not in cache:
+            return True
+        await asyncio.sleep(0.01)
+    return False
+
+
+@pytest.mark.asyncio
+async def test_trackers_changed_elsewhere_are_dropped_from_the_cache():
+    async with listening() as (cache, db, _):
+        storage = PostgresStorage(db)
+        cache.put("listened-1", "stale")
+        await storage.create_tracker("listened-1", 1)
+        assert await dropped(cache, "listened-1")
+
+        # members joining doesn't write the tracker itself
+        await storage.add_participants("listened-1", [Participant("Alice", 15)])
+        cache.put("listened-1", "stale")
+        await storage.add_participants("listened-1", [Participant("Bob", 10)])
+        assert await dropped(cache, "listened-1")
+
+        cache.put("listened-1", "stale")
+        await storage.delete_tracker("listened-1")
+        assert await dropped(cache, "listened-1")
+
+        cache.put("listened-2", "stale")
+        await EventStorage(db).create_tracker("listened-2", 1)
+        assert await dropped(cache, "listened-2")
+
+
+@pytest.mark.asyncio
+async def test_changes_made_by_the_process_itself_are_ignored():
+    async with listening() as (cache, _, _):
+        cache.put("listened-1", "fresh")
+        cache.put("listened-2", "stale")
+        own = await asyncpg.connect(DATABASE_URL)
+        other = await asyncpg.connect(DATABASE_URL)
+        own_backends.add(own.get_server_pid())
+        try:
+            await own.execute(f"NOTIFY {CHANGES_CHANNEL}, 'listened-1'")
+            await other.execute(f"NOTIFY {CHANGES_CHANNEL}, 'listened-2'")
+        finally:
+            own_backends.discard(own.get_server_pid())
+            await own.close()
+            await other.close()
+
+        # notifications arrive in the order they were sent
+        assert await dropped(cache, "listened-2")
+        assert cache.peek("listened-1") == "fresh"
+
+
+@pytest.mark.asyncio
+async def test_trackers_changed_while_nobody_listened_are_dropped_on_listening_again():
+    options = {"interval": 0.01, "backoff": 0.01, "max_backoff": 0.05}
+    async with listening(**options) as (cache, db, listener):
+        storage = PostgresStorage(db)
+        await storage.create_tracker("listened-1", 1)
+        await storage.create_tracker("listened-2", 1)
+        await db.execute(
+            "UPDATE initiative_trackers SET updated_at = now() - interval '1 hour' "
+            "WHERE channel_id LIKE 'listened-%'"
+        )
+        # notifications arrive in order, so those of the writes above have been heard
+        cache.put("listened-sync", "stale")
+        await db.execute(f"NOTIFY {CHANGES_CHANNEL}, 'listened-sync'")
+        assert await dropped(cache, "listened-sync")
+        for channel_id in ("listened-1", "listened-2", "listened-gone"):
+            cache.put(channel_id, "cached")
+        missed = missed_changes.value()
+
+        # the listener can't listen again until it's given its database back
+        listener.url = "postgresql://nobody@127.0.0.1:1/nothing"
+        await db.execute(
+            "SELECT pg_terminate_backend(pid) FROM pg_stat_activity "
+            "WHERE application_name = 'custodian-listener'"
+        )
+        while listener.listening.is_set():
+            await asyncio.sleep(0.01)
+        await storage.add_participants("listened-2", [Participant("Alice", 15)])
+        listener.url = DATABASE_URL
+        await asyncio.wait_for(listener.listening.wait(), 5)
+
+        assert cache.peek("listened-1") == "cached"
+        assert "listened-2" not in cache
+        assert "listened-gone" not in cache
+        assert missed_changes.value() == missed + 2
@@ -0,0 +1,95 @@
+import pytest
+
+from app.metrics import Counter, Gauge, Histogram, Metric, merge, render
+
+
+def test_counter_counts_per_label_and_in_total():
+    registry = []
+    counter = Counter("things_total", "Things", registry=registry)
+    counter.inc(kind="a")
+    counter.inc(2, kind="b")
+    counter.inc(kind="a")
+
+    assert registry == [counter]
+    assert counter.value(kind="a") == 2
+    assert counter.value(kind="b") == 2
+    assert counter.value(kind="c") == 0
+    assert counter.value() == 4
+
+
+def test_metrics_must_say_how_to_sample_them():
+    registry = []
+    with pytest.raises(TypeError):
+        Metric("things", "Things", registry=registry)
+    assert registry == []
+
+
+def test_histogram_counts_observations_into_buckets():
+    histogram = Histogram("sizes", "Sizes", buckets=(1, 5, 10), registry=[])
+    for value in (0.5, 1, 3, 7, 50):
+        histogram.observe(value, kind="a")
+    histogram.observe(2, kind="b")
+
+    assert histogram.count(kind="a") == 5
+    assert histogram.sum(kind="a") == 61.5
+    # cumulative, and an observation on a bound counts towards that bound
+    assert histogram.bucket_counts(kind="a") == [2, 3, 4]
+    assert histogram.bucket_counts(kind="b") == [0, 1, 1]
+    assert histogram.count(kind="c") == 0
+    assert histogram.bucket_counts(kind="c") == [0, 0, 0]
+
+
+def test_gauges_can_be_set_or_read_from_a_function():
+    registry = []
+    gauge = Gauge("temperature", "Temperature", registry=registry)
+    gauge.set(3, room="a")
+    gauge.set(5, room="a")
+    live = Gauge("live", "Live", function=lambda: 7, registry=registry)
+
+    assert gauge.value(room="a") == 5
+    assert live.value() == 7
+
+
+def test_metrics_render_in_the_prometheus_text_format():
+    registry = []
+    Counter("things_total", "Things", registry=registry).inc(2, kind='say "hi"')
+    Gauge("latency_seconds", "Latency", function=lambda: float("nan"), registry=registry)
+    histogram = Histogram("sizes", "Sizes", buckets=(1, 5), registry=registry)
+    histogram.observe(3, kind="a")
+    histogram.observe(10, kind="a")
+
+    assert render(registry).splitlines() == [
+        "# HELP things_total Things",
+        "# TYPE things_total counter",
+        'things_total{kind="say \\"hi\\""} 2.0',
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds gauge",
+        "latency_seconds NaN",
+        "# HELP sizes Sizes",
+        "# TYPE sizes histogram",
+        'sizes_bucket{kind="a",le="1"} 0',
+        'sizes_bucket{kind="a",le="5"} 1',
+        'sizes_bucket{kind="a",le="+Inf"} 2',
+        'sizes_sum{kind="a"} 13.0',
+        'sizes_count{kind="a"} 2',
+    ]
+
+
+def test_merged_metrics_keep_each_metric_together_and_label_each_process():
+    expositions = {}
+    for process, count in (("0", 1), ("1", 2)):
+        registry = []
+        Counter("things_total", "Things", registry=registry).inc(count, kind="a")
+        Gauge("up", "Up", registry=registry).set(1)
+        expositions[process] = render(registry)
+
+    assert merge(expositions, "worker").splitlines() == [
+        "# HELP things_total Things",
+        "# TYPE things_total counter",
+        'things_total{worker="0",kind="a"} 1.0',
+        'things_total{worker="1",kind="a"} 2.0',
+        "# HELP up Up",
+        "# TYPE up gauge",
+        'up{worker="0"} 1',
+        'up{worker="1"} 1',
+    ]
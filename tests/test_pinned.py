@@ -0,0 +1,97 @@
+import asyncio
+from types import SimpleNamespace
+
+import discord
+import pytest
+
+from app.bot.pinned import PinnedTrackers
+from app.controllers import initiative
+from app.controllers.initiative import InitiativeTracker
+from app.errors import NotFoundError
+
+
+class FakeMessage:
+    """Records the edits made to it, each of which takes a while."""
+
+    def __init__(self):
+        self.edits = []
+
+    async def edit(self, content):
+        await asyncio.sleep(0.02)
+        self.edits.append(content)
+
+
+class GoneMessage:
+    """A message that was deleted."""
+
+    async def edit(self, content):
+        raise discord.NotFound(SimpleNamespace(status=404, reason="Not Found"), None)
+
+
+def tracker(channel_id: str, current_round: int) -> InitiativeTracker:
+    return InitiativeTracker(1, channel_id, current_round, message_id="42")
+
+
+@pytest.mark.asyncio
+async def test_a_burst_of_changes_is_one_edit_showing_the_last():
+    pinned = PinnedTrackers(delay=0.01)
+    message = FakeMessage()
+
+    for current_round in range(1, 6):
+        pinned.show(message, tracker("channel", current_round))
+    await asyncio.sleep(0.1)
+
+    assert message.edits == [str(tracker("channel", 5))]
+
+
+@pytest.mark.asyncio
+async def test_changes_made_during_an_edit_are_shown_by_the_next_one():
+    pinned = PinnedTrackers(delay=0.01)
+    message = FakeMessage()
+
+    pinned.show(message, tracker("channel", 1))
+    await asyncio.sleep(0.02)
+    # the first edit is being made
+    pinned.show(message, tracker("channel", 2))
+    pinned.show(message, tracker("channel", 3))
+    await asyncio.sleep(0.1)
+
+    assert message.edits == [str(tracker("channel", 1)), str(tracker("channel", 3))]
+
+
+@pytest.mark.asyncio
+async def test_channels_are_edited_independently():
+    pinned = PinnedTrackers(delay=0.01)
+    first, second = FakeMessage(), FakeMessage()
+
+    pinned.show(first, tracker("first", 1))
+    pinned.show(second, tracker("second", 2))
+    await asyncio.sleep(0.1)
+
+    assert first.edits == [str(tracker("first", 1))]
+    assert second.edits == [str(tracker("second", 2))]
+
+
+@pytest.mark.asyncio
+async def test_changes_to_an_ended_tracker_are_not_shown():
+    pinned = PinnedTrackers(delay=0.01)
+    message = FakeMessage()
+
+    pinned.show(message, tracker("channel", 1))
+    pinned.forget("channel")
+    await asyncio.sleep(0.1)
+
+    assert message.edits == []
+
+
+@pytest.mark.asyncio
+async def test_a_gone_message_of_an_ended_tracker_is_forgotten_quietly(monkeypatch):
+    async def set_message(channel_id, message_id):
+        raise NotFoundError("Initiative tracker not found")
+
+    monkeypatch.setattr(initiative, "set_message", set_message)
+    pinned = PinnedTrackers(delay=0.01)
+
+    pinned.show(GoneMessage(), tracker("channel", 1))
+    # raises if the editor failed
+    await pinned._editors["channel"]
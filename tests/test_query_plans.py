@@ -0,0 +1,112 @@
+import asyncio
+import json
+
+import pytest
+from databases import Database
+
+from app.constants import DATABASE_URL
+from app.storage import postgres
+
+# the plans asserted below are those of PostgreSQL 16, which docker-compose runs; before
+# 12, Postgres always materialized CTEs, so plans through them differed
+TRACKERS = 1_000
+MEMBERS_PER_TRACKER = 100
+
+HOT_QUERIES = {
+    "get_initiative": (postgres._GET_INITIATIVE, {}),
+    "add_participants": (
+        postgres._ADD_PARTICIPANTS,
+        {"entries": '[{"name": "Newcomer", "initiative": 10, "tiebreaker": 0}]'},
+    ),
+    "remove_participant": (postgres._REMOVE_PARTICIPANT, {"player_name": "player 50"}),
+    "update_participant": (
+        postgres._UPDATE_PARTICIPANT,
+        {"player_name": "player 50", "init_value": 10, "tiebreaker": 0},
+    ),
+    "next_participant": (postgres._NEXT_PARTICIPANT, {}),
+    "previous_participant": (postgres._PREVIOUS_PARTICIPANT, {}),
+    "move_participant": (postgres._MOVE_PARTICIPANT, {"steps": 3}),
+    "goto_participant": (postgres._GOTO_PARTICIPANT, {"target_name": "player 50"}),
+    "goto_round": (postgres._GOTO_ROUND, {"to_round": 3}),
+}
+
+
+async def seed():
+    """Commits 100k members, vacuumed like the long-lived rows of a real table."""
+    async with Database(DATABASE_URL) as db:
+        await db.execute("DELETE FROM initiative_trackers WHERE channel_id LIKE 'plan-%'")
+        await db.execute(
+            "INSERT INTO initiative_trackers (channel_id, current_round) "
+            "SELECT 'plan-' || i, 1 FROM generate_series(1, :trackers) i",
+            {"trackers": TRACKERS},
+        )
+        await db.execute(
+            "INSERT INTO initiative_members "
+            "(initiative_id, player_name, init_value, tiebreaker) "
+            "SELECT t.id, 'player ' || i, i % 30, i % 3 "
+            "FROM initiative_trackers t, generate_series(1, :members) i "
+            "WHERE t.channel_id LIKE 'plan-%' ORDER BY t.id, i",
+            {"members": MEMBERS_PER_TRACKER},
+        )
+        await db.execute("VACUUM ANALYZE initiative_trackers")
+        await db.execute("VACUUM ANALYZE initiative_members")
+
+
+async def unseed():
+    async with Database(DATABASE_URL) as db:
+        await db.execute("DELETE FROM initiative_trackers WHERE channel_id LIKE 'plan-%'")
+        await db.execute("VACUUM ANALYZE initiative_trackers")
+        await db.execute("VACUUM ANALYZE initiative_members")
+
+
+@pytest.fixture(scope="module", autouse=True)
+def seeded_trackers():
+    asyncio.run(seed())
+    yield
+    asyncio.run(unseed())
+
+
+def find_scans(plan: dict, node_type: str) -> list[str]:
+    """Returns the tables that a query plan reads with the given kind of scan."""
+    scans = []
+    if plan["Node Type"] == node_type:
+        scans.append(plan["Relation Name"])
+    for subplan in plan.get("Plans", []):
+        scans.extend(find_scans(subplan, node_type))
+    return scans
+
+
+def find_indexes(plan: dict) -> set[str]:
+    """Returns the indexes that a query plan reads."""
+    indexes = {plan["Index Name"]} if "Index Name" in plan else set()
+    for subplan in plan.get("Plans", []):
+        indexes |= find_indexes(subplan)
+    return indexes
+
+
+async def explain(query: str, values: dict) -> dict:
+    """Returns the plan of a query against the seeded table of 100k members."""
+    async with Database(DATABASE_URL) as db:
+        explained = await db.fetch_val(
+            f"EXPLAIN (FORMAT JSON) {query}", {"channel_id": "plan-500", **values}
+        )
+        return json.loads(explained)[0]["Plan"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("name", HOT_QUERIES)
+async def test_hot_queries_do_not_sequentially_scan(name):
+    query, values = HOT_QUERIES[name]
+    plan = await explain(query, values)
+    assert find_scans(plan, "Seq Scan") == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "name",
+    ["get_initiative", "next_participant", "previous_participant", "move_participant"],
+)
+async def test_member_lists_are_read_in_turn_order_from_the_index(name):
+    query, values = HOT_QUERIES[name]
+    plan = await explain(query, values)
+    assert "ix_initiative_members_turn_order" in find_indexes(plan)
@@ -0,0 +1,142 @@
+import asyncio
+
+import pytest
+from databases import Database
+
+from app.constants import DATABASE_URL
+from app.controllers import initiative
+from app.controllers.queue import ChannelQueue
+from app.database import current_command, finish_command, start_command
+from app.errors import BacktrackError
+
+
+class FakeMover:
+    """Records the moves it is asked to make, and fails ones that go back too far."""
+
+    def __init__(self, position: int = 0):
+        self.position = position
+        self.moves = []
+
+    async def __call__(self, channel_id, steps, **options):
+        await asyncio.sleep(0)
+        self.moves.append(steps)
+        if self.position + steps < 0:
+            raise BacktrackError("Cannot go back before round 1")
+        self.position += steps
+        return self.position
+
+
+@pytest.mark.asyncio
+async def test_commands_for_a_channel_run_one_at_a_time_in_order(channel_id):
+    queue = ChannelQueue()
+    running = []
+    finished = []
+
+    async def command(channel_id, name):
+        running.append(name)
+        assert len(running) == 1
+        await asyncio.sleep(0.01)
+        running.remove(name)
+        finished.append(name)
+        return name
+
+    results = await asyncio.gather(*(queue.run(channel_id, command, n) for n in range(5)))
+    assert results == [0, 1, 2, 3, 4]
+    assert finished == [0, 1, 2, 3, 4]
+
+
+@pytest.mark.asyncio
+async def test_queued_moves_are_merged_into_one(channel_id):
+    mover = FakeMover()
+    queue = ChannelQueue(mover=mover)
+
+    results = await asyncio.gather(*(queue.move(channel_id, 1) for _ in range(5)))
+    assert mover.moves == [5]
+    assert results == [5, None, None, None, None]
+    assert queue.merged == 4
+
+
+@pytest.mark.asyncio
+async def test_moves_in_different_directions_are_not_merged(channel_id):
+    mover = FakeMover(position=10)
+    queue = ChannelQueue(mover=mover)
+
+    await asyncio.gather(
+        queue.move(channel_id, 1),
+        queue.move(channel_id, 1),
+        queue.move(channel_id, -1),
+        queue.move(channel_id, 1),
+    )
+    assert mover.moves == [2, -1, 1]
+
+
+@pytest.mark.asyncio
+async def test_merged_moves_that_backtrack_too_far_are_retried_one_at_a_time(channel_id):
+    mover = FakeMover(position=1)
+    queue = ChannelQueue(mover=mover)
+
+    async def hold(channel_id):
+        await asyncio.sleep(0.01)
+
+    results = await asyncio.gather(
+        queue.run(channel_id, hold),
+        queue.move(channel_id, -1),
+        queue.move(channel_id, -1),
+        return_exceptions=True,
+    )
+    assert mover.moves == [-2, -1, -1]
+    assert results[1] == 0
+    assert isinstance(results[2], BacktrackError)
+
+
+@pytest.mark.asyncio
+async def test_errors_are_raised_to_the_caller(channel_id):
+    queue = ChannelQueue()
+
+    async def broken(channel_id):
+        raise ValueError("broken")
+
+    with pytest.raises(ValueError):
+        await queue.run(channel_id, broken)
+
+    # the queue keeps working afterwards
+    assert await queue.run(channel_id, lambda channel_id: asyncio.sleep(0, "ok")) == "ok"
+
+
+@pytest.mark.asyncio
+async def test_queued_commands_run_as_the_command_that_queued_them(channel_id):
+    queue = ChannelQueue()
+
+    async def command(channel_id):
+        await asyncio.sleep(0.01)
+        return current_command.get().command
+
+    async def invoke(name):
+        # each slash command is its own task, as it is when the bot runs it
+        start_command(name, channel_id)
+        try:
+            return await queue.run(channel_id, command)
+        finally:
+            finish_command()
+
+    results = await asyncio.gather(
+        asyncio.create_task(invoke("init next")), asyncio.create_task(invoke("init back"))
+    )
+    assert results == ["init next", "init back"]
+
+
+@pytest.mark.asyncio
+async def test_a_burst_of_nexts_is_one_database_write(channel_id):
+    async with Database(DATABASE_URL, force_rollback=True) as db:
+        queue = ChannelQueue()
+        await initiative.create_initiative(channel_id, database=db)
+        for name, value in (("Alice", 15), ("Bob", 10), ("Charlie", 5)):
+            await initiative.add_participant(channel_id, name, value, database=db)
+
+        results = await asyncio.gather(
+            *(queue.move(channel_id, 1, database=db) for _ in range(4))
+        )
+        tracker = results[0]
+        assert results[1:] == [None, None, None]
+        assert tracker.current_round == 2
+        assert tracker.current_participant == initiative.Participant("Bob", 10)
@@ -0,0 +1,34 @@
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+from app.database import finish_command, start_command
+from app.server import create_app
+
+
+@pytest.mark.asyncio
+async def test_metrics_are_served_in_the_prometheus_format(channel_id):
+    start_command("init next", channel_id)
+    finish_command()
+
+    async with TestClient(TestServer(create_app())) as client:
+        response = await client.get("/metrics")
+        assert response.status == 200
+        assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+        text = await response.text()
+
+    assert 'command_seconds_count{command="init next"}' in text
+    for name in (
+        "discord_gateway_latency_seconds",
+        "db_pool_connections_in_use",
+        "tracker_cache_hit_ratio",
+        "event_loop_lag_seconds",
+    ):
+        assert f"# TYPE {name} " in text
+
+
+@pytest.mark.asyncio
+async def test_health_check_fails_until_the_bot_is_ready():
+    async with TestClient(TestServer(create_app())) as client:
+        response = await client.get("/healthz")
+        assert response.status == 503
+        assert await response.json() == {"discord": False, "database": False}
@@ -0,0 +1,277 @@
+from contextlib import asynccontextmanager
+
+import pytest
+from databases import Database
+
+from app.constants import DATABASE_URL
+from app.controllers import initiative
+from app.controllers.cache import TrackerCache
+from app.controllers.tracker import Participant
+from app.errors import AlreadyExistsError, BacktrackError, NotFoundError
+from app.storage import (
+    EventStorage,
+    JournalStorage,
+    MemoryStorage,
+    PostgresStorage,
+    SQLiteStorage,
+)
+
+BACKENDS = [
+    "memory",
+    "sqlite",
+    "postgres",
+    "events",
+    "journal",
+]
+
+
+@asynccontextmanager
+async def connected(backend: str, tmp_path):
+    """Yields an empty storage of the given kind, or one whose writes are rolled back."""
+    if backend in ("postgres", "events"):
+        async with Database(DATABASE_URL, force_rollback=True) as db:
+            yield PostgresStorage(db) if backend == "postgres" else EventStorage(db)
+        return
+
+    if backend == "sqlite":
+        storage = SQLiteStorage(str(tmp_path / "trackers.sqlite3"))
+    elif backend == "journal":
+        storage = JournalStorage(MemoryStorage(), str(tmp_path / "trackers.journal"))
+    else:
+        storage = MemoryStorage()
+    await storage.connect()
+    try:
+        yield storage
+    finally:
+        await storage.disconnect()
+
+
+def names(tracker) -> list[str]:
+    return [p.name for p in tracker.participants]
+
+
+PARTY = [Participant("Alice", 15), Participant("Bob", 10), Participant("Charlie", 5)]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("backend", BACKENDS)
+async def test_creates_and_gets_trackers(backend, channel_id, tmp_path):
+    async with connected(backend, tmp_path) as storage:
+        created = await storage.create_tracker(channel_id, 2)
+        tracker = await storage.get_tracker(channel_id)
+        assert (tracker.id, tracker.current_round, tracker.participants) == (
+            created.id,
+            2,
+            (),
+        )
+
+        with pytest.raises(NotFoundError):
+            await storage.get_tracker("missing")
+        # last, as it aborts the transaction Postgres tests run in
+        with pytest.raises(AlreadyExistsError):
+            await storage.create_tracker(channel_id, 1)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("backend", BACKENDS)
+async def test_adds_participants_in_turn_order(backend, channel_id, tmp_path):
+    async with connected(backend, tmp_path) as storage:
+        await storage.create_tracker(channel_id, 1)
+        tracker = await storage.add_participants(
+            channel_id, [Participant("Bob", 10), Participant("Alice", 15, 1)]
+        )
+        assert names(tracker) == ["Alice", "Bob"]
+        assert tracker.current_participant.name == "Alice"
+        assert tracker.version == 1
+
+        # whoever is current stays current as others join ahead of them
+        tracker = await storage.add_participants(channel_id, [Participant("Dana", 20)])
+        assert names(tracker) == ["Dana", "Alice", "Bob"]
+        assert tracker.current_participant.name == "Alice"
+        assert tracker.version == 1
+
+        with pytest.raises(AlreadyExistsError):
+            await storage.add_participants(
+                channel_id, [Participant("Charlie", 5), Participant("Bob", 1)]
+            )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("backend", BACKENDS)
+async def test_removing_the_current_participant_passes_the_turn(
+    backend, channel_id, tmp_path
+):
+    async with connected(backend, tmp_path) as storage:
+        await storage.create_tracker(channel_id, 1)
+        await storage.add_participants(channel_id, PARTY)
+        await storage.goto_participant(channel_id, "Charlie")
+
+        tracker = await storage.remove_participant(channel_id, "Bob")
+        assert names(tracker) == ["Alice", "Charlie"]
+        assert tracker.current_participant.name == "Charlie"
+
+        tracker = await storage.remove_participant(channel_id, "Charlie")
+        assert tracker.current_participant.name == "Alice"
+
+        tracker = await storage.remove_participant(channel_id, "Alice")
+        assert tracker.participants == ()
+        assert tracker.current_member_id is None
+
+        with pytest.raises(NotFoundError):
+            await storage.remove_participant(channel_id, "Alice")
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("backend", BACKENDS)
+async def test_updating_a_participant_keeps_the_current_one(
+    backend, channel_id, tmp_path
+):
+    async with connected(backend, tmp_path) as storage:
+        await storage.create_tracker(channel_id, 1)
+        await storage.add_participants(channel_id, PARTY)
+        tracker = await storage.goto_participant(channel_id, "Bob")
+
+        updated = await storage.update_participant(channel_id, "Charlie", 20, 0)
+        assert names(updated) == ["Charlie", "Alice", "Bob"]
+        assert updated.current_participant.name == "Bob"
+        assert updated.version == tracker.version
+
+        with pytest.raises(NotFoundError):
+            await storage.update_participant(channel_id, "Dana", 1, 0)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("backend", BACKENDS)
+async def test_moves_between_participants_and_rounds(backend, channel_id, tmp_path):
+    async with connected(backend, tmp_path) as storage:
+        await storage.create_tracker(channel_id, 1)
+        # nothing to move through yet
+        tracker = await storage.move(channel_id, 1)
+        assert tracker.current_round == 1
+
+        await storage.add_participants(channel_id, PARTY)
+        tracker = await storage.move(channel_id, 1)
+        assert tracker.current_participant.name == "Bob"
+
+        tracker = await storage.move(channel_id, 5)
+        assert (tracker.current_round, tracker.current_participant.name) == (3, "Alice")
+
+        tracker = await storage.move(channel_id, -1)
+        assert (tracker.current_round, tracker.current_participant.name) == (2, "Charlie")
+
+        with pytest.raises(BacktrackError):
+            await storage.move(channel_id, -6)
+        tracker = await storage.get_tracker(channel_id)
+        assert (tracker.current_round, tracker.current_participant.name) == (2, "Charlie")
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("backend", BACKENDS)
+async def test_goes_to_participants_and_rounds(backend, channel_id, tmp_path):
+    async with connected(backend, tmp_path) as storage:
+        await storage.create_tracker(channel_id, 1)
+        await storage.add_participants(channel_id, PARTY)
+
+        tracker = await storage.goto_participant(channel_id, "Charlie")
+        assert tracker.current_participant.name == "Charlie"
+        with pytest.raises(NotFoundError):
+            await storage.goto_participant(channel_id, "Dana")
+
+        tracker = await storage.goto_round(channel_id, 4)
+        assert (tracker.current_round, tracker.current_participant.name) == (4, "Alice")
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("backend", BACKENDS)
+async def test_sets_messages_and_deletes_trackers(backend, channel_id, tmp_path):
+    async with connected(backend, tmp_path) as storage:
+        await storage.create_tracker(channel_id, 1)
+        await storage.add_participants(channel_id, PARTY)
+
+        await storage.set_message(channel_id, "42")
+        assert (await storage.get_tracker(channel_id)).message_id == "42"
+        await storage.set_message(channel_id, None)
+        assert (await storage.get_tracker(channel_id)).message_id is None
+
+        await storage.delete_tracker(channel_id)
+        with pytest.raises(NotFoundError):
+            await storage.get_tracker(channel_id)
+        with pytest.raises(NotFoundError):
+            await storage.delete_tracker(channel_id)
+        with pytest.raises(NotFoundError):
+            await storage.set_message(channel_id, "42")
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("backend", BACKENDS)
+async def test_lists_recently_written_trackers(backend, tmp_path):
+    async with connected(backend, tmp_path) as storage:
+        for channel in ("recent-1", "recent-2"):
+            await storage.create_tracker(channel, 1)
+            await storage.add_participants(channel, PARTY)
+
+        recent = {t.channel_id: t async for t in storage.recent_trackers(1, 1_000)}
+        expected = ["Alice", "Bob", "Charlie"]
+        assert names(recent["recent-1"]) == names(recent["recent-2"]) == expected
+        assert len([t async for t in storage.recent_trackers(1, 1)]) == 1
+
+
+@pytest.mark.asyncio
+# the others are written at the database's time, which can't be turned forward
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+async def test_membership_changes_count_as_writes(backend, tmp_path):
+    now = 0.0
+    storage = (
+        SQLiteStorage(str(tmp_path / "trackers.sqlite3"), clock=lambda: now)
+        if backend == "sqlite"
+        else MemoryStorage(clock=lambda: now)
+    )
+    await storage.connect()
+    try:
+        for channel in ("joined", "left", "changed", "idle"):
+            await storage.create_tracker(channel, 1)
+            await storage.add_participants(channel, PARTY)
+        now += 2 * 3600
+        await storage.add_participants("joined", [Participant("Dave", 1)])
+        await storage.remove_participant("left", "Charlie")
+        await storage.update_participant("changed", "Charlie", 12, 0)
+
+        recent = {t.channel_id async for t in storage.recent_trackers(1, 1_000)}
+        assert recent == {"joined", "left", "changed"}
+    finally:
+        await storage.disconnect()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("backend", BACKENDS)
+async def test_controllers_take_a_storage(backend, channel_id, tmp_path):
+    async with connected(backend, tmp_path) as storage:
+        cache = TrackerCache()
+        await initiative.create_initiative(channel_id, database=storage, cache=cache)
+        await initiative.add_participants(
+            channel_id, PARTY, database=storage, cache=cache
+        )
+        tracker = await initiative.next_participant(
+            channel_id, database=storage, cache=cache
+        )
+        assert tracker.current_participant.name == "Bob"
+        assert cache.get(channel_id) is tracker
+
+        tracker = await initiative.remove_participant(
+            channel_id, "Bob", database=storage, cache=cache
+        )
+        assert tracker.current_participant.name == "Charlie"
+        tracker = await initiative.previous_participant(
+            channel_id, database=storage, cache=cache
+        )
+        assert (tracker.current_round, tracker.current_participant.name) == (1, "Alice")
+        stored = await initiative.get_initiative(
+            channel_id, database=storage, cache=TrackerCache()
+        )
+        assert stored == tracker
+
+        await initiative.delete_initiative(channel_id, database=storage, cache=cache)
+        assert channel_id not in cache
+        # last, as it aborts the transaction Postgres tests run in
+        with pytest.raises(NotFoundError):
+            await initiative.get_initiative(channel_id, database=storage, cache=cache)